@@ -7,7 +7,10 @@ echo "
 "
 
 echo "[1/4] Removing application files..."
+sudo systemctl disable --now marthaba-helper.service 2>/dev/null
+sudo rm -f /etc/systemd/system/marthaba-helper.service
 sudo rm -rf /opt/marthaba
+sudo rm -f /usr/local/bin/marthaba
 
 echo "[2/4] Removing menu entry..."
 sudo rm -f /usr/share/applications/marthaba.desktop
@@ -16,6 +19,7 @@ echo "[3/4] Removing desktop shortcut..."
 rm -f ~/Desktop/MarThaba.desktop
 
 echo "[4/4] Cleaning up packages..."
+# Packages pulled in by older installers
 pip3 uninstall -y Pillow pycaw screen-brightness-control 2>/dev/null
 
 echo "
@@ -0,0 +1,801 @@
+#!/usr/bin/env python3
+"""Micro-benchmarks for MarThaba's headless core.
+
+Everything runs against temp files (marthaba.Paths / explicit paths), so no
+display or root is needed.
+
+Run: python3 bench_marthaba.py [name ...] [--json results.json] [--compare baseline.json]
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import marthaba
+
+
+def timed(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+def random_domain(rng):
+    labels = rng.randint(1, 3)
+    name = ".".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10)))
+                    for _ in range(labels))
+    return name + rng.choice([".com", ".net", ".org", ".io"])
+
+
+def sized(bench, sizes):
+    """Run `bench` once per size; results keyed by size"""
+    return {str(size): bench(size) for size in sizes}
+
+
+def bench_matcher(rule_count=100000, lookups=100000):
+    """DomainMatcher build time and lookup cost with `rule_count` rules"""
+    rng = random.Random(42)
+    rules = [random_domain(rng) for _ in range(rule_count)]
+    rules = [("*." + rule) if i % 4 == 0 else rule for i, rule in enumerate(rules)]
+
+    started = time.perf_counter()
+    matcher = marthaba.DomainMatcher(rules)
+    build = time.perf_counter() - started
+
+    hosts = []
+    for i in range(lookups):
+        if i % 2:
+            hosts.append(random_domain(rng))
+        else:
+            rule = rules[rng.randrange(rule_count)]
+            hosts.append("www." + rule[2:] if rule.startswith("*.") else rule)
+
+    started = time.perf_counter()
+    hits = sum(1 for host in hosts if matcher.matches(host))
+    elapsed = time.perf_counter() - started
+    return {
+        'rules': rule_count,
+        'build_s': round(build, 4),
+        'lookups': lookups,
+        'hits': hits,
+        'lookup_ns': round(elapsed / lookups * 1e9, 1)
+    }
+
+
+def bench_hosts(lines=10000, cycles=20):
+    """HostsEnforcer apply (write), apply (unchanged) and clear on a hosts file of `lines` lines"""
+    rng = random.Random(11)
+    tmp_dir = tempfile.mkdtemp(prefix="marthaba-bench-")
+    try:
+        path = os.path.join(tmp_dir, "hosts")
+        with open(path, 'w') as f:
+            f.write("127.0.0.1 localhost\n")
+            for i in range(lines - 1):
+                f.write(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255} {random_domain(rng)}\n")
+        enforcer = marthaba.HostsEnforcer(path)
+        allowed = ["m.youtube.com"]
+        apply_s = clear_s = 0.0
+        for _ in range(cycles):
+            started = time.perf_counter()
+            written = enforcer.apply(marthaba.DEFAULT_BLOCKED, allowed)
+            apply_s += time.perf_counter() - started
+            started = time.perf_counter()
+            enforcer.clear()
+            clear_s += time.perf_counter() - started
+        enforcer.apply(marthaba.DEFAULT_BLOCKED, allowed)
+        unchanged = timed(lambda: enforcer.apply(marthaba.DEFAULT_BLOCKED, allowed), cycles)
+        return {
+            'lines': lines,
+            'file_bytes': os.path.getsize(path),
+            'apply_ms': round(apply_s / cycles * 1000, 3),
+            'apply_unchanged_ms': round(unchanged * 1000, 3),
+            'clear_ms': round(clear_s / cycles * 1000, 3),
+            'apply_syscalls': written.syscalls,
+            'apply_bytes_written': written.bytes_written
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def bench_history_log(sessions=100000, appends=50):
+    """SessionLog with `sessions` records: tail(10) load, full scan and fsync'd append"""
+    tmp_dir = tempfile.mkdtemp(prefix="marthaba-bench-")
+    try:
+        path = os.path.join(tmp_dir, "history.jsonl")
+        start = datetime.datetime.now() - datetime.timedelta(minutes=sessions)
+        with open(path, 'w') as f:
+            for i in range(sessions):
+                stamp = (start + datetime.timedelta(minutes=i)).isoformat()
+                f.write(f'{{"start_time":"{stamp}","end_time":"{stamp}","duration":0.5,"sites":[]}}\n')
+        log = marthaba.SessionLog(path, max_bytes=1 << 40, max_age_days=100000, legacy_path=None)
+        tail = timed(lambda: log.tail(10, marthaba.is_session), 20)
+        started = time.perf_counter()
+        scanned = sum(1 for _ in log)
+        scan = time.perf_counter() - started
+        now = int(time.time())
+        record = marthaba.SessionRecord(now, now + 1800, sites=log.snapshots.put([]))
+        append = timed(lambda: log.append(record), appends)
+        return {
+            'sessions': scanned,
+            'file_bytes': os.path.getsize(path),
+            'tail10_ms': round(tail * 1000, 3),
+            'full_scan_s': round(scan, 3),
+            'append_ms': round(append * 1000, 3)
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def bench_history_format(sessions=100000, site_lists=20, sites=8):
+    """History records at `sessions`: ISO/inline-site lines vs epoch/snapshot lines, on disk and in memory"""
+    rng = random.Random(5)
+    lists = [[random_domain(rng) for _ in range(sites)] for _ in range(site_lists)]
+    start = int(time.time()) - sessions * 3600
+    tmp_dir = tempfile.mkdtemp(prefix="marthaba-bench-")
+    try:
+        legacy_path = os.path.join(tmp_dir, "legacy.jsonl")
+        with open(legacy_path, 'w') as f:
+            for i in range(sessions):
+                begin = datetime.datetime.fromtimestamp(start + i * 3600)
+                f.write(json.dumps({'start_time': begin.isoformat(),
+                                    'end_time': (begin + datetime.timedelta(minutes=50)).isoformat(),
+                                    'duration': 50 / 60, 'sites': lists[i % site_lists]},
+                                   separators=(',', ':')) + "\n")
+        log = marthaba.SessionLog(os.path.join(tmp_dir, "history.jsonl"), max_bytes=1 << 40,
+                                  max_age_days=100000, legacy_path=None)
+        ids = [log.snapshots.put(sites) for sites in lists]
+        with open(log.path, 'w') as f:
+            for i in range(sessions):
+                begin = start + i * 3600
+                f.write(marthaba.SessionRecord(begin, begin + 3000, sites=ids[i % site_lists]).to_json() + "\n")
+
+        # What a process holds when it keeps every record: the old dicts vs SessionRecords
+        tracemalloc.start()
+        with open(legacy_path, 'rb') as f:
+            legacy = [json.loads(line) for line in f]
+        legacy_bytes = tracemalloc.get_traced_memory()[0]
+        del legacy
+        tracemalloc.stop()
+        tracemalloc.start()
+        compact = list(log)
+        compact_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert len(compact) == sessions and log.snapshots.get(compact[-1].sites)
+        compact_file = os.path.getsize(log.path) + os.path.getsize(log.snapshots.path)
+        return {
+            'legacy_file_bytes': os.path.getsize(legacy_path),
+            'compact_file_bytes': compact_file,
+            'file_ratio': round(os.path.getsize(legacy_path) / compact_file, 1),
+            'legacy_memory_bytes': legacy_bytes,
+            'compact_memory_bytes': compact_bytes,
+            'memory_ratio': round(legacy_bytes / compact_bytes, 1)
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def bench_sqlite(sessions=100000, appends=50):
+    """SQLite storage: one-shot migration from JSONL, History tab paging and range queries, append"""
+    tmp_dir = tempfile.mkdtemp(prefix="marthaba-bench-")
+    try:
+        path = os.path.join(tmp_dir, "history.jsonl")
+        start = datetime.datetime.now() - datetime.timedelta(minutes=sessions)
+        with open(path, 'w') as f:
+            for i in range(sessions):
+                stamp = (start + datetime.timedelta(minutes=i)).isoformat()
+                f.write(f'{{"start_time":"{stamp}","end_time":"{stamp}","duration":0.5,"sites":[]}}\n')
+                if i % 2:
+                    f.write(f'{{"event":"end","start_time":"{stamp}","end_time":"{stamp}",'
+                            f'"planned":1800,"completed":true}}\n')
+        log = marthaba.SessionLog(path, max_bytes=1 << 40, max_age_days=100000, legacy_path=None)
+        database = marthaba.Database(os.path.join(tmp_dir, "marthaba.db"))
+        started = time.perf_counter()
+        database.migrate(None, log)
+        migrate = time.perf_counter() - started
+        history = marthaba.SqliteSessionLog(database)
+        count = len(history)
+        newest = timed(lambda: history.page(count - 6, count), 200)
+        middle = timed(lambda: history.page(count // 2, count // 2 + 6), 20)
+        day = (start + datetime.timedelta(minutes=sessions // 2)).timestamp()
+        between = timed(lambda: history.between(day, day + 86400), 20)
+        now = int(time.time())
+        record = marthaba.SessionRecord(now, now + 1800, sites=history.snapshots.put([]))
+        append = timed(lambda: history.append(record), appends)
+        database.close()
+        return {
+            'sessions': count,
+            'migrate_s': round(migrate, 3),
+            'db_bytes': os.path.getsize(database.path),
+            'page_newest_ms': round(newest * 1000, 3),
+            'page_middle_ms': round(middle * 1000, 3),
+            'between_day_ms': round(between * 1000, 3),
+            'append_ms': round(append * 1000, 3)
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def bench_config(saves=1000, sites=1000):
+    """ConfigStore: cost of save() on the UI thread, coalescing and a synchronous flush"""
+    tmp_dir = tempfile.mkdtemp(prefix="marthaba-bench-")
+    try:
+        store = marthaba.ConfigStore(os.path.join(tmp_dir, "config.json"), delay=0.05)
+        store.data['allowed_sites'] = [f"site{i}.example.com" for i in range(sites)]
+
+        def save():
+            store.data['counter'] = store.data.get('counter', 0) + 1
+            store.save()
+        save_call = timed(save, saves)
+        store.flush()
+        coalesced = store.writes
+        store.dirty = True
+        flush = timed(lambda: (setattr(store, 'dirty', True), store.flush()), 20)
+        return {
+            'saves': saves,
+            'save_call_us': round(save_call * 1e6, 2),
+            'writes_for_burst': coalesced,
+            'flush_ms': round(flush * 1000, 3),
+            'file_bytes': os.path.getsize(store.path)
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def bench_timer(ticks=100000):
+    """Per-tick cost of the countdown (texts + next tick) and of a scheduler wakeup"""
+    timer = marthaba.FocusTimer()
+    now = time.time()
+    timer.start(now, now + 3600)
+    tick = timed(lambda: (timer.texts(), timer.next_tick_ms()), ticks)
+
+    root = VirtualRoot()
+    scheduler = marthaba.FrameScheduler(root, clock=root.clock)
+    scheduler.add('timer', lambda: 1.0)
+    scheduler.add('logo', lambda: 1.5, slack=0.5, animation=True)
+    started = time.perf_counter()
+    root.run(ticks)
+    wakeup = (time.perf_counter() - started) / max(1, root.wakeups)
+    return {
+        'tick_us': round(tick * 1e6, 2),
+        'scheduler_wakeup_us': round(wakeup * 1e6, 2)
+    }
+
+
+def bench_metrics(calls=200000):
+    """Cost of a histogram observation with metrics off (the default) and on"""
+    metrics = marthaba.Metrics()
+    disabled = timed(lambda: metrics.observe('marthaba_ui_task_seconds', 0.002, task='timer'), calls)
+    tmp_dir = tempfile.mkdtemp(prefix="marthaba-bench-")
+    try:
+        metrics.enable(tmp_dir, 'bench', interval=3600)
+        enabled = timed(lambda: metrics.observe('marthaba_ui_task_seconds', 0.002, task='timer'), calls)
+        render = timed(metrics.render, 100)
+    finally:
+        metrics.enabled = False
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return {
+        'observe_disabled_ns': round(disabled * 1e9, 1),
+        'observe_enabled_ns': round(enabled * 1e9, 1),
+        'render_us': round(render * 1e6, 1)
+    }
+
+
+def bench_blocklist(entries=300000):
+    """Cold import, unchanged re-import and mmap lookups of a hosts-format list"""
+    rng = random.Random(7)
+    tmp_dir = tempfile.mkdtemp(prefix="marthaba-bench-")
+    try:
+        source = os.path.join(tmp_dir, "list.hosts")
+        with open(source, 'w') as f:
+            for _ in range(entries):
+                f.write(f"0.0.0.0 {random_domain(rng)}\n")
+        store = marthaba.BlocklistStore(os.path.join(tmp_dir, "store"))
+
+        started = time.perf_counter()
+        summary = store.import_sources([source])
+        cold = time.perf_counter() - started
+        started = time.perf_counter()
+        store.import_sources([source])
+        warm = time.perf_counter() - started
+
+        started = time.perf_counter()
+        domains = store.open()
+        open_s = time.perf_counter() - started
+        hosts = [random_domain(rng) for _ in range(20000)]
+        lookup = timed(lambda: [domains.matches(host) for host in hosts], 1) / len(hosts)
+        size = os.path.getsize(store.combined_path)
+        domains.close()
+        return {
+            'entries': summary['entries'],
+            'import_s': round(cold, 3),
+            'reimport_unchanged_s': round(warm, 4),
+            'open_s': round(open_s, 6),
+            'lookup_us': round(lookup * 1e6, 2),
+            'file_bytes': size
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def bench_dns(queries=20000, window=64):
+    """DNS sinkhole queries/sec for blocked, cached and forwarded names (fake upstream)"""
+    def run(sinkhole, names):
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.settimeout(2)
+        packets = [marthaba.dns_build_query(i & 0xFFFF, names[i % len(names)]) for i in range(queries)]
+        started = time.perf_counter()
+        answered = 0
+        for start in range(0, queries, window):
+            batch = packets[start:start + window]
+            for packet in batch:
+                client.sendto(packet, sinkhole.listen)
+            for _ in batch:
+                try:
+                    client.recv(4096)
+                    answered += 1
+                except socket.timeout:
+                    break
+        elapsed = time.perf_counter() - started
+        client.close()
+        return round(answered / elapsed)
+
+    with marthaba.FakeDnsUpstream() as upstream:
+        sinkhole = marthaba.DnsSinkhole(("127.0.0.1", 0), upstream.address, cache_size=100000)
+        sinkhole.start_in_thread()
+        sinkhole.configure(True, marthaba.DEFAULT_BLOCKED)
+        time.sleep(0.05)
+        rng = random.Random(3)
+        try:
+            return {
+                'blocked_qps': run(sinkhole, ["www.youtube.com", "m.facebook.com"]),
+                'cached_qps': run(sinkhole, ["example.com", "python.org"]),
+                'forwarded_qps': run(sinkhole, [random_domain(rng) for _ in range(queries)]),
+                'upstream_queries': upstream.queries
+            }
+        finally:
+            sinkhole.stop()
+
+
+def bench_cli_startup(runs=15):
+    """Cold start of `marthaba status` as the installed wrapper runs it, vs a bare interpreter"""
+    launcher = "import sys, marthaba; code = marthaba.main(); sys.stderr.write(str('tkinter' in sys.modules)); sys.exit(code)"
+    package_dir = os.path.dirname(os.path.abspath(marthaba.__file__))
+    home = tempfile.mkdtemp(prefix="marthaba-bench-")
+    env = dict(os.environ, HOME=home, PYTHONPATH=package_dir)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    def run(command):
+        started = time.perf_counter()
+        result = subprocess.run(command, env=env, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, text=True, check=True)
+        return time.perf_counter() - started, result.stderr
+
+    try:
+        # First run writes the bytecode cache, like the installer does
+        _, tk_loaded = run([sys.executable, "-c", launcher, "status"])
+        status = [run([sys.executable, "-c", launcher, "status"])[0] for _ in range(runs)]
+        bare = [run([sys.executable, "-c", "pass"])[0] for _ in range(runs)]
+        return {
+            'runs': runs,
+            'status_ms': round(statistics.median(status) * 1000, 1),
+            'interpreter_ms': round(statistics.median(bare) * 1000, 1),
+            'tkinter_imported': tk_loaded == 'True'
+        }
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def bench_history(sessions=100000, page=6):
+    """Session index build/reopen, random page reads and date-range lookups"""
+    tmp_dir = tempfile.mkdtemp(prefix="marthaba-bench-")
+    try:
+        path = os.path.join(tmp_dir, "history.jsonl")
+        start = datetime.datetime.now() - datetime.timedelta(hours=sessions)
+        with open(path, 'w') as f:
+            for i in range(sessions):
+                stamp = (start + datetime.timedelta(hours=i)).isoformat()
+                f.write(f'{{"start_time":"{stamp}","end_time":"{stamp}","duration":0.5,"sites":[]}}\n')
+                f.write(f'{{"event":"end","start_time":"{stamp}","end_time":"{stamp}",'
+                        f'"planned":1800,"completed":{"true" if i % 3 else "false"}}}\n')
+        log = marthaba.SessionLog(path, max_bytes=1 << 40, max_age_days=100000)
+
+        started = time.perf_counter()
+        marthaba.SessionIndex(log).close()
+        build = time.perf_counter() - started
+        started = time.perf_counter()
+        index = marthaba.SessionIndex(log)
+        reopen = time.perf_counter() - started
+
+        rng = random.Random(5)
+        tops = [rng.randrange(len(index) - page) for _ in range(2000)]
+        page_read = timed(lambda: [index.record(tops[0] + row) for row in range(page)] and tops.append(tops.pop(0)),
+                          len(tops))
+        days = [start.timestamp() + rng.randrange(sessions // 24) * 86400 for _ in range(2000)]
+        lookup = timed(lambda: index.between(days[0], days[0] + 86400) and days.append(days.pop(0)), len(days))
+
+        # Scroll through every page; Python heap use should not grow with the log
+        tracemalloc.start()
+        for top in range(0, len(index) - page, page):
+            for row in range(page):
+                index.record(top + row)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        result = {
+            'sessions': len(index),
+            'build_s': round(build, 3),
+            'reopen_s': round(reopen, 5),
+            'page_us': round(page_read * 1e6, 1),
+            'date_range_us': round(lookup * 1e6, 1),
+            'full_scroll_peak_kb': round(peak / 1024, 1),
+            'index_bytes': os.path.getsize(index.path)
+        }
+        index.close()
+        return result
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class VirtualRoot:
+    """after()/after_cancel() on a simulated clock, for timing UI loops without a display"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.jobs = {}
+        self.ids = itertools.count()
+        self.wakeups = 0
+
+    def clock(self):
+        return self.now
+
+    def after(self, ms, callback):
+        job = f"after#{next(self.ids)}"
+        self.jobs[job] = (self.now + ms / 1000, callback)
+        return job
+
+    def after_cancel(self, job):
+        self.jobs.pop(job, None)
+
+    def run(self, seconds):
+        end = self.now + seconds
+        while self.jobs:
+            job = min(self.jobs, key=lambda name: self.jobs[name][0])
+            at, callback = self.jobs.pop(job)
+            if at > end:
+                self.jobs[job] = (at, callback)
+                break
+            self.now = at
+            self.wakeups += 1
+            callback()
+        self.now = end
+
+
+def bench_scheduler(minutes=10):
+    """UI wakeups/min during a session: separate after() chains vs FrameScheduler"""
+    # Before: the logo chain started twice plus the 1 s timer chain
+    old = VirtualRoot()
+
+    def chain(interval):
+        def step():
+            old.after(int(interval * 1000), step)
+        old.after(0, step)
+    for interval in (1.5, 1.5, 1.0):
+        chain(interval)
+    old.run(minutes * 60)
+
+    new = VirtualRoot()
+    scheduler = marthaba.FrameScheduler(new, clock=new.clock)
+    for _ in range(2):
+        scheduler.add('logo', lambda: 1.5, slack=0.5, animation=True)
+    scheduler.add('timer', lambda: 1.0)
+    new.run(minutes * 60)
+    visible = scheduler.wakeups_per_minute()
+
+    # Iconified: animations held, the tick sleeps until the deadline
+    scheduler.pause()
+    scheduler.add('timer', lambda: 1500.0)
+    new.run(minutes * 60)
+    return {
+        'separate_chains_per_min': round(old.wakeups / minutes),
+        'scheduler_per_min': visible,
+        'hidden_per_min': scheduler.wakeups_per_minute()
+    }
+
+
+class DummyUpstream:
+    """Keep-alive HTTP/1.1 origin on loopback: GET /N answers with N bytes"""
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(64)
+        self.address = "127.0.0.1:%d" % self.sock.getsockname()[1]
+        self.payload = bytes(64 * 1024 * 1024)
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def serve(self, conn):
+        reader = conn.makefile('rb')
+        payload = memoryview(self.payload)
+        try:
+            while True:
+                line = reader.readline()
+                if not line:
+                    return
+                while reader.readline() not in (b"\r\n", b""):
+                    pass
+                size = int(line.split()[1].rsplit(b"/", 1)[1] or 0)
+                conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % size)
+                conn.sendall(payload[:size])
+        except OSError:
+            pass
+        finally:
+            reader.close()
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+def http_get(sock, reader, target, host):
+    """One keep-alive GET; returns the body length"""
+    sock.sendall(b"GET %s HTTP/1.1\r\nHost: %s\r\n\r\n" % (target.encode(), host.encode()))
+    length = 0
+    while True:
+        line = reader.readline()
+        if line == b"\r\n":
+            break
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    remaining = length
+    while remaining:
+        remaining -= len(reader.read(min(remaining, 1 << 20)))
+    return length
+
+
+def bench_proxy(requests=2000, body_mb=64):
+    """FilterProxy latency and throughput vs talking to a dummy origin directly"""
+    upstream = DummyUpstream()
+    proxy = marthaba.FilterProxy(("127.0.0.1", 0))
+    proxy.start_in_thread()
+    proxy.configure(True, marthaba.DEFAULT_BLOCKED, [], None, ["%s/shorts" % upstream.address])
+    size = body_mb * 1024 * 1024
+
+    def session(address, connect=None):
+        sock = socket.create_connection(address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = sock.makefile('rb')
+        if connect:
+            sock.sendall(b"CONNECT %s HTTP/1.1\r\n\r\n" % connect.encode())
+            while reader.readline() != b"\r\n":
+                pass
+        return sock, reader
+
+    def latencies(address, prefix):
+        sock, reader = session(address)
+        samples = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            http_get(sock, reader, prefix, upstream.address)
+            samples.append((time.perf_counter() - started) * 1e6)
+        sock.close()
+        samples.sort()
+        return {'p50_us': round(samples[len(samples) // 2], 1),
+                'p99_us': round(samples[int(len(samples) * 0.99)], 1)}
+
+    def throughput(address, target, connect=None):
+        sock, reader = session(address, connect)
+        started = time.perf_counter()
+        http_get(sock, reader, target, upstream.address)
+        elapsed = time.perf_counter() - started
+        sock.close()
+        return round(body_mb / elapsed)
+
+    direct = upstream.sock.getsockname()
+    http = "http://%s" % upstream.address
+    try:
+        result = {
+            'direct_get': latencies(direct, "/100"),
+            'proxied_get': latencies(proxy.listen, http + "/100"),
+            'blocked_get': latencies(proxy.listen, http + "/shorts/1"),
+            'direct_mb_s': throughput(direct, "/%d" % size),
+            'proxied_mb_s': throughput(proxy.listen, http + "/%d" % size),
+            'tunnel_mb_s': throughput(proxy.listen, "/%d" % size, connect=upstream.address),
+        }
+        result['upstream_connections'] = proxy.pool.opened
+        return result
+    finally:
+        proxy.stop()
+        upstream.close()
+
+
+def bench_block_page(requests=5000, clients=8):
+    """BlockPageServer answers per request and log writes per batch"""
+    flushes = []
+    server = marthaba.BlockPageServer("127.0.0.1", ports=(0,), on_flush=lambda session, counts: flushes.append(counts))
+    server.start_in_thread()
+    server.configure((int(time.time()), marthaba.new_session_id()))
+    address = ("127.0.0.1", server.ports[0])
+    samples = []
+
+    def client(count):
+        own = []
+        for i in range(count):
+            started = time.perf_counter()
+            sock = socket.create_connection(address)
+            sock.sendall(b"GET / HTTP/1.1\r\nHost: site%d.example\r\n\r\n" % (i % 50))
+            while sock.recv(4096):
+                pass
+            sock.close()
+            own.append((time.perf_counter() - started) * 1e6)
+        samples.extend(own)
+
+    try:
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(requests // clients,)) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        writes_before_flush = len(flushes)
+        server.flush()
+        samples.sort()
+        return {'p50_us': round(samples[len(samples) // 2], 1),
+                'p99_us': round(samples[int(len(samples) * 0.99)], 1),
+                'requests_per_s': round(len(samples) / elapsed),
+                'log_writes_during_requests': writes_before_flush,
+                'counted': sum(sum(counts.values()) for counts in flushes)}
+    finally:
+        server.stop()
+
+
+def bench_export(sessions=100000):
+    """export pipeline at `sessions`: rows/s and peak memory, streamed vs materialized"""
+    start = int(time.time()) - sessions * 3600
+    tmp_dir = tempfile.mkdtemp(prefix="marthaba-bench-")
+    try:
+        log = marthaba.SessionLog(os.path.join(tmp_dir, "history.jsonl"), max_bytes=1 << 40,
+                                  max_age_days=100000, legacy_path=None)
+        sites = log.snapshots.put(["github.com", "docs.python.org"])
+        with open(log.path, 'w') as f:
+            for i in range(sessions):
+                begin = start + i * 3600
+                f.write(marthaba.SessionRecord(begin, begin + 3000, sites=sites).to_json() + "\n")
+                f.write(marthaba.SessionRecord(begin, begin + 2400, event='end', planned=3000,
+                                               completed=bool(i % 4)).to_json() + "\n")
+        result = {}
+        with open(os.devnull, 'w') as out:
+            for fmt in ('csv', 'ndjson'):
+                started = time.perf_counter()
+                rows = marthaba.export_rows(marthaba.iter_sessions(iter(log)), log.snapshots, "bench")
+                count = marthaba.write_rows(rows, marthaba.EXPORT_FIELDS, out, fmt)
+                assert count == sessions
+                result[f'{fmt}_rows_per_s'] = round(count / (time.perf_counter() - started))
+            tracemalloc.start()
+            rows = marthaba.export_rows(marthaba.iter_sessions(iter(log)), log.snapshots, "bench")
+            marthaba.write_rows(rows, marthaba.EXPORT_FIELDS, out)
+            result['streamed_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            started = time.perf_counter()
+            rows = marthaba.export_rows(marthaba.iter_sessions(iter(log)), log.snapshots, "bench")
+            marthaba.write_rows(marthaba.report_rows(rows, 'week'), marthaba.REPORT_FIELDS, out)
+            result['weekly_report_ms'] = round((time.perf_counter() - started) * 1000)
+        # The same rows built as a list first, as loading the whole history would
+        tracemalloc.start()
+        rows = list(marthaba.export_rows(marthaba.iter_sessions(iter(log)), log.snapshots, "bench"))
+        result['materialized_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del rows
+        return result
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+BENCHMARKS = {
+    'hosts': lambda: sized(bench_hosts, (100, 10000, 100000)),
+    'matcher': lambda: sized(bench_matcher, (10, 1000, 100000)),
+    'history_log': lambda: sized(bench_history_log, (1000, 10000, 100000, 1000000)),
+    'sqlite': lambda: sized(bench_sqlite, (10000, 100000)),
+    'history_format': bench_history_format,
+    'config': bench_config,
+    'timer': bench_timer,
+    'metrics': bench_metrics,
+    'blocklist': bench_blocklist,
+    'dns': bench_dns,
+    'proxy': bench_proxy,
+    'block_page': bench_block_page,
+    'cli_startup': bench_cli_startup,
+    'scheduler': bench_scheduler,
+    'history': bench_history,
+    'export': lambda: sized(bench_export, (10000, 100000)),
+}
+
+
+def flatten(results, prefix=""):
+    """{'hosts': {'100': {'apply_ms': 1}}} -> {'hosts.100.apply_ms': 1}"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def print_result(name, result):
+    if all(isinstance(value, dict) for value in result.values()):
+        for size, value in result.items():
+            print_result(f"{name}.{size}", value)
+        return
+    print(f"{name}: " + ", ".join(f"{k}={v}" for k, v in result.items()))
+
+
+def compare(results, baseline_path):
+    """Print every numeric metric next to the baseline run"""
+    with open(baseline_path) as f:
+        baseline = flatten(json.load(f)['results'])
+    for key, value in flatten(results).items():
+        before = baseline.get(key)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not isinstance(before, (int, float)):
+            continue
+        change = f"{(value - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{key}: {before} -> {value} ({change})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MarThaba benchmarks")
+    parser.add_argument('names', nargs='*', choices=[[]] + list(BENCHMARKS), metavar='name',
+                        help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument('--json', metavar='FILE', help="also write the results as JSON ('-' for stdout)")
+    parser.add_argument('--compare', metavar='FILE', help="compare against an earlier --json run")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.names or list(BENCHMARKS):
+        results[name] = BENCHMARKS[name]()
+        print_result(name, results[name])
+
+    if args.json:
+        document = {
+            'meta': {
+                'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count()
+            },
+            'results': results
+        }
+        if args.json == '-':
+            json.dump(document, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(document, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -25,10 +25,11 @@ python3 --version || {
     sudo apt update && sudo apt install python3 python3-pip python3-tk -y 
 }
 
-echo "[2/7] Installing Python packages..."
-pip3 install --user Pillow pycaw screen-brightness-control || {
-    echo "⚠️  Trying without --user flag..."
-    pip3 install Pillow pycaw screen-brightness-control
+echo "[2/7] Checking Tk support..."
+# No third-party packages are needed; only the window uses Tk
+python3 -c "import tkinter" 2>/dev/null || {
+    echo "⚠️  Tk not found. Installing python3-tk..."
+    sudo apt install python3-tk -y
 }
 
 echo "[3/7] Creating application directories..."
@@ -50,6 +51,11 @@ fi
 
 chmod +x ~/.local/share/marthaba/marthaba.py
 chmod +x ~/.local/bin/marthaba.py
+cat > ~/.local/bin/marthaba << 'EOF'
+#!/bin/bash
+exec python3 -c 'import os, sys; sys.path.insert(0, os.path.expanduser("~/.local/share/marthaba")); import marthaba; sys.exit(marthaba.main())' "$@"
+EOF
+chmod +x ~/.local/bin/marthaba
 
 echo "[5/7] Creating application menu entry..."
 mkdir -p ~/.local/share/applications
@@ -93,13 +99,11 @@ echo "╚═══════════════════════
 echo ""
 echo "Removing MarThaba Pro Quick Install..."
 rm -rf ~/.local/share/marthaba
-rm -f ~/.local/bin/marthaba.py
+rm -f ~/.local/bin/marthaba.py ~/.local/bin/marthaba
 rm -f ~/.local/share/applications/marthaba.desktop
 rm -f ~/Desktop/MarThaba-Quick.desktop
 echo ""
 echo "✅ MarThaba Pro Quick Install completely removed!"
-echo "💡 Note: Python packages are still installed system-wide."
-echo "   To remove them, run: pip3 uninstall Pillow pycaw screen-brightness-control"
 EOF
 
 chmod +x ~/.local/share/marthaba/uninstall.sh
@@ -115,6 +119,7 @@ echo "
    • Applications Menu > 'MarThaba Pro (Quick)'
    • Desktop Shortcut: 'MarThaba Pro (Quick)'
    • Terminal: python3 ~/.local/share/marthaba/marthaba.py
+   • Headless: marthaba start 25m | status | stop | allow add SITE
 
 🛠️  Uninstall: ~/.local/share/marthaba/uninstall.sh
 
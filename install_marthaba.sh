@@ -20,30 +20,54 @@ if [ -d "/opt/marthaba" ]; then
     sudo rm -rf /opt/marthaba
 fi
 
-echo "[1/7] Checking dependencies..."
+echo "[1/8] Checking dependencies..."
 python3 --version || { 
     echo "[ERROR] Python3 not installed. Installing..."
     sudo apt update && sudo apt install python3 python3-pip python3-tk -y 
 }
 
-echo "[2/7] Creating installation directory..."
+echo "[2/8] Creating installation directory..."
 sudo mkdir -p /opt/marthaba
 
-echo "[3/7] Downloading application files..."
+echo "[3/8] Downloading application files..."
 sudo wget -q -O /opt/marthaba/marthaba.py https://raw.githubusercontent.com/arafat212/Mar-Thaba/main/marthaba.py
 sudo wget -q -O /opt/marthaba/requirements.txt https://raw.githubusercontent.com/arafat212/Mar-Thaba/main/requirements.txt
 
-echo "[4/7] Installing Python packages..."
-sudo pip3 install -q Pillow pycaw screen-brightness-control
+echo "[4/8] Checking Tk support..."
+# No third-party packages are needed; only the window uses Tk
+python3 -c "import tkinter" 2>/dev/null || sudo apt install python3-tk -y
 
-echo "[5/7] Creating system command..."
+echo "[5/8] Creating system command..."
 sudo tee /usr/local/bin/marthaba-pro > /dev/null << 'EOF'
 #!/bin/bash
 python3 /opt/marthaba/marthaba.py
 EOF
 sudo chmod +x /usr/local/bin/marthaba-pro
+# Headless CLI: imports the module so the cached bytecode keeps startup fast
+sudo tee /usr/local/bin/marthaba > /dev/null << 'EOF'
+#!/bin/bash
+exec python3 -c 'import sys; sys.path.insert(0, "/opt/marthaba"); import marthaba; sys.exit(marthaba.main())' "$@"
+EOF
+sudo chmod +x /usr/local/bin/marthaba
+sudo python3 -m py_compile /opt/marthaba/marthaba.py
+
+echo "[6/8] Installing hosts helper service..."
+sudo tee /etc/systemd/system/marthaba-helper.service > /dev/null << EOF
+[Unit]
+Description=MarThaba Pro hosts helper
+
+[Service]
+ExecStart=/usr/bin/python3 /opt/marthaba/marthaba.py --helper --owner ${SUDO_UID:-$(id -u)}
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+EOF
+sudo systemctl daemon-reload && sudo systemctl enable --now marthaba-helper.service || {
+    echo "[WARN] Could not start the helper. Run it manually with: sudo python3 /opt/marthaba/marthaba.py --helper"
+}
 
-echo "[6/7] Creating application menu entry..."
+echo "[7/8] Creating application menu entry..."
 sudo tee /usr/share/applications/marthaba-pro.desktop > /dev/null << EOF
 [Desktop Entry]
 Version=1.0
@@ -58,7 +82,7 @@ Categories=Utility;Productivity;
 Keywords=focus;productivity;timer;shield;block;
 EOF
 
-echo "[7/7] Creating desktop shortcut..."
+echo "[8/8] Creating desktop shortcut..."
 tee ~/Desktop/MarThaba-Pro.desktop > /dev/null << EOF
 [Desktop Entry]
 Version=1.0
@@ -85,6 +109,7 @@ echo "
    • Applications Menu > MarThaba Pro
    • Desktop Shortcut: MarThaba Pro
    • Terminal Command: marthaba-pro
+   • Headless: marthaba start 25m | status | stop | allow add SITE | schedule | daemon
    • Direct: python3 /opt/marthaba/marthaba.py
 
 🛡️  Features:
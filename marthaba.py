@@ -1,26 +1,4904 @@
 #!/usr/bin/env python3
-import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
 import datetime
+import bisect
 import json
 import os
 import time
 import threading
-import subprocess
-import re
+import ctypes
+import fcntl
+import select
+import struct
+import socket
+import socketserver
+import shutil
+import heapq
+import mmap
+import array
+import itertools
+import collections
+import random
+import argparse
+import atexit
+import math
 import sys
-import base64
 import tempfile
+import signal
+import stat
+
+# tkinter and asyncio are imported on first use (load_tk / load_asyncio) so
+# the CLI and the daemon start without paying for them; subprocess, hashlib
+# and tkinter.simpledialog are imported inside the few functions using them
+tk = ttk = messagebox = None
+asyncio = None
 
 CONFIG_FILE = os.path.expanduser("~/.marthaba_config.json")
-HISTORY_FILE = os.path.expanduser("~/.marthaba_history.json")
+HISTORY_FILE = os.path.expanduser("~/.marthaba_history.jsonl")
+LEGACY_HISTORY_FILE = os.path.expanduser("~/.marthaba_history.json")
+ANALYTICS_FILE = os.path.expanduser("~/.marthaba_analytics.json")
+BLOCKLIST_DIR = os.path.expanduser("~/.marthaba_blocklists")
+HOSTS_FILE = "/etc/hosts"
+HELPER_SOCKET = "/run/marthaba-helper.sock"
+REDIRECT_IP = "127.0.0.1"
+DAEMON_PID_FILE = os.path.expanduser("~/.marthaba_daemon.pid")
+METRICS_DIR = os.path.expanduser("~/.marthaba_metrics")
+SCHEDULE_FILE = os.path.expanduser("~/.marthaba_schedule.json")
+DATABASE_FILE = os.path.expanduser("~/.marthaba.db")
+INSTANCE_LOCK_FILE = os.path.expanduser("~/.marthaba_instance.lock")
+INSTANCE_SOCKET = os.path.expanduser("~/.marthaba_instance.sock")
+
+# Default blocked sites
+DEFAULT_BLOCKED = [
+    "www.youtube.com",
+    "youtube.com",
+    "m.youtube.com",
+    "www.facebook.com",
+    "facebook.com",
+    "m.facebook.com",
+    "www.instagram.com",
+    "instagram.com"
+]
+
+# Sections of otherwise allowed sites; only FilterProxy can see paths
+DEFAULT_BLOCKED_PATHS = [
+    "www.youtube.com/shorts",
+    "www.youtube.com/reel",
+    "m.youtube.com/shorts",
+    "www.facebook.com/reel",
+    "www.facebook.com/watch",
+    "www.instagram.com/reels"
+]
+
+
+def load_tk():
+    """Import tkinter into the module namespace; only the GUI needs it"""
+    global tk, ttk, messagebox
+    import tkinter as tk
+    from tkinter import ttk, messagebox
+
+
+def load_asyncio():
+    global asyncio
+    import asyncio
+
+
+def normalize_host(value):
+    """Reduce a URL, host or rule to a bare lowercase host name"""
+    host = value.strip().lower()
+    if "://" in host:
+        host = host.split("://", 1)[1]
+    host = host.split('/', 1)[0].split('?', 1)[0]
+    if host.count(':') == 1:
+        host = host.split(':', 1)[0]
+    return host.strip('.')
+
+
+HOST_NAME_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789-_.")
+
+
+def is_host_name(host):
+    """True for a lowercase DNS name that is safe to write into a hosts file line"""
+    if not isinstance(host, str) or not 0 < len(host) <= 253 or not HOST_NAME_CHARS.issuperset(host):
+        return False
+    return all(label and len(label) <= 63 and label[0] != '-' and label[-1] != '-'
+               for label in host.split('.'))
+
+
+class DomainMatcher:
+    """Hashed suffix-set matcher for host rules.
+
+    `example.com` matches that host exactly, `*.example.com` matches any
+    subdomain of it. With include_subdomains=True a plain rule also covers
+    its subdomains (how the allowlist treats `youtube.com`). A lookup hashes
+    each suffix of the host once, so it costs O(labels) whatever the rule count.
+    """
+
+    def __init__(self, rules=(), include_subdomains=False):
+        self.include_subdomains = include_subdomains
+        self.exact = set()
+        self.wildcard = set()
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule):
+        rule = rule.strip().lower()
+        if rule.startswith("*."):
+            host = normalize_host(rule[2:])
+            if host:
+                self.wildcard.add(host)
+            return
+        host = normalize_host(rule)
+        if not host:
+            return
+        self.exact.add(host)
+        if self.include_subdomains:
+            self.wildcard.add(host)
+
+    def matches(self, host):
+        host = normalize_host(host)
+        if host in self.exact:
+            return True
+        wildcard = self.wildcard
+        if not wildcard:
+            return False
+        dot = host.find('.')
+        while dot != -1:
+            if host[dot + 1:] in wildcard:
+                return True
+            dot = host.find('.', dot + 1)
+        return False
+
+    __contains__ = matches
+
+
+HOST_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789-._")
+NON_BLOCKABLE = frozenset(["localhost", "localhost.localdomain", "local", "broadcasthost",
+                           "ip6-localhost", "ip6-loopback", "0.0.0.0"])
+
+
+def parse_blocklist(lines):
+    """Yield normalised host names from hosts-format or plain domain-list lines"""
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line or line.startswith('!'):
+            continue
+        fields = line.split()
+        # Hosts format: "0.0.0.0 a.com b.com"; domain list: "a.com"
+        if fields[0].replace('.', '').isdigit() or ':' in fields[0]:
+            candidates = fields[1:]
+        else:
+            candidates = fields[:1]
+        for candidate in candidates:
+            host = normalize_host(candidate)
+            if (host and '.' in host and host not in NON_BLOCKABLE
+                    and set(host) <= HOST_CHARS and not host.replace('.', '').isdigit()):
+                yield host
+
+
+def host_key(host):
+    """Reversed-label sort key, so a domain sorts right before its subdomains"""
+    return ".".join(reversed(host.split('.'))).encode()
+
+
+def sorted_unique_keys(hosts, chunk_size=200000, tmp_dir=None):
+    """External sort: yield unique host keys in order using bounded memory"""
+    runs = []
+    chunk = set()
+
+    def flush():
+        fd, path = tempfile.mkstemp(prefix="marthaba-run-", dir=tmp_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.writelines(key + b"\n" for key in sorted(chunk))
+        runs.append(path)
+        chunk.clear()
+
+    for host in hosts:
+        chunk.add(host_key(host))
+        if len(chunk) >= chunk_size:
+            flush()
+    if not runs:
+        yield from sorted(chunk)
+        return
+    if chunk:
+        flush()
+    files = [open(path, 'rb') for path in runs]
+    try:
+        yield from unique_merge(files)
+    finally:
+        for f, path in zip(files, runs):
+            f.close()
+            os.unlink(path)
+
+
+def unique_merge(sources):
+    """Merge already sorted key streams (bytes, optionally newline-terminated), dropping duplicates"""
+    previous = None
+    for key in heapq.merge(*((line.rstrip(b"\n") for line in source) for source in sources)):
+        if key != previous:
+            yield key
+            previous = key
+
+
+class CompactDomainSet:
+    """Memory-mapped sorted set of host keys written by BlocklistStore.
+
+    Layout: magic, count, (count + 1) uint32 offsets, then the keys. Lookups
+    binary-search the mapping directly, so opening costs nothing but the mmap.
+    An entry blocks its host and every subdomain of it.
+    """
+    MAGIC = b"MTBLSET1"
+    HEADER = struct.Struct("<8sI")
+
+    def __init__(self, path, owners=None):
+        """`owners`: if given, the file must be a regular file one of these uids owns"""
+        self.path = path
+        # O_NONBLOCK: opening a FIFO must not hang the caller before the check below
+        with os.fdopen(os.open(path, os.O_RDONLY | os.O_NONBLOCK), 'rb') as f:
+            info = os.fstat(f.fileno())
+            if owners is not None and not (stat.S_ISREG(info.st_mode) and info.st_uid in owners):
+                raise ValueError(f"{path}: not a file owned by the user being served")
+            if info.st_size < self.HEADER.size:
+                raise ValueError(f"{path}: truncated blocklist")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = self.HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC:
+            self.map.close()
+            raise ValueError(f"{path}: not a MarThaba blocklist")
+        offsets_end = self.HEADER.size + 4 * (self.count + 1)
+        self.offsets = memoryview(self.map)[self.HEADER.size:offsets_end].cast('I')
+        self.blob_start = offsets_end
+
+    @classmethod
+    def write(cls, path, keys):
+        """Write sorted unique keys to `path` atomically; returns the count"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, blob_path = tempfile.mkstemp(prefix=".blob-", dir=directory)
+        offsets = array.array('I', [0])
+        with os.fdopen(fd, 'w+b') as blob:
+            for key in keys:
+                blob.write(key)
+                offsets.append(offsets[-1] + len(key))
+            blob.seek(0)
+            fd, tmp_path = tempfile.mkstemp(prefix=".set-", dir=directory)
+            with os.fdopen(fd, 'wb') as out:
+                out.write(cls.HEADER.pack(cls.MAGIC, len(offsets) - 1))
+                if sys.byteorder != 'little':
+                    offsets.byteswap()
+                out.write(offsets.tobytes())
+                shutil.copyfileobj(blob, out, 1 << 20)
+                out.flush()
+                os.fsync(out.fileno())
+        os.unlink(blob_path)
+        os.replace(tmp_path, path)
+        return len(offsets) - 1
+
+    def __len__(self):
+        return self.count
+
+    def key_at(self, index):
+        start = self.blob_start + self.offsets[index]
+        return self.map[start:self.blob_start + self.offsets[index + 1]]
+
+    def contains_key(self, key):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self.key_at(mid)
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def matches(self, host):
+        labels = normalize_host(host).split('.')
+        # Check the host and each parent domain (at least two labels)
+        for i in range(len(labels) - 1):
+            if self.contains_key(".".join(reversed(labels[i:])).encode()):
+                return True
+        return False
+
+    __contains__ = matches
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield ".".join(reversed(self.key_at(index).decode().split('.')))
+
+    def close(self):
+        self.offsets.release()
+        self.map.close()
+
+
+class BlocklistStore:
+    """Imports third-party blocklists into one compact on-disk set.
+
+    Every source is streamed line by line into its own sorted shard; a
+    source whose checksum did not change since the last import is skipped,
+    and the shards are only merged again when something changed.
+    """
+    MANIFEST = "manifest.json"
+    COMBINED = "blocklist.bin"
+
+    def __init__(self, directory=BLOCKLIST_DIR):
+        self.directory = directory
+        self.combined_path = os.path.join(directory, self.COMBINED)
+        self.manifest_path = os.path.join(directory, self.MANIFEST)
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'sources': {}}
+
+    def save_manifest(self, manifest):
+        fd, tmp_path = tempfile.mkstemp(prefix=".manifest-", dir=self.directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def checksum(path):
+        import hashlib
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def shard_path(self, source):
+        import hashlib
+        name = hashlib.sha1(os.path.abspath(source).encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f"source-{name}.keys")
+
+    def import_sources(self, sources):
+        """Bring the combined set in line with `sources`; returns a summary dict"""
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = self.load_manifest()
+        previous = manifest.get('sources', {})
+        current = {}
+        summary = {'imported': [], 'skipped': [], 'removed': [], 'entries': 0}
+
+        for source in sources:
+            source = os.path.abspath(os.path.expanduser(source))
+            shard = self.shard_path(source)
+            digest = self.checksum(source)
+            entry = previous.get(source)
+            if entry and entry.get('sha256') == digest and os.path.exists(shard):
+                current[source] = entry
+                summary['skipped'].append(source)
+                continue
+            count = 0
+            tmp_path = shard + ".tmp"
+            with open(source, 'r', encoding='utf-8', errors='replace') as src, open(tmp_path, 'wb') as out:
+                for key in sorted_unique_keys(parse_blocklist(src), tmp_dir=self.directory):
+                    out.write(key + b"\n")
+                    count += 1
+            os.replace(tmp_path, shard)
+            current[source] = {'sha256': digest, 'entries': count, 'shard': shard}
+            summary['imported'].append(source)
+
+        for source, entry in previous.items():
+            if source not in current:
+                summary['removed'].append(source)
+                if os.path.exists(entry.get('shard', '')):
+                    os.unlink(entry['shard'])
+
+        changed = summary['imported'] or summary['removed'] or not os.path.exists(self.combined_path)
+        if changed:
+            shards = [open(current[source]['shard'], 'rb') for source in current]
+            try:
+                summary['entries'] = CompactDomainSet.write(self.combined_path, unique_merge(shards))
+            finally:
+                for shard in shards:
+                    shard.close()
+            manifest = {'sources': current, 'entries': summary['entries']}
+            self.save_manifest(manifest)
+        else:
+            summary['entries'] = manifest.get('entries', 0)
+        return summary
+
+    def open(self):
+        """Memory-map the combined set, or None if nothing was imported yet"""
+        try:
+            return CompactDomainSet(self.combined_path)
+        except (OSError, ValueError):
+            return None
+
+
+class Metrics:
+    """Counters, gauges and histograms kept in memory, written as Prometheus text.
+
+    Off unless enable() is called: every recording method returns on its
+    first line and hot paths check `enabled` before timing anything. Once
+    enabled, a background thread appends a snapshot to `<role>.prom` every
+    `interval` seconds if anything changed; past `max_bytes` the file is
+    rotated to `<role>.prom.1`.
+    """
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+    SNAPSHOT = "# marthaba snapshot"
+    HELP = {
+        'marthaba_enforcement_cycle_seconds': "Wall time of one hosts apply/clear, helper round trip included",
+        'marthaba_enforcement_cycles_total': "Enforcement cycles by operation and whether the hosts file changed",
+        'marthaba_enforcement_errors_total': "Enforcement cycles that raised",
+        'marthaba_enforcement_subprocesses_total': "Subprocesses (sudo) spawned by enforcement",
+        'marthaba_enforcement_syscalls_total': "File syscalls issued by enforcement",
+        'marthaba_hosts_bytes_written_total': "Bytes written to the hosts file",
+        'marthaba_hosts_file_bytes': "Size of the hosts file after the last cycle",
+        'marthaba_ui_tick_lateness_seconds': "How late the UI scheduler woke up compared to its plan",
+        'marthaba_ui_task_seconds': "Time spent in one UI task callback",
+        'marthaba_ui_wakeups_per_minute': "UI scheduler wakeups in the last 60 seconds",
+        'marthaba_ui_dialog_seconds': "Time a modal dialog blocked the UI"
+    }
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.changes = 0
+        self.flushed = 0
+        self.role = None
+        self.path = None
+        self.interval = 60.0
+        self.max_bytes = 256 * 1024
+
+    def enable(self, directory=METRICS_DIR, role='gui', interval=60.0, max_bytes=256 * 1024):
+        if self.enabled:
+            return
+        os.makedirs(directory, exist_ok=True)
+        self.role = role
+        self.path = os.path.join(directory, f"{role}.prom")
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.enabled = True
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        atexit.register(self.flush)
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.changes += 1
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+            self.changes += 1
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # per-bucket counts (made cumulative when rendered), sum, count
+                histogram = self.histograms[key] = [[0] * (len(self.BUCKETS) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(self.BUCKETS, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+            self.changes += 1
+
+    def record_cycle(self, op, stats, duration):
+        """Enforcement cycle: CycleStats from the enforcer or the helper"""
+        if not self.enabled:
+            return
+        self.observe('marthaba_enforcement_cycle_seconds', duration, op=op)
+        self.inc('marthaba_enforcement_cycles_total', op=op, changed=str(stats.changed).lower())
+        self.inc('marthaba_enforcement_subprocesses_total', stats.subprocesses)
+        self.inc('marthaba_enforcement_syscalls_total', stats.syscalls)
+        self.inc('marthaba_hosts_bytes_written_total', stats.bytes_written)
+        if stats.bytes_read:
+            self.set('marthaba_hosts_file_bytes', stats.bytes_written if stats.changed else stats.bytes_read)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        """Current values in the Prometheus text exposition format"""
+        with self.lock:
+            samples = collections.defaultdict(list)
+            kinds = {}
+            for (name, labels), value in self.counters.items():
+                kinds[name] = 'counter'
+                samples[name].append(f"{name}{self._labels(labels)} {value}")
+            for (name, labels), value in self.gauges.items():
+                kinds[name] = 'gauge'
+                samples[name].append(f"{name}{self._labels(labels)} {value}")
+            for (name, labels), (buckets, total, count) in self.histograms.items():
+                kinds[name] = 'histogram'
+                cumulative = 0
+                for bound, bucket in zip(self.BUCKETS + ('+Inf',), buckets):
+                    cumulative += bucket
+                    samples[name].append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+                samples[name].append(f"{name}_sum{self._labels(labels)} {total:.6f}")
+                samples[name].append(f"{name}_count{self._labels(labels)} {count}")
+        lines = []
+        for name in sorted(samples):
+            lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {kinds[name]}")
+            lines.extend(samples[name])
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def flush(self):
+        """Append a snapshot if anything was recorded since the last one"""
+        if not self.enabled or self.changes == self.flushed:
+            return
+        changes = self.changes
+        block = (f"{self.SNAPSHOT} {self.role} {datetime.datetime.now().isoformat(timespec='seconds')} "
+                 f"pid={os.getpid()}\n{self.render()}")
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(block) > self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+            with open(self.path, 'a') as f:
+                f.write(block)
+            self.flushed = changes
+        except OSError as e:
+            print(f"Metrics write error: {e}")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+METRICS = Metrics()
+
+
+def latest_metrics(path):
+    """Last snapshot appended to a metrics file, or None"""
+    try:
+        with open(path) as f:
+            content = f.read()
+    except OSError:
+        return None
+    start = content.rfind(Metrics.SNAPSHOT)
+    return content[start:] if start >= 0 else None
+
+
+class CycleStats:
+    """Cost of one enforcement cycle"""
+    def __init__(self):
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.syscalls = 0
+        self.subprocesses = 0
+        self.changed = False
+        self.duration = 0.0
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for key, value in data.items():
+            if hasattr(stats, key):
+                setattr(stats, key, value)
+        return stats
+
+    def as_dict(self):
+        return {
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'syscalls': self.syscalls,
+            'subprocesses': self.subprocesses,
+            'changed': self.changed,
+            'duration': self.duration
+        }
+
+
+class HostsEnforcer:
+    """Keeps the MarThaba section of the hosts file in sync.
+
+    The hosts file is read once per cycle, the new content is computed in
+    memory and only written back (temp file + rename) when it differs.
+    """
+    BEGIN = "# BEGIN MarThaba Focus"
+    END = "# END MarThaba Focus"
+    LEGACY_MARKER = "# MarThaba Focus"
+
+    def __init__(self, hosts_file=HOSTS_FILE, redirect_ip=REDIRECT_IP):
+        self.hosts_file = hosts_file
+        self.redirect_ip = redirect_ip
+        self.last_stats = CycleStats()
+        self._allowed_cache = None
+        # Set by the helper: imported blocklist files are not trusted there,
+        # and only files owned by the users it serves are opened
+        self.strict = False
+        self.blocklist_owners = None
+
+    def read(self, stats):
+        # open + fstat + read + close
+        with open(self.hosts_file, 'r') as f:
+            content = f.read()
+        stats.syscalls += 4
+        stats.bytes_read += len(content.encode())
+        return content
+
+    def strip_section(self, content):
+        """Return content without the BEGIN/END managed section"""
+        kept = []
+        in_section = False
+        for line in content.splitlines():
+            stripped = line.strip()
+            if stripped == self.BEGIN:
+                in_section = True
+                # Drop the blank separator written before the section
+                if kept and not kept[-1].strip():
+                    kept.pop()
+                continue
+            if in_section:
+                if stripped == self.END:
+                    in_section = False
+                continue
+            kept.append(line)
+        while kept and not kept[-1].strip():
+            kept.pop()
+        return "\n".join(kept) + "\n" if kept else ""
+
+    def extract_section(self, content):
+        """Return the current BEGIN/END managed section (with its leading blank line)"""
+        lines = []
+        in_section = False
+        for line in content.splitlines():
+            stripped = line.strip()
+            if stripped == self.BEGIN:
+                in_section = True
+            if in_section:
+                lines.append(line)
+                if stripped == self.END:
+                    break
+        return "\n" + "\n".join(lines) + "\n" if lines else ""
+
+    def compact_content(self, content, legacy_hosts=DEFAULT_BLOCKED):
+        """Drop everything older versions appended, keeping the managed section.
+
+        Older versions only deleted the bare marker line each cycle, so the
+        entries behind it piled up; those orphans are recognised by host name.
+        """
+        legacy = {f"{self.redirect_ip} {host}" for host in legacy_hosts}
+        kept = []
+        for line in self.strip_section(content).splitlines():
+            stripped = line.strip()
+            if stripped == self.LEGACY_MARKER or " ".join(stripped.split()) in legacy:
+                continue
+            # Collapse the blank runs left behind by the removed blocks
+            if not stripped and kept and not kept[-1].strip():
+                continue
+            kept.append(line)
+        while kept and not kept[-1].strip():
+            kept.pop()
+        compacted = "\n".join(kept) + "\n" if kept else ""
+        return compacted + self.extract_section(content)
+
+    def render_section(self, blocked, allowed=()):
+        allowed = self.allowed_matcher(allowed)
+        entries = [f"{self.redirect_ip} {host}" for host in blocked
+                   if not allowed.matches(host)]
+        if not entries:
+            return ""
+        return "\n" + self.BEGIN + "\n" + "\n".join(entries) + "\n" + self.END + "\n"
+
+    def allowed_matcher(self, allowed):
+        """Compile the allowlist once and reuse it while it stays the same"""
+        if isinstance(allowed, DomainMatcher):
+            return allowed
+        key = tuple(allowed)
+        if self._allowed_cache is None or self._allowed_cache[0] != key:
+            self._allowed_cache = (key, DomainMatcher(key, include_subdomains=True))
+        return self._allowed_cache[1]
+
+    def desired_content(self, current, blocked, allowed=()):
+        return self.strip_section(current) + self.render_section(blocked, allowed)
+
+    def apply(self, blocked, allowed=(), blocklist=None):
+        """Make the hosts file block `blocked` (plus an imported blocklist file) minus `allowed`"""
+        imported = None
+        if blocklist:
+            try:
+                imported = CompactDomainSet(blocklist, self.blocklist_owners)
+            except (OSError, ValueError) as e:
+                print(f"Blocklist error: {e}")
+        if imported is not None:
+            blocked = itertools.chain(blocked, filter(is_host_name, imported) if self.strict else imported)
+        try:
+            return self._sync(lambda current: self.desired_content(current, blocked, allowed))
+        finally:
+            if imported is not None:
+                imported.close()
+
+    def clear(self):
+        """Remove the MarThaba section; returns CycleStats"""
+        return self._sync(self.strip_section)
+
+    def compact(self, legacy_hosts=DEFAULT_BLOCKED):
+        """One-off cleanup of duplicated sections; returns CycleStats"""
+        return self._sync(lambda current: self.compact_content(current, legacy_hosts))
+
+    def _sync(self, transform):
+        stats = CycleStats()
+        started = time.perf_counter()
+        current = self.read(stats)
+        desired = transform(current)
+        if desired != current:
+            self.write(desired, stats)
+            stats.changed = True
+        stats.duration = time.perf_counter() - started
+        self.last_stats = stats
+        return stats
+
+    def write(self, content, stats):
+        data = content.encode()
+        directory = os.path.dirname(os.path.abspath(self.hosts_file))
+        if os.access(directory, os.W_OK):
+            self._write_atomic(directory, data, stats)
+        else:
+            self._write_with_sudo(data, stats)
+        stats.bytes_written += len(data)
+
+    def _write_atomic(self, directory, data, stats):
+        fd, tmp_path = tempfile.mkstemp(prefix=".marthaba-", dir=directory)
+        try:
+            try:
+                mode = os.stat(self.hosts_file).st_mode & 0o777
+            except FileNotFoundError:
+                mode = 0o644
+            # mkstemp + fchmod + write + fsync + close + rename
+            os.fchmod(fd, mode)
+            os.write(fd, data)
+            os.fsync(fd)
+            os.close(fd)
+            fd = None
+            os.replace(tmp_path, self.hosts_file)
+            stats.syscalls += 6
+        except BaseException:
+            if fd is not None:
+                os.close(fd)
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _write_with_sudo(self, data, stats):
+        # Stage the file privately, then copy + rename it in place with a single sudo call
+        import subprocess
+        fd, tmp_path = tempfile.mkstemp(prefix="marthaba-hosts-")
+        try:
+            os.write(fd, data)
+            os.close(fd)
+            stats.syscalls += 3
+            script = 'cp "$1" "$2.marthaba-tmp" && chmod 644 "$2.marthaba-tmp" && mv "$2.marthaba-tmp" "$2"'
+            result = subprocess.run(['sudo', 'sh', '-c', script, 'sh', tmp_path, self.hosts_file],
+                                    capture_output=True)
+            stats.subprocesses += 1
+            if result.returncode != 0:
+                raise OSError(result.stderr.decode().strip() or "sudo failed")
+        finally:
+            os.unlink(tmp_path)
+
+
+class FileWatcher:
+    """Waits for external edits of a single file.
+
+    Uses inotify on the parent directory (so atomic renames are seen) and
+    falls back to comparing mtime/size/inode when inotify is unavailable.
+    """
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, path, poll_interval=2.0):
+        self.path = os.path.abspath(path)
+        self.name = os.path.basename(self.path).encode()
+        self.poll_interval = poll_interval
+        self.fd = None
+        self._last_stat = self._stat()
+        self._wake_r, self._wake_w = os.pipe()
+        self._watching = False
+        self._closed = False
+        self._lock = threading.Lock()
+        self._setup_inotify()
+
+    def _setup_inotify(self):
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+            if fd < 0:
+                return
+            mask = (self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM |
+                    self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE)
+            directory = os.path.dirname(self.path).encode()
+            if libc.inotify_add_watch(fd, directory, mask) < 0:
+                os.close(fd)
+                return
+            self.fd = fd
+        except (OSError, AttributeError):
+            self.fd = None
+
+    @property
+    def uses_inotify(self):
+        return self.fd is not None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            return None
+
+    def _read_events(self):
+        """Consume pending inotify events; True if any concerned our file"""
+        hit = False
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return hit
+            offset = 0
+            while offset < len(buf):
+                _, _, _, length = self.EVENT_HEADER.unpack_from(buf, offset)
+                offset += self.EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if name == self.name:
+                    hit = True
+
+    def drain(self):
+        """Forget changes made so far (e.g. our own write)"""
+        if self.fd is not None:
+            self._read_events()
+        self._last_stat = self._stat()
+
+    def wait(self, timeout):
+        """Block until the file changes or `timeout` seconds pass; True on change"""
+        deadline = time.monotonic() + max(0.0, timeout)
+        while True:
+            remaining = deadline - time.monotonic()
+            if self.fd is not None:
+                ready, _, _ = select.select([self.fd], [], [], max(0.0, remaining))
+                if ready and self._read_events():
+                    self._last_stat = self._stat()
+                    return True
+            else:
+                current = self._stat()
+                if current != self._last_stat:
+                    self._last_stat = current
+                    return True
+                if remaining > 0:
+                    time.sleep(min(self.poll_interval, remaining))
+            if remaining <= 0:
+                return False
+
+    def watch(self, callback):
+        """Call `callback` after each change until close(); blocks, so run it on its own thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._watching = True
+        try:
+            while not self._closed:
+                if self.fd is not None:
+                    ready, _, _ = select.select([self.fd, self._wake_r], [], [])
+                    changed = self.fd in ready and self._read_events()
+                else:
+                    ready, _, _ = select.select([self._wake_r], [], [], self.poll_interval)
+                    current = self._stat()
+                    changed = current != self._last_stat
+                    self._last_stat = current
+                if self._wake_r in ready:
+                    break
+                if changed:
+                    callback()
+        finally:
+            with self._lock:
+                self._watching = False
+                self._release()
+
+    def close(self):
+        with self._lock:
+            if self._closed and not self._watching:
+                return
+            self._closed = True
+            if self._watching:
+                # The watch loop releases the descriptors on its way out
+                os.write(self._wake_w, b"x")
+            else:
+                self._release()
+
+    def _release(self):
+        for fd in (self.fd, self._wake_r, self._wake_w):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.fd = self._wake_r = self._wake_w = None
+
+
+DNS_LISTEN = ("127.0.0.77", 53)
+DNS_UPSTREAM = ("1.1.1.1", 53)
+DNS_HEADER = struct.Struct("!HHHHHH")
+DNS_RR = struct.Struct("!HHIH")
+DNS_TYPE_A = 1
+DNS_TYPE_AAAA = 28
+DNS_TYPE_SOA = 6
+DNS_TYPE_OPT = 41
+DNS_RCODE_NXDOMAIN = 3
+
+
+def dns_skip_name(packet, offset):
+    """Offset just past the (possibly compressed) name starting at `offset`"""
+    while True:
+        length = packet[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += length + 1
+
+
+def dns_parse_query(packet):
+    """Return (qid, flags, qname, qtype, qclass, question_end) of a query"""
+    qid, flags, qdcount, _, _, _ = DNS_HEADER.unpack_from(packet, 0)
+    if qdcount != 1:
+        raise ValueError("expected exactly one question")
+    labels = []
+    offset = DNS_HEADER.size
+    while True:
+        length = packet[offset]
+        offset += 1
+        if length == 0:
+            break
+        if length & 0xC0:
+            raise ValueError("compressed question name")
+        labels.append(packet[offset:offset + length].decode('ascii', 'replace'))
+        offset += length
+    qtype, qclass = struct.unpack_from("!HH", packet, offset)
+    return qid, flags, ".".join(labels).lower(), qtype, qclass, offset + 4
+
+
+def dns_encode_name(name):
+    return b"".join(bytes([len(label)]) + label.encode() for label in name.strip('.').split('.')) + b"\0"
+
+
+def dns_build_query(qid, name, qtype=DNS_TYPE_A):
+    return DNS_HEADER.pack(qid, 0x0100, 1, 0, 0, 0) + dns_encode_name(name) + struct.pack("!HH", qtype, 1)
+
+
+def dns_ttl_offsets(packet, offset):
+    """Offsets of every RR TTL after the question section, plus the smallest TTL"""
+    _, _, qdcount, ancount, nscount, arcount = DNS_HEADER.unpack_from(packet, 0)
+    for _ in range(qdcount):
+        offset = dns_skip_name(packet, offset) + 4
+    offsets = []
+    min_ttl = None
+    for _ in range(ancount + nscount + arcount):
+        offset = dns_skip_name(packet, offset)
+        rtype, _, ttl, rdlength = DNS_RR.unpack_from(packet, offset)
+        if rtype != DNS_TYPE_OPT:
+            offsets.append(offset + 4)
+            min_ttl = ttl if min_ttl is None else min(min_ttl, ttl)
+        offset += DNS_RR.size + rdlength
+    return offsets, min_ttl
+
+
+def dns_block_response(query, flags, qtype, question_end, nxdomain=False):
+    """Answer a blocked query with 0.0.0.0 / :: (or NXDOMAIN)"""
+    qid = struct.unpack_from("!H", query, 0)[0]
+    answer = b""
+    rcode = DNS_RCODE_NXDOMAIN if nxdomain else 0
+    if not nxdomain and qtype in (DNS_TYPE_A, DNS_TYPE_AAAA):
+        rdata = bytes(4) if qtype == DNS_TYPE_A else bytes(16)
+        answer = b"\xc0\x0c" + DNS_RR.pack(qtype, 1, 60, len(rdata)) + rdata
+    header = DNS_HEADER.pack(qid, 0x8080 | (flags & 0x0100) | rcode, 1, 1 if answer else 0, 0, 0)
+    return header + query[DNS_HEADER.size:question_end] + answer
+
+
+class DnsCache:
+    """LRU cache of upstream responses that honours record TTLs.
+
+    Entries are stored without the ID and question, so a hit can be served
+    for any query ID and letter case; TTLs are rewritten to what is left.
+    """
+
+    def __init__(self, capacity=4096, max_ttl=3600):
+        self.capacity = capacity
+        self.max_ttl = max_ttl
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, qid, question):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        header, body, ttl_offsets, stored_at, ttl = entry
+        elapsed = int(time.monotonic() - stored_at)
+        if elapsed >= ttl:
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        body = bytearray(body)
+        for offset in ttl_offsets:
+            current = struct.unpack_from("!I", body, offset)[0]
+            struct.pack_into("!I", body, offset, max(0, current - elapsed))
+        return struct.pack("!H", qid) + header + question + bytes(body)
+
+    def put(self, key, response, question_end):
+        try:
+            offsets, min_ttl = dns_ttl_offsets(response, DNS_HEADER.size)
+        except (IndexError, struct.error):
+            return
+        rcode = response[3] & 0x0F
+        if min_ttl is None or min_ttl <= 0 or rcode not in (0, DNS_RCODE_NXDOMAIN) or response[2] & 0x02:
+            return
+        self.entries[key] = (response[2:12], response[question_end:],
+                             [offset - question_end for offset in offsets],
+                             time.monotonic(), min(min_ttl, self.max_ttl))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+
+class DnsSinkhole:
+    """Local DNS stub that sinkholes blocked names and forwards the rest.
+
+    Listens on UDP and TCP; blocking is decided by the shared matchers, so
+    starting or ending a session only flips `active`. Runs its own asyncio
+    loop, normally inside the helper process.
+    """
+
+    def __init__(self, listen=DNS_LISTEN, upstream=DNS_UPSTREAM, nxdomain=False, cache_size=4096):
+        self.listen = listen
+        self.upstream = upstream
+        self.nxdomain = nxdomain
+        self.cache = DnsCache(cache_size)
+        self.active = False
+        self.blocked = DomainMatcher(DEFAULT_BLOCKED)
+        self.allowed = DomainMatcher()
+        self.imported = None
+        # Set by the helper, as for HostsEnforcer
+        self.blocklist_owners = None
+        self.stats = collections.Counter()
+        self.loop = None
+        self.pending = {}
+        self.upstream_transport = None
+        self.servers = []
+        self.ready = threading.Event()
+        load_asyncio()
+
+    def configure(self, active, blocked=None, allowed=None, blocklist=None):
+        """Swap rules and the active flag; called from any thread"""
+        blocked_matcher = DomainMatcher(blocked) if blocked is not None else self.blocked
+        allowed_matcher = DomainMatcher(allowed or [], include_subdomains=True)
+        imported = None
+        if blocklist:
+            try:
+                imported = CompactDomainSet(blocklist, self.blocklist_owners)
+            except (OSError, ValueError) as e:
+                print(f"Blocklist error: {e}")
+
+        def swap():
+            previous = self.imported
+            self.blocked, self.allowed, self.imported = blocked_matcher, allowed_matcher, imported
+            self.active = active
+            # Lookups never span an await, so the old map can be closed right away
+            if previous is not None:
+                previous.close()
+
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(swap)
+        else:
+            swap()
+
+    def is_blocked(self, qname):
+        if not self.active or self.allowed.matches(qname):
+            return False
+        if self.blocked.matches(qname):
+            return True
+        imported = self.imported
+        return imported is not None and imported.matches(qname)
+
+    async def resolve(self, query, via_tcp=False):
+        qid, flags, qname, qtype, qclass, question_end = dns_parse_query(query)
+        self.stats['queries'] += 1
+        if self.is_blocked(qname):
+            self.stats['blocked'] += 1
+            return dns_block_response(query, flags, qtype, question_end, self.nxdomain)
+        key = (qname, qtype, qclass)
+        cached = self.cache.get(key, qid, query[DNS_HEADER.size:question_end])
+        if cached is not None:
+            return cached
+        self.stats['forwarded'] += 1
+        response = await self.forward_udp(query)
+        if via_tcp and response[2] & 0x02:
+            # Truncated over UDP; a TCP client can take the full answer
+            response = await self.forward_tcp(query)
+        self.cache.put(key, response, question_end)
+        return response
+
+    async def forward_udp(self, query, timeout=2.0):
+        # One shared upstream socket; queries are told apart by a fresh ID
+        while True:
+            upstream_id = random.getrandbits(16)
+            if upstream_id not in self.pending:
+                break
+        future = self.loop.create_future()
+        self.pending[upstream_id] = future
+        try:
+            self.upstream_transport.sendto(struct.pack("!H", upstream_id) + query[2:])
+            response = await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(upstream_id, None)
+        return query[:2] + response[2:]
+
+    async def forward_tcp(self, query, timeout=4.0):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*self.upstream), timeout)
+        try:
+            writer.write(struct.pack("!H", len(query)) + query)
+            await writer.drain()
+            length = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), timeout))[0]
+            return await asyncio.wait_for(reader.readexactly(length), timeout)
+        finally:
+            writer.close()
+
+    async def serve_tcp_client(self, reader, writer):
+        try:
+            while True:
+                length = struct.unpack("!H", await reader.readexactly(2))[0]
+                query = await reader.readexactly(length)
+                response = await self.resolve(query, via_tcp=True)
+                writer.write(struct.pack("!H", len(response)) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass  # the client hung up, or the sinkhole is stopping
+        except (ValueError, IndexError, struct.error, asyncio.TimeoutError, OSError):
+            # A malformed query or a failed upstream ends just this connection
+            self.stats['errors'] += 1
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        sinkhole = self
+
+        class UpstreamProtocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                if len(data) >= 2:
+                    future = sinkhole.pending.get(struct.unpack_from("!H", data, 0)[0])
+                    if future is not None and not future.done():
+                        future.set_result(data)
+
+        class ServerProtocol(asyncio.DatagramProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def datagram_received(self, data, addr):
+                sinkhole.loop.create_task(self.answer(data, addr))
+
+            async def answer(self, data, addr):
+                try:
+                    response = await sinkhole.resolve(data)
+                except (ValueError, IndexError, struct.error, asyncio.TimeoutError, OSError):
+                    sinkhole.stats['errors'] += 1
+                    return
+                self.transport.sendto(response, addr)
+
+        self.upstream_transport, _ = await self.loop.create_datagram_endpoint(
+            UpstreamProtocol, remote_addr=self.upstream)
+        udp, _ = await self.loop.create_datagram_endpoint(ServerProtocol, local_addr=self.listen)
+        # Port 0 means "pick one"; TCP follows whatever UDP got
+        self.listen = udp.get_extra_info('sockname')[:2]
+        tcp = await asyncio.start_server(self.serve_tcp_client, *self.listen)
+        self.servers = [udp, tcp]
+        self.ready.set()
+
+    def start_in_thread(self):
+        """Run the sinkhole on a private event loop thread; returns once listening"""
+        def run():
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(self.start())
+            loop.run_forever()
+            loop.close()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.ready.wait(5)
+        return thread
+
+    async def shutdown(self):
+        for server in self.servers:
+            server.close()
+        if self.upstream_transport is not None:
+            self.upstream_transport.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    def stop(self):
+        if self.loop is not None and self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop)
+
+
+class FakeDnsUpstream:
+    """Offline upstream resolver: answers every A query with 192.0.2.1"""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.queries = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.address = self.sock.getsockname()
+        self.running = True
+
+    def answer(self, query):
+        qid, flags, _, qtype, _, question_end = dns_parse_query(query)
+        answer = b""
+        if qtype == DNS_TYPE_A:
+            answer = b"\xc0\x0c" + DNS_RR.pack(DNS_TYPE_A, 1, self.ttl, 4) + bytes([192, 0, 2, 1])
+        header = DNS_HEADER.pack(qid, 0x8080 | (flags & 0x0100), 1, 1 if answer else 0, 0, 0)
+        return header + query[DNS_HEADER.size:question_end] + answer
+
+    def serve(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            self.queries += 1
+            self.sock.sendto(self.answer(data), addr)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.sock.close()
+
+
+PROXY_LISTEN = ("127.0.0.1", 8877)
+PROXY_HOP_HEADERS = frozenset(["connection", "proxy-connection", "keep-alive", "proxy-authorization",
+                               "te", "trailer", "upgrade"])
+PROXY_BLOCK_PAGE = ("<html><body style=\"font-family:sans-serif;text-align:center;padding-top:15%\">"
+                    "<h1>🛡️ Blocked by MarThaba</h1><p>{target} is blocked during your focus session.</p>"
+                    "</body></html>")
+
+
+class PathRules:
+    """`host/path` rules, e.g. www.youtube.com/shorts.
+
+    The path prefix is blocked on exactly that host. Paths are only
+    visible in plain HTTP requests; HTTPS goes through a CONNECT tunnel
+    and is judged by host (and SNI) alone.
+    """
+
+    def __init__(self, rules=()):
+        self.prefixes = {}
+        for rule in rules:
+            host, slash, path = rule.strip().lower().partition('/')
+            if slash and path.strip('/'):
+                self.prefixes.setdefault(normalize_host(host), []).append('/' + path.strip('/'))
+
+    def blocks(self, host, path):
+        prefixes = self.prefixes.get(host)
+        if not prefixes:
+            return False
+        path = path.split('?', 1)[0].split('#', 1)[0].lower().rstrip('/') or '/'
+        return any(path == prefix or path.startswith(prefix + '/') for prefix in prefixes)
+
+
+def tls_server_name(data):
+    """SNI host name from a TLS ClientHello record, or None"""
+    try:
+        if data[0] != 0x16 or data[5] != 0x01:
+            return None
+        end = min(len(data), 5 + struct.unpack_from("!H", data, 3)[0])
+        offset = 5 + 4 + 2 + 32  # record + handshake headers, client version, random
+        offset += 1 + data[offset]  # session id
+        offset += 2 + struct.unpack_from("!H", data, offset)[0]  # cipher suites
+        offset += 1 + data[offset]  # compression methods
+        extensions_end = min(end, offset + 2 + struct.unpack_from("!H", data, offset)[0])
+        offset += 2
+        while offset + 4 <= extensions_end:
+            kind, length = struct.unpack_from("!HH", data, offset)
+            offset += 4
+            if kind == 0:  # server_name: list length, name type, name length, name
+                name_length = struct.unpack_from("!H", data, offset + 3)[0]
+                return data[offset + 5:offset + 5 + name_length].decode('ascii').lower()
+            offset += length
+    except (IndexError, struct.error, UnicodeDecodeError):
+        pass
+    return None
+
+
+def parse_http_head(head):
+    """Request or status line plus headers -> (first line fields, [(name, value)])"""
+    lines = head.decode('latin-1').split("\r\n")
+    fields = lines[0].split(' ', 2)
+    if len(fields) < 3:
+        raise ValueError(f"malformed HTTP line: {lines[0]!r}")
+    headers = []
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers.append((name.strip(), value.strip()))
+    return fields, headers
+
+
+def http_header(headers, name):
+    """Last value of header `name` (lowercase) or ''"""
+    value = ''
+    for key, item in headers:
+        if key.lower() == name:
+            value = item
+    return value
+
+
+def split_authority(authority, default_port):
+    """host[:port] or [v6]:port -> (host, port)"""
+    if authority.startswith('['):
+        host, _, rest = authority[1:].partition(']')
+        return host, int(rest[1:]) if rest.startswith(':') else default_port
+    host, port = parse_address(authority, default_port)
+    return host, int(port)
+
+
+class ProxyConnection:
+    """Non-blocking socket with just enough buffering to follow HTTP/1.1 framing.
+
+    Bodies and tunnels are relayed with recv_into a reused buffer and
+    handed straight to sendall, so no per-chunk bytes objects are built.
+    """
+    RELAY_BUFFER = 256 * 1024
+    HEAD_LIMIT = 64 * 1024
+
+    def __init__(self, loop, sock):
+        self.loop = loop
+        self.sock = sock
+        self.buffer = bytearray()
+        self.scratch = None
+
+    @classmethod
+    async def open(cls, loop, host, port, timeout=10.0):
+        error = OSError(f"cannot resolve {host}")
+        for family, kind, proto, _, address in await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM):
+            sock = socket.socket(family, kind, proto)
+            sock.setblocking(False)
+            try:
+                await asyncio.wait_for(loop.sock_connect(sock, address), timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                sock.close()
+                error = e if isinstance(e, OSError) else OSError(f"timed out connecting to {host}")
+                continue
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return cls(loop, sock)
+        raise error
+
+    async def fill(self):
+        data = await self.loop.sock_recv(self.sock, 65536)
+        if not data:
+            raise ConnectionError("connection closed")
+        self.buffer += data
+
+    async def readuntil(self, separator):
+        start = 0
+        while True:
+            index = self.buffer.find(separator, start)
+            if index >= 0:
+                index += len(separator)
+                data = bytes(self.buffer[:index])
+                del self.buffer[:index]
+                return data
+            if len(self.buffer) > self.HEAD_LIMIT:
+                raise ValueError("HTTP header too long")
+            start = max(0, len(self.buffer) - len(separator) + 1)
+            await self.fill()
+
+    async def read_head(self):
+        """Next header block, or None if the peer closed between messages"""
+        if not self.buffer:
+            data = await self.loop.sock_recv(self.sock, 65536)
+            if not data:
+                return None
+            self.buffer += data
+        return await self.readuntil(b"\r\n\r\n")
+
+    async def send(self, data):
+        await self.loop.sock_sendall(self.sock, data)
+
+    async def relay(self, target, count=None):
+        """Copy `count` bytes (None: until EOF) from this connection to `target`"""
+        if self.buffer:
+            take = len(self.buffer) if count is None else min(count, len(self.buffer))
+            await target.send(self.buffer[:take])
+            del self.buffer[:take]
+            if count is not None:
+                count -= take
+        if count == 0:
+            return
+        if self.scratch is None:
+            self.scratch = memoryview(bytearray(self.RELAY_BUFFER))
+        scratch = self.scratch
+        while count is None or count > 0:
+            window = scratch if count is None or count >= len(scratch) else scratch[:count]
+            size = await self.loop.sock_recv_into(self.sock, window)
+            if not size:
+                if count is None:
+                    return
+                raise ConnectionError("connection closed mid-body")
+            await self.loop.sock_sendall(target.sock, scratch[:size])
+            if count is not None:
+                count -= size
+
+    async def discard(self, count):
+        while len(self.buffer) < count:
+            count -= len(self.buffer)
+            self.buffer.clear()
+            await self.fill()
+        del self.buffer[:count]
+
+    async def relay_chunked(self, target):
+        while True:
+            line = await self.readuntil(b"\r\n")
+            await target.send(line)
+            size = int(line.split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                # Trailers up to the final empty line
+                while line != b"\r\n":
+                    line = await self.readuntil(b"\r\n")
+                    await target.send(line)
+                return
+            await self.relay(target, size + 2)
+
+    def shutdown_write(self):
+        try:
+            self.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.close()
+
+
+class UpstreamPool:
+    """Idle keep-alive connections to origin servers, reused across plain HTTP requests"""
+
+    def __init__(self, max_idle=4, idle_timeout=30.0):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.idle = {}
+        self.opened = 0
+        self.reused = 0
+
+    async def acquire(self, loop, host, port):
+        """(connection, reused)"""
+        idle = self.idle.get((host, port))
+        now = time.monotonic()
+        while idle:
+            connection, since = idle.pop()
+            # Anything readable on an idle connection means the server closed it
+            if now - since < self.idle_timeout and not select.select([connection.sock], [], [], 0)[0]:
+                self.reused += 1
+                return connection, True
+            connection.close()
+        self.opened += 1
+        return await ProxyConnection.open(loop, host, port), False
+
+    def release(self, host, port, connection):
+        idle = self.idle.setdefault((host, port), [])
+        if connection.buffer or len(idle) >= self.max_idle:
+            connection.close()
+        else:
+            idle.append((connection, time.monotonic()))
+
+    def close(self):
+        for idle in self.idle.values():
+            for connection, _ in idle:
+                connection.close()
+        self.idle = {}
+
+
+class FilterProxy:
+    """Local HTTP proxy that applies the block to hosts and, for plain HTTP, paths.
+
+    CONNECT tunnels are refused for blocked hosts, and closed if the TLS
+    ClientHello names a blocked host (SNI), is cut short, or names no host
+    for a bare-address target; HTTPS paths stay invisible since traffic
+    is not decrypted. Plain HTTP requests are checked
+    against host and path rules and forwarded over pooled keep-alive
+    upstream connections. Like DnsSinkhole it runs its own asyncio loop
+    and a session only flips `active`.
+    """
+    TLS_PEEK_TIMEOUT = 2.0
+
+    def __init__(self, listen=PROXY_LISTEN):
+        self.listen = listen
+        self.active = False
+        self.blocked = DomainMatcher(DEFAULT_BLOCKED)
+        self.allowed = DomainMatcher()
+        self.paths = PathRules(DEFAULT_BLOCKED_PATHS)
+        self.imported = None
+        self.pool = UpstreamPool()
+        self.stats = collections.Counter()
+        self.loop = None
+        self.server_sock = None
+        self.error = None
+        self.ready = threading.Event()
+        load_asyncio()
+
+    def configure(self, active, blocked=None, allowed=None, blocklist=None, paths=None):
+        """Swap rules and the active flag; called from any thread"""
+        blocked_matcher = DomainMatcher(blocked) if blocked is not None else self.blocked
+        allowed_matcher = DomainMatcher(allowed or [], include_subdomains=True)
+        path_rules = PathRules(paths) if paths is not None else self.paths
+        imported = None
+        if blocklist:
+            try:
+                imported = CompactDomainSet(blocklist)
+            except (OSError, ValueError) as e:
+                print(f"Blocklist error: {e}")
+
+        def swap():
+            previous = self.imported
+            self.blocked, self.allowed, self.paths, self.imported = (blocked_matcher, allowed_matcher,
+                                                                     path_rules, imported)
+            self.active = active
+            if previous is not None:
+                previous.close()
+
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(swap)
+        else:
+            swap()
+
+    def is_blocked(self, host, path=None):
+        if not self.active:
+            return False
+        host = normalize_host(host)
+        # Path rules narrow an allowed site (youtube.com allowed, Shorts not)
+        if path is not None and self.paths.blocks(host, path):
+            return True
+        if self.allowed.matches(host):
+            return False
+        if self.blocked.matches(host):
+            return True
+        imported = self.imported
+        return imported is not None and imported.matches(host)
+
+    async def refuse(self, client, target, keep_alive=False):
+        self.stats['blocked'] += 1
+        body = PROXY_BLOCK_PAGE.format(target=target).encode()
+        await client.send(f"HTTP/1.1 403 Forbidden\r\nContent-Type: text/html; charset=utf-8\r\n"
+                          f"Content-Length: {len(body)}\r\n"
+                          f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body)
+
+    async def serve_client(self, sock):
+        client = ProxyConnection(self.loop, sock)
+        try:
+            while True:
+                head = await client.read_head()
+                if head is None:
+                    break
+                (method, target, version), headers = parse_http_head(head)
+                if method == 'CONNECT':
+                    await self.tunnel(client, target)
+                    break
+                if not await self.forward(client, method, target, version, headers):
+                    break
+        except (ConnectionError, ValueError, OSError, asyncio.TimeoutError):
+            self.stats['errors'] += 1
+        finally:
+            client.close()
+
+    async def tunnel(self, client, target):
+        self.stats['tunnels'] += 1
+        host, port = split_authority(target, 443)
+        if self.is_blocked(host):
+            await self.refuse(client, host)
+            return
+        upstream = await ProxyConnection.open(self.loop, host, port)
+        try:
+            await client.send(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+            try:
+                complete = await asyncio.wait_for(self.peek_client_hello(client), self.TLS_PEEK_TIMEOUT)
+            except asyncio.TimeoutError:
+                complete = False  # the server speaks first, or the hello stalled
+            if client.buffer[:1] == b"\x16" and self.tls_blocked(host, client.buffer if complete else None):
+                self.stats['blocked'] += 1
+                return
+            await asyncio.gather(self.pump(client, upstream), self.pump(upstream, client))
+        finally:
+            upstream.close()
+
+    async def peek_client_hello(self, client):
+        """Buffer the first TLS record whole, so the SNI extension is in it.
+
+        True once it is complete; False if the client does not speak TLS or
+        closes first. Every fill() adds data or raises, so this cannot spin.
+        """
+        while True:
+            buffer = client.buffer
+            if buffer and buffer[0] != 0x16:
+                return False
+            if len(buffer) >= 5 and len(buffer) >= 5 + struct.unpack_from("!H", buffer, 3)[0]:
+                return True
+            try:
+                await client.fill()
+            except ConnectionError:
+                return False
+
+    def tls_blocked(self, host, record):
+        """Whether a tunnel to `host` whose ClientHello is `record` (None: cut short) is blocked"""
+        if not self.active:
+            return False
+        server_name = tls_server_name(record) if record is not None else None
+        if server_name is None:
+            # Nothing to check but the CONNECT target, and an address says nothing
+            return record is None or ':' in host or host.replace('.', '').isdigit()
+        return server_name != host and self.is_blocked(server_name)
+
+    async def pump(self, source, target):
+        try:
+            await source.relay(target)
+        except (ConnectionError, OSError):
+            pass
+        target.shutdown_write()
+
+    async def forward(self, client, method, target, version, headers):
+        """Relay one plain HTTP request; True if the client connection stays usable"""
+        self.stats['requests'] += 1
+        if not target.lower().startswith("http://"):
+            await client.send(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            return False
+        authority, _, path = target[7:].partition('/')
+        path = '/' + path
+        host, port = split_authority(authority, 80)
+        connection = http_header(headers, 'connection').lower()
+        client_keep = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        chunked = 'chunked' in http_header(headers, 'transfer-encoding').lower()
+        length = int(http_header(headers, 'content-length') or 0)
+        if self.is_blocked(host, path):
+            # Drain the body so the connection can carry the next request
+            if chunked:
+                client_keep = False
+            elif length:
+                await client.discard(length)
+            await self.refuse(client, host + path, client_keep)
+            return client_keep
+
+        lines = [f"{method} {path} HTTP/1.1"]
+        lines += [f"{name}: {value}" for name, value in headers if name.lower() not in PROXY_HOP_HEADERS]
+        if not http_header(headers, 'host'):
+            lines.append(f"Host: {authority}")
+        request_head = ("\r\n".join(lines) + "\r\nConnection: keep-alive\r\n\r\n").encode('latin-1')
+
+        for attempt in (1, 2):
+            upstream, reused = await self.pool.acquire(self.loop, host, port)
+            try:
+                await upstream.send(request_head)
+                if chunked:
+                    await client.relay_chunked(upstream)
+                elif length:
+                    await client.relay(upstream, length)
+                response_head = await upstream.read_head()
+                if response_head is None:
+                    raise ConnectionError("upstream closed the connection")
+                break
+            except (ConnectionError, OSError):
+                upstream.close()
+                # A pooled connection may have gone stale; a body cannot be sent twice
+                if not reused or chunked or length or attempt == 2:
+                    raise
+
+        try:
+            (_, status, _), response_headers = parse_http_head(response_head)
+            status = int(status)
+            while 100 <= status < 200 and status != 101:
+                await client.send(response_head)
+                response_head = await upstream.read_head()
+                if response_head is None:
+                    raise ConnectionError("upstream closed the connection")
+                (_, status, _), response_headers = parse_http_head(response_head)
+                status = int(status)
+            upstream_keep = http_header(response_headers, 'connection').lower() != 'close'
+            response_chunked = 'chunked' in http_header(response_headers, 'transfer-encoding').lower()
+            response_length = http_header(response_headers, 'content-length')
+            bodiless = method == 'HEAD' or status in (204, 304)
+            if not (bodiless or response_chunked or response_length):
+                # Delimited by the server closing; the client has to see a close too
+                upstream_keep = client_keep = False
+            lines = [response_head.split(b"\r\n", 1)[0].decode('latin-1')]
+            lines += [f"{name}: {value}" for name, value in response_headers
+                      if name.lower() not in PROXY_HOP_HEADERS]
+            lines.append(f"Connection: {'keep-alive' if client_keep else 'close'}")
+            await client.send(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+            if bodiless:
+                pass
+            elif response_chunked:
+                await upstream.relay_chunked(client)
+            elif response_length:
+                await upstream.relay(client, int(response_length))
+            else:
+                await upstream.relay(client)
+        except BaseException:
+            upstream.close()
+            raise
+        if upstream_keep:
+            self.pool.release(host, port, upstream)
+        else:
+            upstream.close()
+        return client_keep
+
+    async def accept_loop(self):
+        while True:
+            sock, _ = await self.loop.sock_accept(self.server_sock)
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.loop.create_task(self.serve_client(sock))
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        family, kind, proto, _, address = socket.getaddrinfo(*self.listen, type=socket.SOCK_STREAM)[0]
+        sock = socket.socket(family, kind, proto)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(address)
+            sock.listen(128)
+        except OSError:
+            sock.close()
+            raise
+        sock.setblocking(False)
+        self.server_sock = sock
+        # Port 0 means "pick one"
+        self.listen = sock.getsockname()[:2]
+        self.loop.create_task(self.accept_loop())
+        self.ready.set()
+
+    def start_in_thread(self):
+        """Run the proxy on a private event loop thread; returns once listening"""
+        def run():
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(self.start())
+            except OSError as e:
+                self.error = e
+                self.ready.set()
+                loop.close()
+                return
+            loop.run_forever()
+            loop.close()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.ready.wait(5)
+        if self.error is not None:
+            raise self.error
+        return thread
+
+    async def shutdown(self):
+        if self.server_sock is not None:
+            self.server_sock.close()
+        self.pool.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    def stop(self):
+        if self.loop is not None and self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop)
+
+
+BLOCK_PAGE_PORTS = (80, 443)
+BLOCK_PAGE = (b"<html><body style=\"font-family:sans-serif;text-align:center;padding-top:15%\">"
+              b"<h1>Blocked by MarThaba</h1><p>Back to work!</p></body></html>")
+
+
+class BlockPageServer:
+    """Listens on the address blocked hosts are redirected to and counts the attempts.
+
+    Plain HTTP gets a tiny page right away; an HTTPS connection is read up
+    to the ClientHello, whose SNI names the site, and closed. Counts per
+    domain stay in memory and are handed to `on_flush(session, counts)`,
+    `session` being the key configure() got, every FLUSH_INTERVAL seconds
+    and when the session changes, so
+    a request never touches the disk. Ports below 1024 need root or
+    CAP_NET_BIND_SERVICE.
+    """
+    FLUSH_INTERVAL = 300.0
+    READ_TIMEOUT = 5.0
+    READ_LIMIT = 16384
+
+    def __init__(self, address=REDIRECT_IP, ports=BLOCK_PAGE_PORTS, on_flush=None):
+        self.address = address
+        self.ports = ports
+        self.on_flush = on_flush
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.session = None
+        self.stats = collections.Counter()
+        self.loop = None
+        self.sockets = []
+        self.error = None
+        self.ready = threading.Event()
+        load_asyncio()
+
+    def configure(self, session):
+        """Count for `session`, a (start, session id) key (None: none); call from any thread"""
+        with self.lock:
+            if session == self.session:
+                return
+        self.flush()
+        with self.lock:
+            self.session = session
+
+    def count(self, domain):
+        with self.lock:
+            if self.session is not None:
+                self.counts[domain] += 1
+
+    def flush(self):
+        """Hand the counts gathered since the last flush to `on_flush`"""
+        with self.lock:
+            counts, self.counts = self.counts, collections.Counter()
+            session = self.session
+        if counts and session is not None and self.on_flush is not None:
+            try:
+                self.on_flush(session, dict(counts))
+            except Exception as e:
+                print(f"Blocked attempts flush error: {e}")
+
+    async def serve_client(self, sock):
+        try:
+            data = await asyncio.wait_for(self.loop.sock_recv(sock, 4096), self.READ_TIMEOUT)
+            if data[:1] == b"\x16":
+                # A whole TLS record, so the SNI extension is in it
+                while len(data) < min(5 + struct.unpack_from("!H", data, 3)[0], self.READ_LIMIT):
+                    more = await asyncio.wait_for(self.loop.sock_recv(sock, 4096), self.READ_TIMEOUT)
+                    if not more:
+                        break
+                    data += more
+                domain = tls_server_name(data)
+            else:
+                head, _, _ = data.partition(b"\r\n\r\n")
+                try:
+                    _, headers = parse_http_head(head)
+                    domain = http_header(headers, 'host')
+                except ValueError:
+                    domain = None
+                await self.loop.sock_sendall(sock, b"HTTP/1.1 403 Forbidden\r\nContent-Type: text/html\r\n"
+                                             b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(BLOCK_PAGE)
+                                             + BLOCK_PAGE)
+            domain = normalize_host(domain) if domain else None
+            if domain:
+                self.count(domain)
+                self.stats['attempts'] += 1
+        except (OSError, ValueError, struct.error, asyncio.TimeoutError):
+            self.stats['errors'] += 1
+        finally:
+            sock.close()
+
+    async def accept_loop(self, server_sock):
+        while True:
+            sock, _ = await self.loop.sock_accept(server_sock)
+            sock.setblocking(False)
+            self.loop.create_task(self.serve_client(sock))
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+            # The append is fsync'd; keep it off the accept loop
+            await self.loop.run_in_executor(None, self.flush)
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        try:
+            for port in self.ports:
+                family, kind, proto, _, address = socket.getaddrinfo(self.address, port,
+                                                                     type=socket.SOCK_STREAM)[0]
+                sock = socket.socket(family, kind, proto)
+                self.sockets.append(sock)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind(address)
+                sock.listen(128)
+                sock.setblocking(False)
+        except OSError:
+            for sock in self.sockets:
+                sock.close()
+            self.sockets = []
+            raise
+        # Port 0 means "pick one"
+        self.ports = tuple(sock.getsockname()[1] for sock in self.sockets)
+        for sock in self.sockets:
+            self.loop.create_task(self.accept_loop(sock))
+        self.loop.create_task(self.flush_loop())
+        self.ready.set()
+
+    def start_in_thread(self):
+        """Run the listener on a private event loop thread; returns once listening"""
+        def run():
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(self.start())
+            except OSError as e:
+                self.error = e
+                self.ready.set()
+                loop.close()
+                return
+            loop.run_forever()
+            loop.close()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.ready.wait(5)
+        if self.error is not None:
+            raise self.error
+        return thread
+
+    async def shutdown(self):
+        for sock in self.sockets:
+            sock.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    def stop(self):
+        self.flush()
+        if self.loop is not None and self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop)
+
+
+class HelperRequestHandler(socketserver.StreamRequestHandler):
+    """One JSON request per line, one JSON response per line"""
+
+    def handle(self):
+        if not self.server.is_authorized(self.request):
+            self.send({'ok': False, 'error': 'permission denied'})
+            # Take the request before closing; otherwise the client's send
+            # can fail with EPIPE and it never reads the answer
+            self.request.settimeout(1.0)
+            try:
+                self.rfile.readline(65536)
+            except OSError:
+                pass
+            return
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                ops = request['ops'] if 'ops' in request else [request]
+                response = {'ok': True, 'results': self.server.run_batch(ops)}
+            except Exception as e:
+                response = {'ok': False, 'error': str(e)}
+            self.send(response)
+
+    def send(self, response):
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+        self.wfile.flush()
+
+
+class HelperServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Long-lived root helper that owns all hosts file writes.
+
+    The GUI keeps one connection open and sends batches of
+    apply/clear/compact/status operations, so no sudo process is spawned
+    while a session is running. Only root and `allowed_uids` may connect,
+    and every host name is validated before it reaches the hosts file.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path=HELPER_SOCKET, hosts_file=HOSTS_FILE, allowed_uids=(), sinkhole=None):
+        if not allowed_uids:
+            raise ValueError("the helper needs the uid of the user it serves (--owner or sudo)")
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.socket_path = socket_path
+        self.enforcer = HostsEnforcer(hosts_file)
+        self.enforcer.strict = True
+        self.sinkhole = sinkhole
+        self.allowed_uids = set(allowed_uids)
+        self.enforcer.blocklist_owners = self.allowed_uids
+        if sinkhole is not None:
+            sinkhole.blocklist_owners = self.allowed_uids
+        self.lock = threading.Lock()
+        super().__init__(socket_path, HelperRequestHandler)
+        # The first owner gets the socket; SO_PEERCRED still checks every connection
+        owner = min(self.allowed_uids)
+        if os.geteuid() == 0:
+            import pwd
+            try:
+                group = pwd.getpwuid(owner).pw_gid
+            except KeyError:
+                group = -1
+            os.chown(socket_path, owner, group)
+        os.chmod(socket_path, 0o660)
+
+    def is_authorized(self, sock):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _, uid, _ = struct.unpack("3i", creds)
+        return uid == 0 or uid in self.allowed_uids
+
+    @staticmethod
+    def checked_hosts(op, key, default=()):
+        """op[key] as a list of lowercase host names; ValueError on anything else"""
+        values = op.get(key, default)
+        if not isinstance(values, (list, tuple)):
+            raise ValueError(f"{key} must be a list of host names")
+        hosts = []
+        for value in values:
+            host = value.strip().lower() if isinstance(value, str) else None
+            if not is_host_name(host):
+                raise ValueError(f"invalid host name in {key}: {value!r}")
+            hosts.append(host)
+        return hosts
+
+    @staticmethod
+    def checked_rules(op, key):
+        """Allowlist rules only feed a matcher, but must still be plain strings"""
+        values = op.get(key, [])
+        if not isinstance(values, (list, tuple)) or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"{key} must be a list of strings")
+        return values
+
+    @staticmethod
+    def checked_blocklist(op):
+        blocklist = op.get('blocklist')
+        if blocklist is not None and not (isinstance(blocklist, str) and os.path.isabs(blocklist)):
+            raise ValueError("blocklist must be an absolute path")
+        return blocklist
+
+    def run_batch(self, ops):
+        with self.lock:
+            return [self.run_op(op) for op in ops]
+
+    def run_op(self, op):
+        name = op.get('op')
+        if name == 'apply':
+            return self.enforcer.apply(self.checked_hosts(op, 'blocked', DEFAULT_BLOCKED),
+                                       self.checked_rules(op, 'allowed'), self.checked_blocklist(op)).as_dict()
+        if name == 'clear':
+            return self.enforcer.clear().as_dict()
+        if name == 'compact':
+            return self.enforcer.compact().as_dict()
+        if name == 'status':
+            with open(self.enforcer.hosts_file, 'r') as f:
+                section = self.enforcer.extract_section(f.read())
+            return {
+                'hosts_file': self.enforcer.hosts_file,
+                'active': bool(section),
+                'entries': max(0, section.count("\n") - 3),
+                'last_stats': self.enforcer.last_stats.as_dict()
+            }
+        if name in ('dns_apply', 'dns_clear', 'dns_status'):
+            return self.run_dns_op(name, op)
+        raise ValueError(f"unknown op: {name}")
+
+    def run_dns_op(self, name, op):
+        if self.sinkhole is None:
+            raise ValueError("DNS sinkhole is not enabled (start the helper with --dns)")
+        if name == 'dns_apply':
+            self.sinkhole.configure(True, self.checked_hosts(op, 'blocked', DEFAULT_BLOCKED),
+                                    self.checked_rules(op, 'allowed'), self.checked_blocklist(op))
+        elif name == 'dns_clear':
+            self.sinkhole.configure(False)
+        return {
+            'listen': list(self.sinkhole.listen),
+            'active': self.sinkhole.active if name == 'dns_status' else name == 'dns_apply',
+            'stats': dict(self.sinkhole.stats),
+            'cache_hits': self.sinkhole.cache.hits
+        }
+
+    def start_in_thread(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class MockHelper(HelperServer):
+    """In-process helper working on a temporary hosts file (no root needed)"""
+
+    def __init__(self, initial_hosts="127.0.0.1 localhost\n"):
+        self.tmp_dir = tempfile.mkdtemp(prefix="marthaba-helper-")
+        hosts_file = os.path.join(self.tmp_dir, "hosts")
+        with open(hosts_file, 'w') as f:
+            f.write(initial_hosts)
+        super().__init__(os.path.join(self.tmp_dir, "helper.sock"), hosts_file, [os.getuid()])
+
+    def __enter__(self):
+        self.start_in_thread()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class HelperClient:
+    """Talks to HelperServer; same apply/clear/compact interface as HostsEnforcer"""
+
+    def __init__(self, socket_path=HELPER_SOCKET, timeout=5.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.hosts_file = HOSTS_FILE
+        self.last_stats = CycleStats()
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+
+    def close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+            self.sock = None
+            self.reader = None
+
+    def available(self):
+        """Connect and learn which hosts file the helper manages"""
+        try:
+            self.hosts_file = self.status()['hosts_file']
+            return True
+        except (OSError, ValueError, KeyError):
+            self.close()
+            return False
+
+    def batch(self, *ops):
+        payload = json.dumps({'ops': list(ops)}).encode() + b"\n"
+        for attempt in (1, 2):
+            try:
+                if self.sock is None:
+                    self.connect()
+                self.sock.sendall(payload)
+                line = self.reader.readline()
+                if not line:
+                    raise ConnectionError("helper closed the connection")
+                break
+            except (ConnectionError, BrokenPipeError):
+                # The helper may have restarted; reconnect once
+                self.close()
+                if attempt == 2:
+                    raise
+        response = json.loads(line)
+        if not response.get('ok'):
+            raise OSError(response.get('error', 'helper error'))
+        return response['results']
+
+    def _stats(self, result):
+        self.last_stats = CycleStats.from_dict(result)
+        return self.last_stats
+
+    def apply(self, blocked, allowed=(), blocklist=None):
+        # Imported blocklists travel by path; the helper maps the file itself
+        return self._stats(self.batch({'op': 'apply', 'blocked': list(blocked), 'allowed': list(allowed),
+                                       'blocklist': blocklist})[0])
+
+    def clear(self):
+        return self._stats(self.batch({'op': 'clear'})[0])
+
+    def compact(self):
+        return self._stats(self.batch({'op': 'compact'})[0])
+
+    def status(self):
+        return self.batch({'op': 'status'})[0]
+
+
+class DnsSinkholeClient(HelperClient):
+    """Enforces through the helper's DNS sinkhole: a session is a flag flip"""
+
+    def apply(self, blocked, allowed=(), blocklist=None):
+        self.batch({'op': 'dns_apply', 'blocked': list(blocked), 'allowed': list(allowed),
+                    'blocklist': blocklist})
+        self.last_stats = CycleStats()
+        return self.last_stats
+
+    def clear(self):
+        self.batch({'op': 'dns_clear'})
+        self.last_stats = CycleStats()
+        return self.last_stats
+
+    def compact(self):
+        # The hosts file is not touched in this mode
+        return CycleStats()
+
+    def available(self):
+        try:
+            self.dns_status()
+            return True
+        except (OSError, ValueError):
+            self.close()
+            return False
+
+    def dns_status(self):
+        return self.batch({'op': 'dns_status'})[0]
+
+
+def enforcement_backend(kind='hosts', hosts_file=HOSTS_FILE):
+    """Prefer the running helper; fall back to writing the hosts file directly"""
+    if hosts_file != HOSTS_FILE:
+        # The helper only manages the system hosts file
+        return HostsEnforcer(hosts_file)
+    if kind == 'dns':
+        client = DnsSinkholeClient()
+        if client.available():
+            return client
+        print("DNS sinkhole unavailable, falling back to the hosts file")
+    client = HelperClient()
+    if client.available():
+        return client
+    return HostsEnforcer()
+
+
+def parse_address(value, default_port):
+    host, _, port = value.rpartition(':')
+    if not host:
+        return value, default_port
+    return host, int(port)
+
+
+def run_helper(args):
+    owners = set(args.owner or [])
+    sudo_uid = os.environ.get('SUDO_UID')
+    if sudo_uid:
+        owners.add(int(sudo_uid))
+    if not owners:
+        print("MarThaba helper: no user to serve; start it with sudo or pass --owner UID")
+        return 1
+    sinkhole = None
+    if args.dns:
+        sinkhole = DnsSinkhole(parse_address(args.dns, 53), parse_address(args.upstream, 53),
+                               nxdomain=args.nxdomain)
+        sinkhole.start_in_thread()
+        print(f"MarThaba DNS sinkhole on {sinkhole.listen[0]}:{sinkhole.listen[1]} "
+              f"(upstream {args.upstream}); point resolv.conf at it to use it")
+    server = HelperServer(args.socket, args.hosts, owners, sinkhole)
+    print(f"MarThaba helper listening on {args.socket} (hosts: {args.hosts})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if sinkhole is not None:
+            sinkhole.stop()
+    return 0
+
+
+class Paths:
+    """Every file MarThaba reads or writes, so tests and benchmarks can redirect them"""
+
+    def __init__(self, config=CONFIG_FILE, history=HISTORY_FILE, legacy_history=LEGACY_HISTORY_FILE,
+                 analytics=ANALYTICS_FILE, blocklists=BLOCKLIST_DIR, hosts=HOSTS_FILE,
+                 daemon_pid=DAEMON_PID_FILE, metrics=METRICS_DIR, schedule=SCHEDULE_FILE,
+                 database=DATABASE_FILE, instance_lock=INSTANCE_LOCK_FILE, instance_socket=INSTANCE_SOCKET,
+                 storage=None):
+        self.config = config
+        self.history = history
+        self.legacy_history = legacy_history
+        self.analytics = analytics
+        self.blocklists = blocklists
+        self.hosts = hosts
+        self.daemon_pid = daemon_pid
+        self.metrics = metrics
+        self.schedule = schedule
+        self.database = database
+        self.instance_lock = instance_lock
+        self.instance_socket = instance_socket
+        # 'json' or 'sqlite'; by default whichever the data is already in
+        self.storage = storage or ('sqlite' if os.path.exists(database) else 'json')
+
+    @classmethod
+    def under(cls, directory, hosts=None, storage=None):
+        """All state inside `directory`; the hosts file too unless given"""
+        return cls(config=os.path.join(directory, "config.json"),
+                   history=os.path.join(directory, "history.jsonl"),
+                   legacy_history=None,
+                   analytics=os.path.join(directory, "analytics.json"),
+                   blocklists=os.path.join(directory, "blocklists"),
+                   hosts=hosts or os.path.join(directory, "hosts"),
+                   daemon_pid=os.path.join(directory, "daemon.pid"),
+                   metrics=os.path.join(directory, "metrics"),
+                   schedule=os.path.join(directory, "schedule.json"),
+                   database=os.path.join(directory, "marthaba.db"),
+                   instance_lock=os.path.join(directory, "instance.lock"),
+                   instance_socket=os.path.join(directory, "instance.sock"),
+                   storage=storage)
+
+
+class ConfigStore:
+    """Config dict persisted in the background.
+
+    save() only marks the config dirty; a writer thread waits a short
+    moment so bursts of changes become one write, then replaces the file
+    atomically (temp file, fsync, rename). Writers from any thread are
+    serialised, and flush() writes synchronously (registered at exit).
+    `stamp` identifies the file as last read or written here, so watchers
+    can tell another process's write from our own.
+    """
+    DEFAULTS = {'active': False, 'allowed_sites': [], 'notifications': True}
+
+    def __init__(self, path=CONFIG_FILE, delay=0.5):
+        self.path = path
+        self.delay = delay
+        self.lock = threading.RLock()
+        self.write_lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.dirty = False
+        self.writes = 0
+        # Taken before reading, so a write racing the read still counts as a change
+        self.stamp = self.file_stamp()
+        self.data = self.load()
+        self.writer = None
+        atexit.register(self.flush)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return self.defaults()
+
+    def defaults(self):
+        return {key: (list(value) if isinstance(value, list) else value)
+                for key, value in self.DEFAULTS.items()}
+
+    def file_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            return None
+
+    def changed_on_disk(self):
+        """True if another process wrote the file since we last read or wrote it"""
+        with self.write_lock:
+            return self.file_stamp() != self.stamp
+
+    def reload(self):
+        """Re-read the file written by another process, keeping the same dict"""
+        self.flush()
+        with self.write_lock:
+            self.stamp = self.file_stamp()
+            data = self.load()
+        with self.lock:
+            self.data.clear()
+            self.data.update(data)
+
+    def save(self):
+        """Schedule a write; returns immediately"""
+        with self.lock:
+            self.dirty = True
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = threading.Thread(target=self._writer_loop, daemon=True)
+                self.writer.start()
+            self.wakeup.notify()
+
+    def _writer_loop(self):
+        while True:
+            with self.lock:
+                while not self.dirty:
+                    if not self.wakeup.wait(30):
+                        # Idle for a while; a new thread starts on the next save
+                        self.writer = None
+                        return
+            # Let a burst of updates settle before writing once
+            time.sleep(self.delay)
+            self.flush()
+
+    def flush(self):
+        """Write pending changes now"""
+        with self.write_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                payload = json.dumps(self.data)
+                self.dirty = False
+            try:
+                self._write(payload)
+                self.stamp = self.file_stamp()
+            except OSError as e:
+                with self.lock:
+                    self.dirty = True
+                print(f"Config save error: {e}")
+
+    def _write(self, payload):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".marthaba-config-", dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self.writes += 1
+
+
+class SessionRecord:
+    """One history line: a session start, or an event ('end', 'attempts') of one.
+
+    Times are epoch seconds, written as integers; `sites` is the id of the
+    SiteSnapshots entry holding the allowed sites and `domains` the blocked
+    attempts counted since the previous 'attempts' event. `session` is a
+    random id shared by a session and its events, so two sessions started
+    in the same second stay apart; older lines have none and go by start.
+    from_dict() also reads older lines with ISO times and an inline site list.
+    """
+    __slots__ = ('start', 'end', 'event', 'planned', 'completed', 'sites', 'schedule', 'domains',
+                 'session', 'status', 'attempts')
+
+    def __init__(self, start, end, event=None, planned=None, completed=None, sites=None, schedule=None,
+                 domains=None, session=None, status=0, attempts=0):
+        self.start = start
+        self.end = end
+        self.event = event
+        self.planned = planned
+        self.completed = completed
+        self.sites = sites
+        self.schedule = schedule
+        self.domains = domains
+        self.session = session
+        # End status and blocked attempts of a session, filled in when read through an index
+        self.status = status
+        self.attempts = attempts
+
+    @classmethod
+    def from_dict(cls, data):
+        if 'start' in data:
+            start, end = data['start'], data['end']
+        else:
+            start = datetime.datetime.fromisoformat(data['start_time']).timestamp()
+            end = (datetime.datetime.fromisoformat(data['end_time']).timestamp() if data.get('end_time')
+                   else start + data.get('duration', 0) * 3600)
+        sites = data.get('sites')
+        if isinstance(sites, list):
+            sites = tuple(sites)
+        return cls(start, end, data.get('event'), data.get('planned'), data.get('completed'), sites,
+                   data.get('schedule'), data.get('domains'), data.get('session'))
+
+    @classmethod
+    def from_json(cls, line):
+        return cls.from_dict(json.loads(line))
+
+    def as_dict(self):
+        data = {'start': self.start, 'end': self.end}
+        for key in ('event', 'planned', 'completed', 'sites', 'schedule', 'domains', 'session'):
+            value = getattr(self, key)
+            if value is not None:
+                data[key] = list(value) if isinstance(value, tuple) else value
+        return data
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), separators=(',', ':'))
+
+    @property
+    def duration(self):
+        """Planned (session) or actual (end event) length in hours"""
+        return (self.end - self.start) / 3600
+
+    @property
+    def key(self):
+        """What a session and its events have in common"""
+        return self.start, self.session
+
+
+class SiteSnapshots:
+    """Allowed-site lists stored once and referenced by content hash.
+
+    put() returns a short hash of the sorted list and appends
+    `{"id": ..., "sites": [...]}` to the file only the first time that
+    list is seen; every record using it shares one tuple in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.snapshots = None
+
+    @staticmethod
+    def key(sites):
+        import hashlib
+        sites = tuple(sorted(set(sites)))
+        digest = hashlib.sha1(json.dumps(sites, separators=(',', ':')).encode()).hexdigest()[:16]
+        return digest, sites
+
+    def load(self):
+        snapshots = {}
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        snapshots[entry['id']] = tuple(entry['sites'])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+        return snapshots
+
+    def _loaded(self):
+        if self.snapshots is None:
+            self.snapshots = self.load()
+        return self.snapshots
+
+    def put(self, sites):
+        snapshot_id, sites = self.key(sites)
+        with self.lock:
+            snapshots = self._loaded()
+            if snapshot_id not in snapshots:
+                self.store(snapshot_id, sites)
+                snapshots[snapshot_id] = sites
+        return snapshot_id
+
+    def store(self, snapshot_id, sites):
+        line = json.dumps({'id': snapshot_id, 'sites': sites}, separators=(',', ':')) + "\n"
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        try:
+            os.write(fd, line.encode())
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def get(self, snapshot_id):
+        """Sites of a snapshot id; an inline tuple from an older record is returned as is"""
+        if isinstance(snapshot_id, tuple):
+            return snapshot_id
+        with self.lock:
+            return self._loaded().get(snapshot_id, ())
+
+    def items(self):
+        with self.lock:
+            return list(self._loaded().items())
+
+
+class SessionLog:
+    """Append-only JSONL focus session log with rotation.
+
+    Each session is one fsync'd line. When the active file grows past
+    `max_bytes` or its first entry is older than `max_age_days` it is
+    renamed to `<path>.<seq>` and a fresh file is started. `tail()` reads
+    backwards from the end, so recent sessions cost the same however long
+    the history is. Allowed-site lists live in `<path>.sites` (SiteSnapshots).
+    """
+    BLOCK_SIZE = 8192
+
+    def __init__(self, path=HISTORY_FILE, max_bytes=4 * 1024 * 1024, max_age_days=365,
+                 legacy_path=LEGACY_HISTORY_FILE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.lock = threading.Lock()
+        self._first_time = None
+        self.snapshots = SiteSnapshots(path + ".sites")
+        if legacy_path and os.path.exists(legacy_path) and not os.path.exists(path):
+            self.migrate_legacy(legacy_path)
+
+    def migrate_legacy(self, legacy_path):
+        """One-off import of the old whole-file JSON history"""
+        tmp_path = self.path + ".tmp"
+        try:
+            # Streamed item by item, however large the old file is
+            with open(legacy_path, 'r') as source, open(tmp_path, 'w') as f:
+                for session in iter_json_array(source):
+                    record = SessionRecord.from_dict(session)
+                    if record.sites is not None:
+                        record.sites = self.snapshots.put(record.sites)
+                    f.write(record.to_json() + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except (OSError, ValueError, KeyError, TypeError):
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+        os.replace(tmp_path, self.path)
+        os.replace(legacy_path, legacy_path + ".migrated")
+
+    def archives(self):
+        """Rotated files as (seq, path), oldest first"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        prefix = os.path.basename(self.path) + "."
+        found = []
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return found
+        for name in names:
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and suffix.isdigit():
+                found.append((int(suffix), os.path.join(directory, name)))
+        found.sort()
+        return found
+
+    def next_seq(self):
+        archives = self.archives()
+        return archives[-1][0] + 1 if archives else 1
+
+    def files(self):
+        """All log files, oldest first"""
+        paths = [path for _, path in self.archives()]
+        if os.path.exists(self.path):
+            paths.append(self.path)
+        return paths
+
+    def size(self):
+        """Total bytes of all log files"""
+        total = 0
+        for path in self.files():
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return total
+
+    def index(self):
+        return SessionIndex(self)
+
+    def _first_record_time(self):
+        if self._first_time is None:
+            try:
+                with open(self.path, 'r') as f:
+                    first = f.readline()
+                self._first_time = SessionRecord.from_json(first).start if first.strip() else None
+            except (OSError, ValueError, KeyError, TypeError):
+                self._first_time = None
+        return self._first_time
+
+    def should_rotate(self, now):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return False
+        if size == 0:
+            return False
+        if size >= self.max_bytes:
+            return True
+        first = self._first_record_time()
+        return first is not None and now - first >= self.max_age
+
+    def rotate(self):
+        os.replace(self.path, f"{self.path}.{self.next_seq():06d}")
+        self._first_time = None
+
+    def append(self, record):
+        line = (record.to_json() + "\n").encode()
+        with self.lock:
+            if self.should_rotate(time.time()):
+                self.rotate()
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            try:
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _reverse_lines(self, path):
+        """Yield complete lines of `path` from last to first"""
+        with open(path, 'rb') as f:
+            position = f.seek(0, os.SEEK_END)
+            remainder = b""
+            while position > 0:
+                step = min(self.BLOCK_SIZE, position)
+                position -= step
+                f.seek(position)
+                lines = (f.read(step) + remainder).split(b"\n")
+                remainder = lines.pop(0)
+                for line in reversed(lines):
+                    if line.strip():
+                        yield line
+            if remainder.strip():
+                yield remainder
+
+    def iter_reverse(self):
+        """Records from newest to oldest across all files"""
+        for path in reversed(self.files()):
+            for line in self._reverse_lines(path):
+                try:
+                    yield SessionRecord.from_json(line)
+                except (ValueError, KeyError, TypeError):
+                    # A torn last line from a crash; skip it
+                    continue
+
+    def tail(self, count, predicate=None):
+        """The last `count` records (matching `predicate`), oldest first"""
+        records = filter(predicate, self.iter_reverse()) if predicate else self.iter_reverse()
+        records = list(itertools.islice(records, count))
+        records.reverse()
+        return records
+
+    def __iter__(self):
+        """Records from oldest to newest across all files"""
+        for path in self.files():
+            with open(path, 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        try:
+                            yield SessionRecord.from_json(line)
+                        except (ValueError, KeyError, TypeError):
+                            continue
+
+
+def is_session(record):
+    """History records without an event are session starts"""
+    return record.event is None
+
+
+def new_session_id():
+    return os.urandom(8).hex()
+
+
+class SessionIndex:
+    """On-disk index of every session in a SessionLog, for paging history.
+
+    One fixed-size entry per session (start time, file, byte offset, end
+    status, blocked attempts, session id) is kept in `<log>.idx` and memory-mapped, so
+    the History tab can jump to any row, bisect a date range and read just
+    the visible records however many sessions there are. `refresh()` scans only the
+    bytes appended since the last call; files are tracked by inode, so a
+    rotation does not force a rebuild.
+    """
+    ENTRY = struct.Struct('<dQHBIQ')
+    STATUS = struct.Struct('<B')
+    ATTEMPTS = struct.Struct('<I')
+    STATUS_OFFSET = 18
+    ATTEMPTS_OFFSET = 19
+    UNKNOWN, COMPLETED, ENDED = 0, 1, 2
+    # Bumped when ENTRY changes; an index of another version is rebuilt
+    VERSION = 2
+
+    def __init__(self, log, path=None):
+        self.log = log
+        self.path = path or log.path + ".idx"
+        self.meta_path = self.path + ".json"
+        self.map = None
+        self.handles = {}
+        self.load_meta()
+        self.refresh()
+
+    def load_meta(self):
+        try:
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta.get('version') != self.VERSION:
+                raise ValueError("old index format")
+            self.files = meta['files']
+            self.count = meta['count']
+            size = os.path.getsize(self.path)
+        except (OSError, ValueError, KeyError):
+            size = None
+        if size is None or size < self.count * self.ENTRY.size:
+            self.reset()
+        elif size > self.count * self.ENTRY.size:
+            # Entries written after the last saved meta are scanned again
+            os.truncate(self.path, self.count * self.ENTRY.size)
+
+    def save_meta(self):
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': self.VERSION, 'files': self.files, 'count': self.count}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def reset(self):
+        self.files = []
+        self.count = 0
+        self.close()
+        with open(self.path, 'wb'):
+            pass
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = {}
+
+    def refresh(self):
+        """Index whatever was appended to the log; True if anything changed"""
+        by_inode = {entry['inode']: entry for entry in self.files}
+        current = []
+        for path in self.log.files():
+            info = os.stat(path)
+            entry = by_inode.get(info.st_ino)
+            if entry is None:
+                entry = {'inode': info.st_ino, 'path': path, 'bytes': 0}
+                self.files.append(entry)
+            elif info.st_size < entry['bytes']:
+                # Rewritten behind our back; start over
+                self.reset()
+                return self.refresh()
+            entry['path'] = path
+            current.append((entry, info.st_size))
+        if len(current) < len(self.files):
+            self.reset()
+            return self.refresh()
+
+        added = False
+        with open(self.path, 'r+b') as index:
+            for entry, size in current:
+                if size > entry['bytes']:
+                    added |= self._scan(index, self.files.index(entry), entry, size)
+        if added:
+            self.save_meta()
+            self.close()
+        return added
+
+    def _scan(self, index, file_id, entry, size):
+        # New entries are packed in memory and written in one go; an end
+        # event almost always follows its own session, still in the buffer
+        pending = bytearray()
+        first = self.count
+        changed = False
+        with open(entry['path'], 'rb') as f:
+            f.seek(entry['bytes'])
+            offset = entry['bytes']
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # half-written; picked up next time
+                try:
+                    record = SessionRecord.from_json(line)
+                    start, key = record.start, self.session_key(record)
+                except (ValueError, KeyError, TypeError):
+                    record = None
+                if record is not None and is_session(record):
+                    pending += self.ENTRY.pack(start, offset, file_id, self.UNKNOWN, 0, key)
+                    self.count += 1
+                elif record is not None and record.event in ('end', 'attempts'):
+                    if record.event == 'end':
+                        field, field_offset = self.STATUS, self.STATUS_OFFSET
+                        update = lambda old, record=record: self.COMPLETED if record.completed else self.ENDED
+                    else:
+                        field, field_offset = self.ATTEMPTS, self.ATTEMPTS_OFFSET
+                        update = lambda old, record=record: old + sum(record.domains.values())
+                    position = self._find_pending(pending, start, key)
+                    if position is not None:
+                        position += field_offset
+                        field.pack_into(pending, position, update(field.unpack_from(pending, position)[0]))
+                    else:
+                        index.seek(first * self.ENTRY.size)
+                        index.write(pending)
+                        first, pending = self.count, bytearray()
+                        self._mark(index, start, key, field, field_offset, update)
+                offset += len(line)
+                changed = True
+        index.seek(first * self.ENTRY.size)
+        index.write(pending)
+        entry['bytes'] = offset
+        return changed
+
+    @staticmethod
+    def session_key(record):
+        """The record's session id as a 64-bit number; 0 for records without one"""
+        try:
+            return int(record.session, 16) & 0xFFFFFFFFFFFFFFFF if record.session else 0
+        except (TypeError, ValueError):
+            return 0
+
+    def _find_pending(self, pending, start, key):
+        """Offset in `pending` of the entry of session (`start`, `key`), or None"""
+        position = len(pending) - self.ENTRY.size
+        # Entries are in start order and the session is nearly always the last one
+        while position >= 0:
+            entry = self.ENTRY.unpack_from(pending, position)
+            if entry[0] < start:
+                break
+            if entry[0] == start and entry[5] == key:
+                return position
+            position -= self.ENTRY.size
+        return None
+
+    def _mark(self, index, start, key, field, field_offset, update):
+        """Rewrite one field of the already written entry of session (`start`, `key`)"""
+        index.flush()
+        position = self.bisect(start, index)
+        while position < self.count:
+            entry = self._entry_from(index, position)
+            if entry[0] != start:
+                return
+            if entry[5] == key:
+                index.seek(position * self.ENTRY.size + field_offset)
+                old = field.unpack(index.read(field.size))[0]
+                index.seek(position * self.ENTRY.size + field_offset)
+                index.write(field.pack(update(old)))
+                return
+            position += 1
+
+    def _entry_from(self, index, position):
+        index.seek(position * self.ENTRY.size)
+        return self.ENTRY.unpack(index.read(self.ENTRY.size))
+
+    def __len__(self):
+        return self.count
+
+    def entry(self, position):
+        """(start, offset, file_id, status, attempts, key) of the session at `position` (oldest first)"""
+        if self.map is None:
+            with open(self.path, 'rb') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.ENTRY.unpack_from(self.map, position * self.ENTRY.size)
+
+    def bisect(self, start, index=None):
+        """First position whose session starts at or after `start`"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._entry_from(index, middle) if index else self.entry(middle)
+            if entry[0] < start:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def between(self, start=None, end=None):
+        """Positions [low, high) of sessions starting in [start, end)"""
+        low = self.bisect(start) if start is not None else 0
+        high = self.bisect(end) if end is not None else self.count
+        return low, max(low, high)
+
+    def page(self, low, high):
+        """Sessions at positions [low, high), oldest first"""
+        return [self.record(position) for position in range(low, high)]
+
+    def record(self, position):
+        """The logged session at `position` as a SessionRecord with its end status and attempts"""
+        _, offset, file_id, status, attempts, _ = self.entry(position)
+        handle = self.handles.get(file_id)
+        if handle is None:
+            handle = self.handles[file_id] = open(self.files[file_id]['path'], 'rb')
+        handle.seek(offset)
+        record = SessionRecord.from_json(handle.readline())
+        record.status = status
+        record.attempts = attempts
+        return record
+
+
+def iter_json_array(f, chunk_size=65536):
+    """Yield the items of a top-level JSON array in file `f` without loading it whole"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    opened = False
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position < len(buffer):
+            if not opened:
+                if buffer[position] != "[":
+                    raise ValueError("not a JSON array")
+                opened = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                end = None
+            # Only trust an item once a separator follows it: a number may
+            # continue in the next chunk
+            if end is not None and end < len(buffer) and buffer[end] in " \t\r\n,]":
+                yield item
+                position = end
+                continue
+        chunk = f.read(chunk_size)
+        if not chunk:
+            raise ValueError("unterminated JSON array")
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+class Database:
+    """SQLite file holding the config and the history (the 'sqlite' storage).
+
+    WAL mode lets the window, the daemon and the CLI read while one of
+    them writes. Sessions are indexed on start time, so the History tab
+    pages and filters with range queries. One connection per process is
+    shared by its threads under a lock.
+    """
+    VERSION = 4
+    BATCH = 5000
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY, start_time REAL NOT NULL, "
+        "event TEXT, status INTEGER NOT NULL DEFAULT 0, record TEXT NOT NULL, "
+        "attempts INTEGER NOT NULL DEFAULT 0, session TEXT)",
+        "CREATE INDEX IF NOT EXISTS history_sessions ON history(start_time) WHERE event IS NULL",
+        "CREATE TABLE IF NOT EXISTS snapshots (id TEXT PRIMARY KEY, sites TEXT NOT NULL) WITHOUT ROWID",
+    )
+
+    def __init__(self, path=DATABASE_FILE, readonly=False):
+        import sqlite3
+        self.path = path
+        self.lock = threading.RLock()
+        if readonly:
+            # Exports read copies that may sit on read-only media; never touch them
+            import urllib.parse
+            uri = "file:" + urllib.parse.quote(os.path.abspath(path))
+            self.connection = sqlite3.connect(uri + "?mode=ro", uri=True, timeout=10.0,
+                                              check_same_thread=False)
+            try:
+                self.connection.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+            except sqlite3.OperationalError:
+                # A WAL database without its -shm file in a read-only directory
+                self.connection.close()
+                self.connection = sqlite3.connect(uri + "?immutable=1", uri=True, check_same_thread=False)
+            return
+        self.connection = sqlite3.connect(path, timeout=10.0, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # Same durability as the fsync'd JSON files
+        self.connection.execute("PRAGMA synchronous=FULL")
+
+    @property
+    def version(self):
+        with self.lock:
+            return self.connection.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self, config_path=None, history_log=None):
+        """Create the schema and carry over the JSON config and history in one transaction.
+
+        Records are streamed from the log in batches of prepared inserts;
+        afterwards the JSON files are renamed to `.migrated`. Returns False
+        if the database was already set up (possibly by another process).
+        Running it on an older schema only adds the missing tables and columns.
+        """
+        with self.lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if connection.execute("PRAGMA user_version").fetchone()[0] >= self.VERSION:
+                    connection.rollback()
+                    return False
+                for statement in self.SCHEMA:
+                    connection.execute(statement)
+                columns = {row[1] for row in connection.execute("PRAGMA table_info(history)")}
+                if 'attempts' not in columns:
+                    connection.execute("ALTER TABLE history ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+                if 'session' not in columns:
+                    connection.execute("ALTER TABLE history ADD COLUMN session TEXT")
+                config = {}
+                if config_path and os.path.exists(config_path):
+                    with open(config_path, 'r') as f:
+                        config = json.load(f)
+                connection.executemany("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
+                                       ((key, json.dumps(value)) for key, value in config.items()))
+                migrated = 0
+                if history_log is not None:
+                    snapshots = dict(history_log.snapshots.items())
+                    records = iter(history_log)
+                    for batch in iter(lambda: list(itertools.islice(records, self.BATCH)), []):
+                        for record in batch:
+                            # Older records carry their site list inline
+                            if isinstance(record.sites, tuple):
+                                record.sites, sites = SiteSnapshots.key(record.sites)
+                                snapshots[record.sites] = sites
+                        self._insert_history(batch)
+                        migrated += len(batch)
+                    connection.executemany("INSERT OR IGNORE INTO snapshots (id, sites) VALUES (?, ?)",
+                                           ((snapshot_id, json.dumps(sites))
+                                            for snapshot_id, sites in snapshots.items()))
+                connection.execute(f"PRAGMA user_version = {self.VERSION}")
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+        paths = [config_path] if config else []
+        if history_log is not None:
+            paths += history_log.files()
+            if os.path.exists(history_log.snapshots.path):
+                paths.append(history_log.snapshots.path)
+        for path in paths:
+            os.replace(path, path + ".migrated")
+        if migrated:
+            print(f"Migrated {migrated} history records to {self.path}")
+        return True
+
+    def _insert_history(self, records):
+        rows = []
+        ends = []
+        attempts = []
+        for record in records:
+            rows.append((record.start, record.event, record.session, record.to_json()))
+            # Events find their session by start and id; IS also matches old rows without an id
+            if record.event == 'end':
+                ends.append((SessionIndex.COMPLETED if record.completed else SessionIndex.ENDED,
+                             record.start, record.session))
+            elif record.event == 'attempts':
+                attempts.append((sum(record.domains.values()), record.start, record.session))
+        self.connection.executemany("INSERT INTO history (start_time, event, session, record) "
+                                    "VALUES (?, ?, ?, ?)", rows)
+        self.connection.executemany("UPDATE history SET status = ? "
+                                    "WHERE event IS NULL AND start_time = ? AND session IS ?", ends)
+        self.connection.executemany("UPDATE history SET attempts = attempts + ? "
+                                    "WHERE event IS NULL AND start_time = ? AND session IS ?", attempts)
+
+    def append_history(self, records):
+        with self.lock, self.connection:
+            self._insert_history(records)
+
+    def read_config(self):
+        with self.lock:
+            return {key: json.loads(value)
+                    for key, value in self.connection.execute("SELECT key, value FROM config")}
+
+    def write_config(self, data):
+        """Replace the stored config with `data`, touching only the rows that changed"""
+        values = [(key, json.dumps(value)) for key, value in data.items()]
+        with self.lock, self.connection:
+            stale = {key for (key,) in self.connection.execute("SELECT key FROM config")} - data.keys()
+            self.connection.executemany("DELETE FROM config WHERE key = ?", ((key,) for key in stale))
+            self.connection.executemany(
+                "INSERT INTO config (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value WHERE value != excluded.value", values)
+
+    def put_snapshot(self, snapshot_id, sites):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO snapshots (id, sites) VALUES (?, ?)",
+                                    (snapshot_id, json.dumps(sites)))
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class SqliteConfigStore(ConfigStore):
+    """ConfigStore whose writer thread upserts into the database.
+
+    The database file's mtime is bumped after each write so FileWatcher
+    (the daemon's config watch) notices changes committed to the WAL.
+    """
+
+    def __init__(self, database, delay=0.5):
+        self.database = database
+        super().__init__(database.path, delay)
+
+    def load(self):
+        # The path is the database itself, never a JSON file
+        return self.database.read_config() or self.defaults()
+
+    def _write(self, payload):
+        self.database.write_config(json.loads(payload))
+        os.utime(self.path)
+        self.writes += 1
+
+
+class SqliteSiteSnapshots(SiteSnapshots):
+    """SiteSnapshots in the database's snapshots table"""
+
+    def __init__(self, database):
+        super().__init__(database.path)
+        self.database = database
+
+    def load(self):
+        return {snapshot_id: tuple(json.loads(sites))
+                for snapshot_id, sites in self.database.query("SELECT id, sites FROM snapshots")}
+
+    def store(self, snapshot_id, sites):
+        self.database.put_snapshot(snapshot_id, sites)
+
+
+class SqliteSessionLog:
+    """History in the database, with the SessionLog and SessionIndex interfaces.
+
+    Positions count sessions oldest first, as in SessionIndex; end events
+    set the status of their session when they are appended.
+    """
+    PAGE = 1000
+
+    def __init__(self, database):
+        self.database = database
+        self.path = database.path
+        self.snapshots = SqliteSiteSnapshots(database)
+        self.count = 0
+        self.last_id = None
+        self.refresh()
+
+    def append(self, record):
+        self.database.append_history([record])
+
+    def size(self):
+        """Grows with every append; the analytics cache is checked against it"""
+        return self.database.query("SELECT COALESCE(MAX(id), 0) FROM history")[0][0]
+
+    def files(self):
+        return [self.path]
+
+    def index(self):
+        return self
+
+    def _iter(self, order, compare):
+        last = None
+        while True:
+            if last is None:
+                rows = self.database.query(f"SELECT id, record FROM history ORDER BY id {order} LIMIT ?",
+                                           (self.PAGE,))
+            else:
+                rows = self.database.query(f"SELECT id, record FROM history WHERE id {compare} ? "
+                                           f"ORDER BY id {order} LIMIT ?", (last, self.PAGE))
+            for last, record in rows:
+                yield SessionRecord.from_json(record)
+            if len(rows) < self.PAGE:
+                return
+
+    def __iter__(self):
+        """Records from oldest to newest"""
+        return self._iter('ASC', '>')
+
+    def iter_reverse(self):
+        return self._iter('DESC', '<')
+
+    def tail(self, count, predicate=None):
+        """The last `count` records (matching `predicate`), oldest first"""
+        records = filter(predicate, self.iter_reverse()) if predicate else self.iter_reverse()
+        records = list(itertools.islice(records, count))
+        records.reverse()
+        return records
+
+    def refresh(self):
+        """Re-count sessions; True if anything was appended since the last call"""
+        count, last_id = self.database.query(
+            "SELECT (SELECT COUNT(*) FROM history WHERE event IS NULL), MAX(id) FROM history")[0]
+        changed = last_id != self.last_id
+        self.count, self.last_id = count, last_id
+        return changed
+
+    def __len__(self):
+        return self.count
+
+    def bisect(self, start):
+        """First position whose session starts at or after `start`"""
+        return self.database.query("SELECT COUNT(*) FROM history WHERE event IS NULL AND start_time < ?",
+                                   (start,))[0][0]
+
+    def between(self, start=None, end=None):
+        """Positions [low, high) of sessions starting in [start, end)"""
+        low = self.bisect(start) if start is not None else 0
+        high = self.bisect(end) if end is not None else self.count
+        return low, max(low, high)
+
+    def page(self, low, high):
+        """SessionRecords at positions [low, high), oldest first, with their end status and attempts"""
+        if high <= low:
+            return []
+        # OFFSET walks the index, so count from whichever end is nearer
+        if low <= self.count - high:
+            rows = self.database.query("SELECT record, status, attempts FROM history WHERE event IS NULL "
+                                       "ORDER BY start_time, id LIMIT ? OFFSET ?", (high - low, low))
+        else:
+            rows = self.database.query("SELECT record, status, attempts FROM history WHERE event IS NULL "
+                                       "ORDER BY start_time DESC, id DESC LIMIT ? OFFSET ?",
+                                       (high - low, self.count - high))
+            rows.reverse()
+        records = []
+        for record, status, attempts in rows:
+            record = SessionRecord.from_json(record)
+            record.status = status
+            record.attempts = attempts
+            records.append(record)
+        return records
+
+    def record(self, position):
+        return self.page(position, position + 1)[0]
+
+    def close(self):
+        pass
+
+
+EXPORT_FIELDS = ('source', 'start', 'end', 'planned_minutes', 'focus_minutes', 'status', 'attempts',
+                 'schedule', 'sites')
+REPORT_FIELDS = ('period', 'sessions', 'completed', 'ended_early', 'planned_hours', 'focus_hours', 'attempts')
+
+
+def history_source(path):
+    """(records, site snapshots) of a history copied from any machine.
+
+    `path` may be a JSONL log (its rotated files are read too), the old
+    JSON array file or a MarThaba SQLite database. Records are streamed
+    oldest first.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(16)
+    if head.startswith(b"SQLite format 3"):
+        log = SqliteSessionLog(Database(path, readonly=True))
+        return iter(log), log.snapshots
+    if head.lstrip().startswith(b"["):
+        def legacy():
+            with open(path, 'r') as f:
+                for item in iter_json_array(f):
+                    try:
+                        yield SessionRecord.from_dict(item)
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        # Old records carry their sites inline
+        return legacy(), SiteSnapshots(path + ".sites")
+    log = SessionLog(path, legacy_path=None)
+    return iter(log), log.snapshots
+
+
+def iter_sessions(records):
+    """Fold log records into (session, end event or None), oldest first.
+
+    A session's events follow it in the log, so only the latest session is
+    held; its blocked attempts are summed into `session.attempts`.
+    """
+    session = end = None
+    for record in records:
+        if record.event is None:
+            if session is not None:
+                yield session, end
+            session, end = record, None
+        elif session is not None and record.key == session.key:
+            if record.event == 'end':
+                end = record
+            elif record.event == 'attempts' and record.domains:
+                session.attempts += sum(record.domains.values())
+    if session is not None:
+        yield session, end
+
+
+def export_rows(sessions, snapshots, source, start=None, end=None, now=None):
+    """EXPORT_FIELDS dicts of the sessions starting in [start, end)"""
+    now = time.time() if now is None else now
+    for session, finished in sessions:
+        if start is not None and session.start < start:
+            continue
+        if end is not None and session.start >= end:
+            # The log is in start order
+            break
+        planned = session.end - session.start
+        if finished is not None:
+            status = 'completed' if finished.completed else 'ended_early'
+            focus = finished.end - session.start
+        elif session.end > now:
+            status = 'in_progress'
+            focus = now - session.start
+        else:
+            # Older logs have no end events
+            status = 'completed'
+            focus = planned
+        yield {
+            'source': source,
+            'start': datetime.datetime.fromtimestamp(session.start).isoformat(timespec='seconds'),
+            'end': datetime.datetime.fromtimestamp(session.start + focus).isoformat(timespec='seconds'),
+            'planned_minutes': round(planned / 60, 1),
+            'focus_minutes': round(focus / 60, 1),
+            'status': status,
+            'attempts': session.attempts,
+            'schedule': session.schedule or '',
+            'sites': ' '.join(snapshots.get(session.sites)) if session.sites else '',
+        }
+
+
+def period_of(row, period):
+    """'2024-03-05' (day), '2024-W10' (ISO week) or '2024-03' (month) of an export row"""
+    day = row['start'][:10]
+    if period == 'week':
+        year, week, _ = datetime.date.fromisoformat(day).isocalendar()
+        return f"{year}-W{week:02d}"
+    return day[:7] if period == 'month' else day
+
+
+def report_rows(rows, period):
+    """REPORT_FIELDS totals per day, week or month of export rows in start order"""
+    for key, group in itertools.groupby(rows, lambda row: period_of(row, period)):
+        totals = {'period': key, 'sessions': 0, 'completed': 0, 'ended_early': 0,
+                  'planned_hours': 0.0, 'focus_hours': 0.0, 'attempts': 0}
+        for row in group:
+            totals['sessions'] += 1
+            if row['status'] in ('completed', 'ended_early'):
+                totals[row['status']] += 1
+            totals['planned_hours'] += row['planned_minutes'] / 60
+            totals['focus_hours'] += row['focus_minutes'] / 60
+            totals['attempts'] += row['attempts']
+        totals['planned_hours'] = round(totals['planned_hours'], 2)
+        totals['focus_hours'] = round(totals['focus_hours'], 2)
+        yield totals
+
+
+def write_rows(rows, fields, out, fmt='csv'):
+    """Write rows to `out` one at a time as CSV or NDJSON; returns the row count"""
+    count = 0
+    if fmt == 'csv':
+        import csv
+        writer = csv.DictWriter(out, fields, lineterminator="\n")
+        writer.writeheader()
+        for count, row in enumerate(rows, 1):
+            writer.writerow(row)
+    else:
+        for count, row in enumerate(rows, 1):
+            out.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')) + "\n")
+    return count
+
+
+class FocusAnalytics:
+    """Rolling focus statistics kept up to date as sessions are logged.
+
+    Aggregates (seconds per day, weekday x hour heatmap, streaks,
+    completion counts and blocked attempts per domain) are updated per
+    record and cached in a small JSON file; the History tab reads them
+    without touching the log. When the
+    cache is missing or stale it is rebuilt from the log in column passes.
+    """
+
+    def __init__(self, log, cache_path=ANALYTICS_FILE):
+        self.log = log
+        self.cache_path = cache_path
+        self.reset()
+        if not self.load_cache():
+            self.rebuild()
+
+    def reset(self):
+        self.day_seconds = {}
+        self.heatmap = [[0.0] * 24 for _ in range(7)]
+        self.started = 0
+        self.ended = 0
+        self.completed = 0
+        self.last_day = None
+        self.current_streak = 0
+        self.best_streak = 0
+        self.blocked = collections.Counter()
+        self.log_bytes = 0
+
+    def log_size(self):
+        return self.log.size()
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('log_bytes') != self.log_size() or 'blocked' not in data:
+            return False
+        self.day_seconds = data['day_seconds']
+        self.heatmap = data['heatmap']
+        self.started = data['started']
+        self.ended = data['ended']
+        self.completed = data['completed']
+        self.last_day = data['last_day']
+        self.current_streak = data['current_streak']
+        self.best_streak = data['best_streak']
+        self.blocked = collections.Counter(data['blocked'])
+        self.log_bytes = data['log_bytes']
+        return True
+
+    def save_cache(self):
+        data = {
+            'log_bytes': self.log_bytes,
+            'day_seconds': self.day_seconds,
+            'heatmap': self.heatmap,
+            'started': self.started,
+            'ended': self.ended,
+            'completed': self.completed,
+            'last_day': self.last_day,
+            'current_streak': self.current_streak,
+            'best_streak': self.best_streak,
+            'blocked': self.blocked
+        }
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=".analytics-", dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Analytics cache error: {e}")
+
+    def _add_day(self, day):
+        """Advance the streak for a session started on ISO date `day`"""
+        if day == self.last_day:
+            return
+        if self.last_day is not None and day < self.last_day:
+            # Out-of-order record; only the totals are affected
+            return
+        previous = datetime.date.fromisoformat(self.last_day) if self.last_day else None
+        if previous is not None and datetime.date.fromisoformat(day) - previous == datetime.timedelta(days=1):
+            self.current_streak += 1
+        else:
+            self.current_streak = 1
+        self.last_day = day
+        self.best_streak = max(self.best_streak, self.current_streak)
+
+    def observe(self, record):
+        """Fold one new log record into the aggregates"""
+        start = datetime.datetime.fromtimestamp(record.start)
+        day = start.date().isoformat()
+        if is_session(record):
+            seconds = record.end - record.start
+            self.started += 1
+            self.day_seconds[day] = self.day_seconds.get(day, 0) + seconds
+            self.heatmap[start.weekday()][start.hour] += seconds
+            self._add_day(day)
+        elif record.event == 'end':
+            self.ended += 1
+            if record.completed:
+                self.completed += 1
+            # An emergency stop shortens the planned time
+            actual = record.end - record.start
+            delta = max(0.0, actual) - (actual if record.planned is None else record.planned)
+            if delta:
+                self.day_seconds[day] = max(0.0, self.day_seconds.get(day, 0) + delta)
+                self.heatmap[start.weekday()][start.hour] = max(
+                    0.0, self.heatmap[start.weekday()][start.hour] + delta)
+        elif record.event == 'attempts':
+            self.blocked.update(record.domains)
+
+    def record(self, record):
+        """Observe a record that was just appended to the log and persist"""
+        self.observe(record)
+        self.log_bytes = self.log_size()
+        self.save_cache()
+
+    def rebuild(self):
+        """Recompute everything from the log using column arrays"""
+        self.reset()
+        starts = array.array('d')
+        seconds = array.array('d')
+        ends = {}
+        for record in self.log:
+            if is_session(record):
+                starts.append(record.start)
+                seconds.append(record.end - record.start)
+            elif record.event == 'end':
+                ends[record.key] = record
+            elif record.event == 'attempts':
+                self.blocked.update(record.domains)
+        self.started = len(starts)
+        self.ended = len(ends)
+        self.completed = sum(1 for end in ends.values() if end.completed)
+        for end in ends.values():
+            actual = end.end - end.start
+            starts.append(end.start)
+            seconds.append(max(0.0, actual) - (actual if end.planned is None else end.planned))
+        self._aggregate(starts, seconds)
+        self.log_bytes = self.log_size()
+        self.save_cache()
+
+    def _aggregate(self, starts, seconds):
+        if not starts:
+            return
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        # Local-time buckets: day ordinal, weekday and hour for every start
+        stamps = [datetime.datetime.fromtimestamp(ts) for ts in starts]
+        days = array.array('l', (stamp.toordinal() for stamp in stamps))
+        slots = array.array('l', (stamp.weekday() * 24 + stamp.hour for stamp in stamps))
+        if numpy is not None:
+            weights = numpy.frombuffer(seconds, dtype=numpy.float64)
+            day_index = numpy.frombuffer(days, dtype=numpy.int64) if days.itemsize == 8 else numpy.array(days)
+            first_day = int(day_index.min())
+            per_day = numpy.bincount(day_index - first_day, weights=weights)
+            per_slot = numpy.bincount(numpy.array(slots), weights=weights, minlength=168)
+            day_totals = {first_day + i: float(total) for i, total in enumerate(per_day) if total}
+            slot_totals = [float(total) for total in per_slot]
+        else:
+            day_totals = collections.defaultdict(float)
+            slot_totals = [0.0] * 168
+            for day, slot, weight in zip(days, slots, seconds):
+                day_totals[day] += weight
+                slot_totals[slot] += weight
+        self.day_seconds = {datetime.date.fromordinal(day).isoformat(): max(0.0, total)
+                            for day, total in sorted(day_totals.items())}
+        self.heatmap = [[max(0.0, total) for total in slot_totals[i * 24:(i + 1) * 24]] for i in range(7)]
+        # Streaks need the distinct session days in order
+        for day in sorted(set(days)):
+            self._add_day(datetime.date.fromordinal(day).isoformat())
+
+    def today_seconds(self, today=None):
+        today = today or datetime.date.today()
+        return self.day_seconds.get(today.isoformat(), 0)
+
+    def week_seconds(self, today=None):
+        today = today or datetime.date.today()
+        return sum(self.day_seconds.get((today - datetime.timedelta(days=i)).isoformat(), 0)
+                   for i in range(7))
+
+    def streak(self, today=None):
+        """Current streak; broken if the last session day is before yesterday"""
+        today = today or datetime.date.today()
+        if self.last_day is None:
+            return 0
+        if today - datetime.date.fromisoformat(self.last_day) > datetime.timedelta(days=1):
+            return 0
+        return self.current_streak
+
+    def completion_rate(self):
+        return self.completed / self.ended if self.ended else None
+
+    def blocked_attempts(self):
+        return sum(self.blocked.values())
+
+
+def boot_clock():
+    """Monotonic seconds that keep counting through suspend where possible"""
+    if hasattr(time, 'CLOCK_BOOTTIME'):
+        return time.clock_gettime(time.CLOCK_BOOTTIME)
+    return time.monotonic()
+
+
+class FocusTimer:
+    """Session countdown anchored to a monotonic deadline.
+
+    Wall-clock times are converted once when the session starts, resumes
+    or is shortened; ticks then only read the monotonic clock, so clock
+    changes do not shift the countdown and time spent suspended counts.
+    """
+
+    def __init__(self, clock=boot_clock):
+        self.clock = clock
+        self.started_at = None
+        self.deadline = None
+
+    def start(self, start_wall, end_wall):
+        """Anchor to wall-clock epoch seconds (as stored in the config)"""
+        now_clock, now_wall = self.clock(), time.time()
+        self.started_at = now_clock - (now_wall - start_wall)
+        self.deadline = now_clock + (end_wall - now_wall)
+
+    def set_end(self, end_wall):
+        self.deadline = self.clock() + (end_wall - time.time())
+
+    def stop(self):
+        self.started_at = None
+        self.deadline = None
+
+    @property
+    def running(self):
+        return self.deadline is not None
+
+    def remaining(self):
+        return max(0.0, self.deadline - self.clock()) if self.running else 0.0
+
+    def elapsed(self):
+        return max(0.0, self.clock() - self.started_at) if self.running else 0.0
+
+    def next_tick_ms(self):
+        """Delay until the remaining time crosses the next whole second"""
+        fraction = self.remaining() % 1.0
+        return max(1, int(fraction * 1000) + 1)
+
+    @staticmethod
+    def split(seconds):
+        seconds = int(seconds)
+        return seconds // 3600, (seconds % 3600) // 60, seconds % 60
+
+    def texts(self):
+        """(elapsed, remaining, countdown) label texts for the current instant"""
+        # Round remaining up so the countdown reaches 0s exactly at the deadline
+        remaining = math.ceil(self.remaining())
+        eh, em, es = self.split(self.elapsed())
+        rh, rm, rs = self.split(remaining)
+        if remaining > 3600:
+            countdown = f"⏳ {rh}h {rm}m {rs}s"
+        elif remaining > 60:
+            countdown = f"⏳ {rm}m {rs}s"
+        else:
+            countdown = f"⏳ {rs}s"
+        return (f"Elapsed: {eh:02d}:{em:02d}:{es:02d}",
+                f"Remaining: {rh:02d}:{rm:02d}:{rs:02d}",
+                countdown)
+
+
+class SessionState:
+    """The focus session shared by the Tk thread and the enforcement worker.
+
+    All fields are read and written under one lock; every change bumps
+    `version` and wakes waiters, so the worker reacts to start, emergency
+    stop, session end and hosts tampering immediately instead of polling.
+    Times are epoch seconds.
+    """
+    __slots__ = ('active', 'start_time', 'end_time', 'duration', 'allowed_sites',
+                 'emergency_used', 'session_id', 'version', 'tampered', 'closed', 'lock', 'changed')
+
+    def __init__(self):
+        self.active = False
+        self.start_time = None
+        self.session_id = None
+        self.end_time = None
+        self.duration = 0.0
+        self.allowed_sites = ()
+        self.emergency_used = False
+        self.version = 0
+        self.tampered = False
+        self.closed = False
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+    @classmethod
+    def from_config(cls, config):
+        state = cls()
+        if config.get('active') and config.get('end_time'):
+            state.active = True
+            state.start_time = datetime.datetime.fromisoformat(config['start_time']).timestamp()
+            state.end_time = datetime.datetime.fromisoformat(config['end_time']).timestamp()
+            state.duration = config.get('duration', 0)
+            state.emergency_used = config.get('emergency_used', False)
+            state.session_id = config.get('session_id')
+        state.allowed_sites = tuple(config.get('allowed_sites', []))
+        return state
+
+    FIELDS = ('active', 'start_time', 'end_time', 'duration', 'allowed_sites', 'emergency_used', 'session_id')
+
+    def load(self, config):
+        """Take over the session from a re-read config; True if anything changed"""
+        fresh = SessionState.from_config(config)
+        with self.lock:
+            if all(getattr(self, name) == getattr(fresh, name) for name in self.FIELDS):
+                return False
+            for name in self.FIELDS:
+                setattr(self, name, getattr(fresh, name))
+            self._bump()
+            return True
+
+    def store(self, config):
+        """Copy the session fields into the config dict (caller saves it)"""
+        with self.lock:
+            config['active'] = self.active
+            config['emergency_used'] = self.emergency_used
+            if self.start_time is not None:
+                config['start_time'] = datetime.datetime.fromtimestamp(self.start_time).isoformat()
+                config['end_time'] = datetime.datetime.fromtimestamp(self.end_time).isoformat()
+                config['duration'] = self.duration
+                config['session_id'] = self.session_id
+
+    def _bump(self):
+        self.version += 1
+        self.changed.notify_all()
+
+    def start(self, start_time, end_time, allowed_sites, session_id=None):
+        with self.lock:
+            self.active = True
+            self.start_time = start_time
+            self.session_id = session_id
+            self.end_time = end_time
+            self.duration = (end_time - start_time) / 3600
+            self.allowed_sites = tuple(allowed_sites)
+            self.emergency_used = False
+            self._bump()
+
+    def emergency(self, end_time):
+        """Move the end of the session; False if the stop was already used"""
+        with self.lock:
+            if not self.active or self.emergency_used:
+                return False
+            self.end_time = end_time
+            self.emergency_used = True
+            self._bump()
+            return True
+
+    def finish(self):
+        with self.lock:
+            self.active = False
+            self._bump()
+
+    def set_allowed_sites(self, sites):
+        with self.lock:
+            self.allowed_sites = tuple(sites)
+            self._bump()
+
+    def notify_tamper(self):
+        with self.lock:
+            self.tampered = True
+            self.changed.notify_all()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self._bump()
+
+    def snapshot(self):
+        with self.lock:
+            return self.version, self.active, self.end_time, self.allowed_sites
+
+    def wait(self, version, timeout=None):
+        """Sleep until the state moves past `version`, tampering, or `timeout`; True if tampered"""
+        with self.lock:
+            if self.version == version and not self.tampered and not self.closed:
+                self.changed.wait(timeout)
+            tampered = self.tampered
+            self.tampered = False
+            return tampered
+
+
+class EnforcementWorker:
+    """Applies the block while the session is active and clears it afterwards.
+
+    Sleeps on SessionState between events; the hosts watcher runs on its own
+    thread and only raises the tamper flag. A failed apply (sudo refused,
+    helper down) is retried with exponential backoff until it succeeds.
+    """
+    RETRY_MIN = 1.0
+    RETRY_MAX = 60.0
+
+    def __init__(self, session, backend_kind='hosts', blocklist=lambda: None, hosts_file=HOSTS_FILE,
+                 proxy=None, block_page=None):
+        self.session = session
+        self.backend_kind = backend_kind
+        self.blocklist = blocklist
+        self.hosts_file = hosts_file
+        self.proxy = proxy
+        self.block_page = block_page
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def run(self):
+        backend = None
+        watcher = None
+        applied_version = None
+        tampered = False
+        retry = self.RETRY_MIN
+        while not self.session.closed:
+            version, active, end_time, allowed_sites = self.session.snapshot()
+            remaining = end_time - time.time() if active else 0
+            if remaining > 0:
+                if backend is None:
+                    backend = enforcement_backend(self.backend_kind, self.hosts_file)
+                    watcher = FileWatcher(backend.hosts_file)
+                    threading.Thread(target=watcher.watch, args=(self.session.notify_tamper,),
+                                     daemon=True).start()
+                timeout = remaining
+                if version != applied_version or tampered:
+                    if self.apply(backend, allowed_sites):
+                        applied_version = version
+                        retry = self.RETRY_MIN
+                    else:
+                        # Waking up without a change tries again
+                        applied_version = None
+                        timeout = min(remaining, retry)
+                        retry = min(retry * 2, self.RETRY_MAX)
+                tampered = self.session.wait(version, timeout)
+                continue
+
+            if backend is not None:
+                watcher.close()
+                self.clear(backend)
+                backend = watcher = None
+                applied_version = None
+                retry = self.RETRY_MIN
+            # Nothing to enforce: sleep until the session changes
+            self.session.wait(version)
+            tampered = False
+
+        if backend is not None:
+            watcher.close()
+            if isinstance(backend, HelperClient):
+                backend.close()
+
+    def apply(self, backend, allowed_sites):
+        """True once the block is in place"""
+        started = time.perf_counter()
+        try:
+            # Single read, in-memory diff, write only when something changed
+            blocklist = self.blocklist()
+            stats = backend.apply(DEFAULT_BLOCKED, allowed_sites, blocklist)
+            METRICS.record_cycle('apply', stats, time.perf_counter() - started)
+            if self.proxy is not None:
+                self.proxy.configure(True, DEFAULT_BLOCKED, allowed_sites, blocklist, DEFAULT_BLOCKED_PATHS)
+            if self.block_page is not None:
+                self.block_page.configure((int(self.session.start_time), self.session.session_id))
+            return True
+        except Exception as e:
+            METRICS.inc('marthaba_enforcement_errors_total', op='apply')
+            print(f"Blocking error: {e}")
+            return False
+
+    def clear(self, backend):
+        started = time.perf_counter()
+        if self.proxy is not None:
+            self.proxy.configure(False)
+        if self.block_page is not None:
+            self.block_page.configure(None)
+        try:
+            stats = backend.clear()
+            METRICS.record_cycle('clear', stats, time.perf_counter() - started)
+        except Exception as e:
+            METRICS.inc('marthaba_enforcement_errors_total', op='clear')
+            print(f"Unblocking error: {e}")
+        if isinstance(backend, HelperClient):
+            backend.close()
+
+
+DAY_NAMES = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+DAY_GROUPS = {'daily': range(7), 'weekdays': range(5), 'weekends': (5, 6)}
+
+
+def parse_days(text):
+    """'mon-fri', 'mon,wed,fri', 'weekdays', 'weekends' or 'daily' -> weekday numbers (Monday is 0)"""
+    text = text.strip().lower()
+    if text in DAY_GROUPS:
+        return list(DAY_GROUPS[text])
+    days = set()
+    for part in text.split(','):
+        first, _, last = part.strip().partition('-')
+        try:
+            start = DAY_NAMES.index(first[:3])
+            stop = DAY_NAMES.index(last[:3]) if last else start
+        except ValueError:
+            raise ValueError(f"invalid days: {text!r}")
+        # mon-fri, or wrapping round the weekend like fri-mon
+        days.update((start + offset) % 7 for offset in range((stop - start) % 7 + 1))
+    return sorted(days)
+
+
+def parse_clock(text):
+    """'9:00' or '09:00' -> datetime.time"""
+    try:
+        hours, minutes = text.strip().split(':')
+        return datetime.time(int(hours), int(minutes))
+    except ValueError:
+        raise ValueError(f"invalid time of day: {text!r}")
+
+
+class FocusSchedule:
+    """A recurring focus block in local wall-clock time.
+
+    'weekly' runs one session from `start` to `end` on each of `days`
+    (Monday is 0; an end before the start runs past midnight). 'pomodoro'
+    chains `rounds` sessions of `focus` minutes with `pause` minute breaks,
+    starting at `start`. Times are resolved in the local timezone day by
+    day, so 09:00 stays 09:00 across DST changes.
+    """
+    KINDS = ('weekly', 'pomodoro')
+
+    def __init__(self, name, kind='weekly', start='09:00', end=None, days=range(7),
+                 focus=25, pause=5, rounds=4):
+        if kind not in self.KINDS:
+            raise ValueError(f"unknown schedule kind: {kind!r}")
+        self.name = name
+        self.kind = kind
+        self.start = parse_clock(start)
+        self.end = None
+        if kind == 'weekly':
+            if not end:
+                raise ValueError("a weekly schedule needs an end time")
+            self.end = parse_clock(end)
+            if self.end == self.start:
+                raise ValueError("schedule start and end are the same")
+        self.days = tuple(sorted(set(days)))
+        self.focus = float(focus)
+        self.pause = float(pause)
+        self.rounds = int(rounds)
+        if not self.days or self.focus <= 0 or self.pause < 0 or self.rounds < 1:
+            raise ValueError("schedule needs days, a positive focus length and at least one round")
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def as_dict(self):
+        data = {'name': self.name, 'kind': self.kind, 'start': self.start.strftime('%H:%M'),
+                'days': list(self.days)}
+        if self.kind == 'weekly':
+            data['end'] = self.end.strftime('%H:%M')
+        else:
+            data.update(focus=self.focus, pause=self.pause, rounds=self.rounds)
+        return data
+
+    def occurrences(self, day):
+        """(start, end) epoch pairs of the sessions this schedule starts on `day`"""
+        if day.weekday() not in self.days:
+            return []
+        start = datetime.datetime.combine(day, self.start)
+        if self.kind == 'weekly':
+            end = datetime.datetime.combine(day, self.end)
+            if end <= start:
+                end += datetime.timedelta(days=1)
+            return [(start.timestamp(), end.timestamp())]
+        first = start.timestamp()
+        step = (self.focus + self.pause) * 60
+        return [(first + i * step, first + i * step + self.focus * 60) for i in range(self.rounds)]
+
+
+def schedule_signature(schedules):
+    """Identifies a schedule list and the timezone its occurrences were computed in"""
+    import hashlib
+    payload = json.dumps([schedules, time.tzname, time.timezone], sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+class ScheduleQueue:
+    """Upcoming scheduled sessions in a min-heap of (start, end, name).
+
+    Occurrences are expanded HORIZON_DAYS ahead, one day at a time as the
+    horizon moves. The heap is saved to its own file (not the shared
+    config) with a signature of the schedules, so a restart reuses it
+    without expanding anything.
+    """
+    HORIZON_DAYS = 7
+
+    def __init__(self, schedules, path=SCHEDULE_FILE):
+        self.schedules = [FocusSchedule.from_dict(data) for data in schedules]
+        self.signature = schedule_signature(schedules)
+        self.path = path
+        self.lock = threading.Lock()
+        self.heap = []
+        self.expanded_through = 0  # ordinal of the last expanded day
+        self.dirty = False
+        state = self.load_state()
+        # Start of the last occurrence taken, so it is not started twice
+        self.handled = state.get('handled', 0.0)
+        if state.get('signature') == self.signature:
+            self.heap = [tuple(item) for item in state.get('upcoming', [])]
+            heapq.heapify(self.heap)
+            self.expanded_through = state.get('expanded_through', 0)
+
+    def _fill(self, now):
+        today = datetime.date.fromtimestamp(now).toordinal()
+        last = today + self.HORIZON_DAYS
+        if last <= self.expanded_through:
+            return
+        # From yesterday, for sessions running past midnight
+        for ordinal in range(max(self.expanded_through + 1, today - 1), last + 1):
+            day = datetime.date.fromordinal(ordinal)
+            for schedule in self.schedules:
+                for start, end in schedule.occurrences(day):
+                    if end > now:
+                        heapq.heappush(self.heap, (start, end, schedule.name))
+        self.expanded_through = last
+        self.dirty = True
+
+    def upcoming(self, now, limit=5):
+        """The next `limit` occurrences starting after `now`"""
+        with self.lock:
+            self._fill(now)
+            return heapq.nsmallest(limit, (item for item in self.heap if item[0] > now))
+
+    def next_start(self, now):
+        upcoming = self.upcoming(now, 1)
+        return upcoming[0][0] if upcoming else None
+
+    def take_due(self, now):
+        """Pop every occurrence that has started; returns the one still running, if not taken before"""
+        due = None
+        with self.lock:
+            self._fill(now)
+            while self.heap and self.heap[0][0] <= now:
+                item = heapq.heappop(self.heap)
+                self.dirty = True
+                if item[1] > now and item[0] > self.handled:
+                    due = item
+            if due is not None:
+                self.handled = due[0]
+        return due
+
+    def load_state(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def sync_handled(self):
+        """Adopt an occurrence another process took in the meantime"""
+        self.handled = max(self.handled, self.load_state().get('handled', 0.0))
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            state = {'signature': self.signature, 'handled': self.handled,
+                     'expanded_through': self.expanded_through,
+                     'upcoming': [list(item) for item in sorted(self.heap)]}
+            self.dirty = False
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=".marthaba-schedule-", dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Schedule save error: {e}")
+
+
+class WallClockTimer:
+    """Sleeps until a wall-clock time, through suspend and clock changes.
+
+    Uses an absolute CLOCK_REALTIME timerfd, which fires right after a
+    resume if the time passed while suspended and is cancelled when the
+    clock is set. Without timerfd it sleeps at most `max_sleep` seconds at
+    a time and re-reads the clock.
+    """
+    CLOCK_REALTIME = 0
+    TFD_NONBLOCK = 0o4000
+    TFD_CLOEXEC = 0o2000000
+    TFD_TIMER_ABSTIME = 1
+    TFD_TIMER_CANCEL_ON_SET = 2
+
+    class ITimerSpec(ctypes.Structure):
+        _fields_ = [('interval_sec', ctypes.c_long), ('interval_nsec', ctypes.c_long),
+                    ('value_sec', ctypes.c_long), ('value_nsec', ctypes.c_long)]
+
+    def __init__(self, max_sleep=60.0):
+        self.max_sleep = max_sleep
+        self.libc = None
+        self.fd = None
+        self._wake_r, self._wake_w = os.pipe()
+        self._setup_timerfd()
+
+    def _setup_timerfd(self):
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.timerfd_create(self.CLOCK_REALTIME, self.TFD_NONBLOCK | self.TFD_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd >= 0:
+            self.libc = libc
+            self.fd = fd
+
+    def _arm(self, at):
+        seconds = int(at)
+        spec = self.ITimerSpec(0, 0, seconds, int((at - seconds) * 1e9))
+        flags = self.TFD_TIMER_ABSTIME | self.TFD_TIMER_CANCEL_ON_SET
+        return self.libc.timerfd_settime(self.fd, flags, ctypes.byref(spec), None) == 0
+
+    def wait_until(self, at):
+        """Sleep until epoch `at` (None: until woken); returns 'due', 'clock' or 'woken'"""
+        if self.fd is not None and at is not None and self._arm(at):
+            ready, _, _ = select.select([self.fd, self._wake_r], [], [])
+            if self._wake_r in ready:
+                os.read(self._wake_r, 64)
+                return 'woken'
+            try:
+                os.read(self.fd, 8)
+            except OSError:
+                # ECANCELED: the clock was set, recompute the deadline
+                return 'clock'
+            return 'due'
+        while True:
+            timeout = None if at is None else min(self.max_sleep, max(0.0, at - time.time()))
+            ready, _, _ = select.select([self._wake_r], [], [], timeout)
+            if ready:
+                os.read(self._wake_r, 64)
+                return 'woken'
+            if time.time() >= at:
+                return 'due'
+
+    def wake(self):
+        os.write(self._wake_w, b"x")
+
+    def close(self):
+        for fd in (self.fd, self._wake_r, self._wake_w):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.fd = self._wake_r = self._wake_w = None
+
+
+class ScheduleRunner:
+    """Sleeps until the next scheduled start, then calls `on_due`.
+
+    The owner starts the session on its own thread (FocusService.start_due);
+    wake() makes the runner look at the schedule again after it changed.
+    """
+
+    def __init__(self, queue, on_due):
+        self.queue = queue  # callable, the queue is rebuilt when schedules change
+        self.on_due = on_due
+        self.timer = WallClockTimer()
+        self.closed = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def run(self):
+        try:
+            while not self.closed:
+                at = self.queue().next_start(time.time())
+                if self.timer.wait_until(at) == 'due' and not self.closed:
+                    self.on_due()
+        finally:
+            self.timer.close()
+
+    def wake(self):
+        if not self.closed:
+            self.timer.wake()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.timer.wake()
+
+
+class FocusService:
+    """Session, config and history logic shared by the GUI, the CLI and the daemon.
+
+    Nothing here touches tkinter. The config file is the state shared
+    between processes: reload() picks up a session started or stopped by
+    another one.
+    """
+    EMERGENCY_MINUTES = 30
+
+    def __init__(self, paths=None):
+        self.paths = paths or Paths()
+        if self.paths.storage == 'sqlite':
+            database = Database(self.paths.database)
+            if database.version < Database.VERSION:
+                database.migrate(self.paths.config,
+                                 SessionLog(self.paths.history, legacy_path=self.paths.legacy_history))
+            self.config_store = SqliteConfigStore(database)
+            self.history_log = SqliteSessionLog(database)
+        else:
+            self.config_store = ConfigStore(self.paths.config)
+            self.history_log = SessionLog(self.paths.history, legacy_path=self.paths.legacy_history)
+        self.config = self.config_store.data
+        self.session = SessionState.from_config(self.config)
+        self._analytics = None
+        self._schedule = None
+        self.proxy = None
+        self.block_page = None
+        self.log_lock = threading.Lock()
+
+    @property
+    def analytics(self):
+        # Loaded on first use; `status` never needs it
+        if self._analytics is None:
+            self._analytics = FocusAnalytics(self.history_log, self.paths.analytics)
+        return self._analytics
+
+    def save(self):
+        self.session.store(self.config)
+        self.config_store.save()
+
+    def reload(self):
+        """Re-read the config from disk; True if the session changed"""
+        self.config_store.reload()
+        return self.session.load(self.config)
+
+    def log(self, record):
+        # The block page listener flushes from its own thread
+        with self.log_lock:
+            # Check the analytics cache against the log before the log grows
+            analytics = self.analytics
+            self.history_log.append(record)
+            analytics.record(record)
+        return record
+
+    def log_attempts(self, session, domains):
+        """One batch of blocked attempts counted by BlockPageServer for `session` (start, id)"""
+        start, session_id = session
+        self.log(SessionRecord(start, int(time.time()), event='attempts', domains=domains,
+                               session=session_id))
+
+    @property
+    def schedule(self):
+        """ScheduleQueue for config['schedules'], rebuilt when they change"""
+        schedules = self.config.get('schedules', [])
+        queue = self._schedule
+        if queue is None or queue.signature != schedule_signature(schedules):
+            queue = self._schedule = ScheduleQueue(schedules, self.paths.schedule)
+        return queue
+
+    def start(self, seconds, schedule=None):
+        """Start a session of `seconds`; returns the logged session record"""
+        if self.session.active:
+            raise ValueError("A focus session is already running")
+        if seconds <= 0:
+            raise ValueError("Please set a valid time duration")
+        start_time = time.time()
+        session_id = new_session_id()
+        # Wakes the enforcement worker right away
+        self.session.start(start_time, start_time + seconds, self.config.get('allowed_sites', []), session_id)
+        self.save()
+        # The site list is stored once and referenced by its hash
+        sites = self.history_log.snapshots.put(self.config.get('allowed_sites', []))
+        start = int(start_time)
+        return self.log(SessionRecord(start, start + round(seconds), sites=sites, schedule=schedule,
+                                      session=session_id))
+
+    def start_due(self, now=None):
+        """Start the scheduled session that should be running now; returns its record or None.
+
+        An occurrence is only taken once, also across processes sharing the
+        config, and is skipped while a session already runs.
+        """
+        now = time.time() if now is None else now
+        queue = self.schedule
+        queue.sync_handled()
+        due = queue.take_due(now)
+        # Persist the taken occurrence before starting it
+        queue.save()
+        if due is None or self.session.active:
+            return None
+        return self.start(due[1] - now, schedule=due[2])
+
+    def add_schedule(self, schedule):
+        """Add or replace the schedule with the same name"""
+        schedules = [data for data in self.config.get('schedules', []) if data['name'] != schedule.name]
+        schedules.append(schedule.as_dict())
+        self.config['schedules'] = schedules
+        self.config_store.save()
+
+    def remove_schedule(self, name):
+        """Drop a schedule by name; False if there is none"""
+        schedules = self.config.get('schedules', [])
+        kept = [data for data in schedules if data['name'] != name]
+        if len(kept) == len(schedules):
+            return False
+        self.config['schedules'] = kept
+        self.config_store.save()
+        return True
+
+    def make_schedule_runner(self, on_due):
+        return ScheduleRunner(lambda: self.schedule, on_due)
+
+    def emergency(self):
+        """End the session within 30 minutes; returns the new end, or None if already used"""
+        end_time = min(self.session.end_time or 0, time.time() + self.EMERGENCY_MINUTES * 60)
+        if not self.session.emergency(end_time):
+            return None
+        self.save()
+        return end_time
+
+    def finish(self):
+        """Log how the session ended and mark it inactive; returns the end record.
+
+        The window and the daemon both reach the deadline of the same
+        session, so the end record is written under a lock on the log and
+        only if no other process has written it yet.
+        """
+        record = None
+        if self.block_page is not None:
+            # The last batch goes before the end record
+            self.block_page.flush()
+        if self.session.active and self.config.get('start_time'):
+            start, session_id = int(self.session.start_time), self.session.session_id
+            fd = os.open(self.history_log.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if not self.session_ended(start, session_id):
+                    record = self.log(SessionRecord(start, int(time.time()), event='end',
+                                                    planned=round(self.config.get('duration', 0) * 3600),
+                                                    completed=not self.session.emergency_used,
+                                                    session=session_id))
+            finally:
+                os.close(fd)
+        self.session.finish()
+        self.save()
+        return record
+
+    def session_ended(self, start, session_id=None):
+        """True if the end of session (`start`, `session_id`) is already logged"""
+        for record in self.history_log.iter_reverse():
+            if record.event == 'end' and record.key == (start, session_id):
+                return True
+            if record.event is None and record.start <= start:
+                # Reached the session itself
+                return False
+        return False
+
+    def add_site(self, site):
+        """Allow a site outside sessions; returns its cleaned name, or None if already there"""
+        if self.session.active:
+            raise ValueError("Cannot add sites during an active focus session!")
+        site = normalize_host(site)
+        if site.startswith('www.'):
+            site = site[4:]
+        if not site:
+            raise ValueError("Please enter a website")
+        sites = self.config.get('allowed_sites', [])
+        if site in sites:
+            return None
+        sites.append(site)
+        self.config['allowed_sites'] = sites
+        self.session.set_allowed_sites(sites)
+        self.save()
+        return site
+
+    def remove_site(self, site):
+        """Drop an allowed site outside sessions; False if it was not listed"""
+        if self.session.active:
+            raise ValueError("Cannot remove sites during an active focus session!")
+        sites = self.config.get('allowed_sites', [])
+        if site not in sites:
+            return False
+        sites.remove(site)
+        self.config['allowed_sites'] = sites
+        self.session.set_allowed_sites(sites)
+        self.save()
+        return True
+
+    def status(self):
+        _, active, end_time, allowed_sites = self.session.snapshot()
+        upcoming = self.schedule.upcoming(time.time(), 1)
+        return {
+            'active': active,
+            'remaining': max(0.0, end_time - time.time()) if active else 0.0,
+            'end_time': self.config.get('end_time') if active else None,
+            'emergency_used': self.session.emergency_used,
+            'allowed_sites': list(allowed_sites),
+            'next_scheduled': upcoming[0] if upcoming else None,
+            'daemon': daemon_pid(self.paths.daemon_pid)
+        }
+
+    def import_blocklists(self):
+        """Refresh the imported blocklists listed in config['blocklists']"""
+        sources = self.config.get('blocklists', [])
+        store = BlocklistStore(self.paths.blocklists)
+        if not sources and not os.path.exists(store.manifest_path):
+            return
+        try:
+            summary = store.import_sources(sources)
+            if summary['imported'] or summary['removed']:
+                print(f"Blocklists imported: {summary['entries']} entries")
+        except Exception as e:
+            print(f"Blocklist import error: {e}")
+
+    def blocklist_path(self):
+        if not self.config.get('blocklists'):
+            return None
+        path = BlocklistStore(self.paths.blocklists).combined_path
+        return path if os.path.exists(path) else None
+
+    def compact_hosts(self):
+        """Remove duplicated blocks left in the hosts file by older versions"""
+        try:
+            backend = enforcement_backend(hosts_file=self.paths.hosts)
+            backend.compact()
+            if isinstance(backend, HelperClient):
+                backend.close()
+        except Exception as e:
+            print(f"Hosts compaction error: {e}")
+
+    def start_proxy(self):
+        """Run the filtering proxy if config['proxy'] names a listen address"""
+        address = self.config.get('proxy')
+        if address and self.proxy is None:
+            proxy = FilterProxy(split_authority(address, PROXY_LISTEN[1]))
+            try:
+                proxy.start_in_thread()
+                self.proxy = proxy
+                print(f"MarThaba proxy on {address}")
+            except OSError as e:
+                print(f"Proxy error: {e}")
+        return self.proxy
+
+    def start_block_page(self):
+        """Run the blocked-attempt listener if config['block_page'] names the address"""
+        address = self.config.get('block_page')
+        if address and self.block_page is None:
+            block_page = BlockPageServer(address, on_flush=self.log_attempts)
+            try:
+                block_page.start_in_thread()
+                self.block_page = block_page
+            except OSError as e:
+                print(f"Block page error on {address}: {e} (ports 80/443 need root or CAP_NET_BIND_SERVICE)")
+        return self.block_page
+
+    def make_worker(self):
+        return EnforcementWorker(self.session, self.config.get('backend', 'hosts'), self.blocklist_path,
+                                 self.paths.hosts, self.start_proxy(), self.start_block_page())
+
+
+def daemon_pid(pid_file=DAEMON_PID_FILE):
+    """pid of the running daemon, or None"""
+    try:
+        with open(pid_file) as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return None
+    return pid
+
+
+def spawn_daemon(options=()):
+    """Start `marthaba [options] daemon` detached from the terminal"""
+    import subprocess
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), *options, 'daemon'],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL, start_new_session=True).pid
+
+
+def run_daemon(service=None):
+    """Enforce sessions without the GUI until SIGTERM.
+
+    The worker applies and clears the block; this loop only sleeps until
+    the session deadline, a config change (inotify) or the next scheduled
+    start, finishes the session when it is due and starts scheduled ones.
+    """
+    service = service or FocusService()
+    pid_file = service.paths.daemon_pid
+    if daemon_pid(pid_file) is not None:
+        print("MarThaba daemon is already running")
+        return 1
+    with open(pid_file, 'w') as f:
+        f.write(str(os.getpid()))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    changed = threading.Event()
+    watcher = FileWatcher(service.config_store.path)
+    threading.Thread(target=watcher.watch, args=(changed.set,), daemon=True).start()
+    threading.Thread(target=service.import_blocklists, daemon=True).start()
+    service.make_worker().start()
+    runner = service.make_schedule_runner(changed.set)
+    runner.start()
+    service.start_due()
+    try:
+        while True:
+            _, active, end_time, _ = service.session.snapshot()
+            if active and end_time <= time.time():
+                service.finish()
+                service.config_store.flush()
+                continue
+            if changed.wait(end_time - time.time() if active else None):
+                changed.clear()
+                # Our own writes and schedule wakeups need no re-read
+                if service.config_store.changed_on_disk():
+                    service.reload()
+                service.start_due()
+                # The schedules may have been edited
+                runner.wake()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.close()
+        watcher.close()
+        service.session.close()
+        if service.block_page is not None:
+            service.block_page.stop()
+        service.config_store.flush()
+        if daemon_pid(pid_file) == os.getpid():
+            os.unlink(pid_file)
+    return 0
+
+
+class InstanceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Socket of the running window; later launches hand their command to it.
+
+    Speaks the helper's JSON-lines protocol, so HelperClient is the client.
+    Commands are queued for the Tk thread: `notify` wakes it and it answers
+    them in run_pending().
+    """
+    daemon_threads = True
+    TIMEOUT = 10.0
+
+    def __init__(self, socket_path):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.socket_path = socket_path
+        self.pending = collections.deque()
+        self.handler = None
+        self.notify = None
+        self.ready = threading.Event()
+        super().__init__(socket_path, HelperRequestHandler)
+        os.chmod(socket_path, 0o600)
+
+    def is_authorized(self, sock):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _, uid, _ = struct.unpack("3i", creds)
+        return uid == os.getuid()
+
+    def run_batch(self, ops):
+        return [self.dispatch(op) for op in ops]
+
+    def dispatch(self, op):
+        # Launches racing the window's startup wait for it to attach
+        if not self.ready.wait(self.TIMEOUT):
+            raise OSError("MarThaba is still starting")
+        done = threading.Event()
+        reply = {}
+        self.pending.append((op, reply, done))
+        self.notify()
+        if not done.wait(self.TIMEOUT):
+            raise OSError("MarThaba did not answer")
+        if 'error' in reply:
+            raise ValueError(reply['error'])
+        return reply['result']
+
+    def attach(self, handler, notify):
+        """Start answering: `handler(op)` runs on the Tk thread after `notify()`"""
+        self.handler = handler
+        self.notify = notify
+        self.ready.set()
+
+    def run_pending(self):
+        while self.pending:
+            op, reply, done = self.pending.popleft()
+            try:
+                reply['result'] = self.handler(op)
+            except Exception as e:
+                # Answer anyway, or the launch would wait out TIMEOUT
+                reply['error'] = str(e) or type(e).__name__
+            finally:
+                done.set()
+
+    def start_in_thread(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class SingleInstance:
+    """One window per user: an flock on the lock file plus InstanceServer.
+
+    The lock is released by the kernel when the process dies, so a crash
+    never leaves a stale instance; only the lock holder (re)creates the
+    socket.
+    """
+
+    def __init__(self, lock_path=INSTANCE_LOCK_FILE, socket_path=INSTANCE_SOCKET):
+        self.lock_path = lock_path
+        self.socket_path = socket_path
+        self.lock_fd = None
+        self.server = None
+
+    def acquire(self):
+        """Take the lock and start listening; False if another window holds it"""
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.lock_fd = fd
+        self.server = InstanceServer(self.socket_path)
+        self.server.start_in_thread()
+        return True
+
+    def held(self):
+        """True while some process holds the lock"""
+        try:
+            fd = os.open(self.lock_path, os.O_RDONLY | os.O_CLOEXEC)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+    def forward(self, op, wait=2.0):
+        """Run `op` in the running window and return its result; None if no window runs"""
+        deadline = time.monotonic() + wait
+        while True:
+            client = HelperClient(self.socket_path)
+            try:
+                return client.batch(op)[0]
+            except (FileNotFoundError, ConnectionRefusedError):
+                # The window may hold the lock but not listen yet
+                if not self.held() or time.monotonic() > deadline:
+                    return None
+                time.sleep(0.02)
+            finally:
+                client.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+
+class FrameScheduler:
+    """One Tk after() chain shared by every periodic UI task.
+
+    Tasks are keyed by name, so adding a task again only reschedules it.
+    A task may run up to `slack` seconds late, which lets it piggyback on
+    another task's wakeup (the logo animation rides along with the timer
+    tick). Animation tasks are held while the window is hidden. Works with
+    anything that has after/after_cancel, so it runs without a display.
+    """
+
+    def __init__(self, root, clock=time.monotonic):
+        self.root = root
+        self.clock = clock
+        self.tasks = {}
+        self.job = None
+        self.job_at = None
+        self.paused = False
+        self.wakeup_times = collections.deque()
+
+    def add(self, name, callback, interval=None, delay=0.0, slack=0.0, animation=False):
+        """Run `callback` after `delay`, then every `interval` seconds.
+
+        The callback may return the seconds until its next run instead;
+        with neither a return value nor an interval the task ends.
+        """
+        self.tasks[name] = {'callback': callback, 'interval': interval, 'slack': slack,
+                            'animation': animation, 'due': self.clock() + delay}
+        self._arm()
+
+    def remove(self, name):
+        if self.tasks.pop(name, None) is not None:
+            self._arm()
+
+    def pause(self):
+        """Hold animation tasks (window iconified or unmapped)"""
+        self.paused = True
+        self._arm()
+
+    def resume(self):
+        self.paused = False
+        now = self.clock()
+        for task in self.tasks.values():
+            if task['animation']:
+                task['due'] = min(task['due'], now)
+        self._arm()
+
+    def wakeups_per_minute(self):
+        self._expire(self.clock())
+        return len(self.wakeup_times)
+
+    def _expire(self, now):
+        while self.wakeup_times and self.wakeup_times[0] <= now - 60:
+            self.wakeup_times.popleft()
+
+    def _runnable(self):
+        return [task for task in self.tasks.values() if not (self.paused and task['animation'])]
+
+    def _arm(self):
+        tasks = self._runnable()
+        at = min((task['due'] + task['slack'] for task in tasks), default=None)
+        if at == self.job_at:
+            return
+        if self.job is not None:
+            self.root.after_cancel(self.job)
+            self.job = None
+        self.job_at = at
+        if at is not None:
+            self.job = self.root.after(max(0, math.ceil((at - self.clock()) * 1000)), self._run)
+
+    def _run(self):
+        planned = self.job_at
+        self.job = self.job_at = None
+        now = self.clock()
+        self.wakeup_times.append(now)
+        self._expire(now)
+        record = METRICS.enabled
+        if record:
+            METRICS.set('marthaba_ui_wakeups_per_minute', len(self.wakeup_times))
+            if planned is not None:
+                METRICS.observe('marthaba_ui_tick_lateness_seconds', max(0.0, now - planned))
+        for name, task in list(self.tasks.items()):
+            if task['due'] > now or (self.paused and task['animation']):
+                continue
+            try:
+                if record:
+                    started = time.perf_counter()
+                    delay = task['callback']()
+                    METRICS.observe('marthaba_ui_task_seconds', time.perf_counter() - started, task=name)
+                else:
+                    delay = task['callback']()
+            except Exception as e:
+                print(f"UI task {name} error: {e}")
+                self.tasks.pop(name, None)
+                continue
+            if delay is None:
+                delay = task['interval']
+            if self.tasks.get(name) is not task:
+                continue  # the callback replaced or removed itself
+            if delay is None:
+                del self.tasks[name]
+            else:
+                task['due'] = now + delay
+        self._arm()
+
+
+class StartupProfile:
+    """Named wall-clock phases of GUI startup, printed by --profile-startup"""
+    FIRST_PAINT_TARGET = 0.25
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.phases = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self, imports=(), out=None):
+        out = out or sys.stderr
+        if imports:
+            print("Module imports (cumulative, from -X importtime):", file=out)
+            for name, seconds in imports:
+                print(f"  {name:<24} {seconds * 1000:8.1f} ms", file=out)
+        print("Startup phases:", file=out)
+        for name, seconds in self.phases:
+            print(f"  {name:<24} {seconds * 1000:8.1f} ms", file=out)
+        total = self.last - self.started
+        verdict = "ok" if total <= self.FIRST_PAINT_TARGET else "over target"
+        print(f"  {'first paint total':<24} {total * 1000:8.1f} ms "
+              f"(target {self.FIRST_PAINT_TARGET * 1000:.0f} ms, {verdict})", file=out)
+
+
+def import_breakdown(limit=12):
+    """Cumulative import cost of this module and its direct imports, slowest first"""
+    import subprocess
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True)
+    # Children are listed (indented) before the module that imported them
+    children = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2][1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        row = (name.strip(), int(parts[1]) / 1e6)
+        if depth == 1:
+            children.append(row)
+        elif depth == 0:
+            if row[0] == module:
+                children.sort(key=lambda child: child[1], reverse=True)
+                return [row] + children[:limit]
+            children = []
+    return []
+
 
 class AnimatedMarThaba:
-    def __init__(self, root):
+    def __init__(self, root, profile=None, service=None, instance=None):
         self.root = root
+        self.profile = profile or StartupProfile()
         self.root.title("MarThaba Pro - Ultimate Focus System")
         self.root.geometry("480x750")
-        self.root.configure(bg='#0d1117')
         self.root.resizable(False, False)
         
         # Set app icon (Shield + Clock design)
@@ -28,16 +4906,49 @@ class AnimatedMarThaba:
         
         # Center window
         self.root.eval('tk::PlaceWindow . center')
+        self.profile.mark('window')
         
+        self.service = service or FocusService()
+        self.config = self.service.config
+        self.profile.mark('config + session')
         self.setup_styles()
-        self.config = self.load_config()
-        self.history = self.load_history()
-        self.current_theme = 'enhanced_dark'
+        self.root.configure(bg=self.colors['bg'])
+        self.profile.mark('styles')
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.history_index = None  # opened with the History tab
         self.animation_running = True
-        self.emergency_used = False
+        self.session = self.service.session
+        self.worker = self.service.make_worker()
+        self.worker.start()
+        self.timer = FocusTimer()
+        self.ui_state = None
+        self.label_texts = {}
+        self.scheduler = FrameScheduler(self.root)
+        self.root.bind("<Unmap>", self.on_visibility, add='+')
+        self.root.bind("<Map>", self.on_visibility, add='+')
+        threading.Thread(target=self.service.compact_hosts, daemon=True).start()
+        threading.Thread(target=self.service.import_blocklists, daemon=True).start()
+        self.profile.mark('enforcement worker')
         self.setup_ui()
+        self.profile.mark('focus tab')
         self.auto_resume_session()
-        self.check_block_status()
+        self.schedule_tick()
+        self.root.bind('<<ScheduleDue>>', self.on_schedule_due)
+        # event_generate is how the runner thread hands the start to the Tk thread
+        self.schedule_runner = self.service.make_schedule_runner(
+            lambda: self.root.event_generate('<<ScheduleDue>>', when='tail'))
+        self.schedule_runner.start()
+        # Edits by the CLI or the daemon arrive as file changes, not by polling
+        self.root.bind('<<ConfigChanged>>', self.on_config_changed)
+        self.config_watcher = FileWatcher(self.service.config_store.path)
+        threading.Thread(target=self.config_watcher.watch, args=(self.on_config_file_event,),
+                         daemon=True).start()
+        self.instance = instance
+        if instance is not None:
+            self.root.bind('<<InstanceCommand>>', lambda event: instance.run_pending())
+            instance.attach(self.handle_instance_command,
+                            lambda: self.root.event_generate('<<InstanceCommand>>', when='tail'))
+        self.profile.mark('resume + first tick')
 
     def setup_app_icon(self):
         """Create and set shield + clock icon"""
@@ -99,12 +5010,15 @@ class AnimatedMarThaba:
                 'gradient_end': '#4ecdc4'
             }
         }
-        self.colors = self.themes['enhanced_dark']
+        self.current_theme = self.config.get('theme', 'enhanced_dark')
+        if self.current_theme not in self.themes:
+            self.current_theme = 'enhanced_dark'
+        self.colors = self.themes[self.current_theme]
+        # widget -> {option: color role}, filled as widgets are built
+        self.theme_registry = {}
         
-    def setup_ui(self):
-        # Create notebook for tabs with custom style
+    def configure_notebook_style(self):
         style = ttk.Style()
-        style.theme_use('clam')
         style.configure("Custom.TNotebook", 
                        background=self.colors['bg'],
                        borderwidth=0)
@@ -117,6 +5031,11 @@ class AnimatedMarThaba:
                  background=[("selected", self.colors['accent']),
                            ("active", self.colors['accent_hover'])],
                  foreground=[("selected", 'black')])
+    
+    def setup_ui(self):
+        # Create notebook for tabs with custom style
+        ttk.Style().theme_use('clam')
+        self.configure_notebook_style()
         
         self.notebook = ttk.Notebook(self.root, style="Custom.TNotebook")
         self.notebook.pack(fill=tk.BOTH, expand=True, padx=12, pady=12)
@@ -134,8 +5053,72 @@ class AnimatedMarThaba:
         self.notebook.add(self.settings_frame, text="⚙️ Settings")
         
         self.create_main_ui()
-        self.create_history_ui()
-        self.create_settings_ui()
+        # History and Settings are built the first time they are shown
+        self.tab_builders = {
+            str(self.history_frame): self.create_history_ui,
+            str(self.settings_frame): self.create_settings_ui
+        }
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+        self.register_theme_roles(self.root)
+    
+    def on_tab_changed(self, event=None):
+        tab = str(self.notebook.select())
+        builder = self.tab_builders.pop(tab, None)
+        if builder is not None:
+            builder()
+            self.register_theme_roles(self.notebook.nametowidget(tab))
+    
+    # Color options a theme switch rewrites, and the palette roles they can hold
+    THEMED_OPTIONS = ('background', 'foreground', 'activebackground', 'activeforeground',
+                      'highlightbackground', 'highlightcolor', 'selectbackground',
+                      'troughcolor', 'insertbackground', 'disabledforeground')
+    THEME_ROLES = ('bg', 'card_bg', 'card_hover', 'accent', 'accent_hover', 'danger',
+                   'danger_hover', 'success', 'warning', 'text', 'text_light', 'border')
+    
+    def register_theme_roles(self, widget):
+        """Record which palette role each color option of `widget` and its children uses"""
+        roles_by_color = {self.colors[role]: role for role in reversed(self.THEME_ROLES)}
+        pending = [widget]
+        while pending:
+            widget = pending.pop()
+            pending.extend(widget.winfo_children())
+            if widget in self.theme_registry:
+                continue
+            roles = {}
+            options = set(widget.keys())
+            for option in self.THEMED_OPTIONS:
+                if option in options:
+                    role = roles_by_color.get(str(widget.cget(option)))
+                    if role:
+                        roles[option] = role
+            self.theme_registry[widget] = roles
+    
+    def change_theme(self, key):
+        """Recolor every registered widget in place and remember the choice"""
+        if key not in self.themes or key == self.current_theme:
+            return
+        self.current_theme = key
+        self.colors = self.themes[key]
+        self.config['theme'] = key
+        self.save_config()
+        
+        for widget, roles in list(self.theme_registry.items()):
+            if not roles:
+                continue
+            try:
+                widget.config(**{option: self.colors[role] for option, role in roles.items()})
+            except tk.TclError:
+                del self.theme_registry[widget]
+        self.configure_notebook_style()
+        
+        # Colors that follow the session state rather than a fixed role
+        state, self.ui_state = self.ui_state, None
+        self.set_ui_state(state)
+        if self.session.emergency_used:
+            self.emergency_btn.config(bg=self.colors['text_light'])
+        self.update_check_display()
+        if hasattr(self, 'stats_labels'):
+            self.refresh_analytics_panels()
     
     def create_main_ui(self):
         main_container = tk.Frame(self.main_frame, bg=self.colors['bg'])
@@ -362,6 +5345,9 @@ class AnimatedMarThaba:
         self.emergency_btn.pack_forget()
     
     def create_history_ui(self):
+        self.history_index = self.service.history_log.index()
+        self.history_range = (0, len(self.history_index))
+        self.history_top = 0
         history_container = tk.Frame(self.history_frame, bg=self.colors['bg'])
         history_container.pack(fill=tk.BOTH, expand=True, padx=15, pady=15)
         
@@ -375,6 +5361,27 @@ class AnimatedMarThaba:
                 font=('Arial', 10),
                 bg=self.colors['bg'], fg=self.colors['text_light']).pack()
         
+        self.create_analytics_panels(history_container)
+        
+        # Date range filter (YYYY-MM-DD, both ends optional)
+        filter_frame = tk.Frame(history_container, bg=self.colors['bg'])
+        filter_frame.pack(fill=tk.X, pady=(0, 8))
+        self.history_from_var = tk.StringVar()
+        self.history_to_var = tk.StringVar()
+        for label, var in (("From", self.history_from_var), ("To", self.history_to_var)):
+            tk.Label(filter_frame, text=label, font=('Arial', 9),
+                    bg=self.colors['bg'], fg=self.colors['text_light']).pack(side=tk.LEFT, padx=(0, 4))
+            entry = tk.Entry(filter_frame, textvariable=var, font=('Arial', 9), width=11,
+                            bg=self.colors['border'], fg=self.colors['text'], relief='flat', bd=0,
+                            insertbackground=self.colors['text'])
+            entry.pack(side=tk.LEFT, padx=(0, 8), ipady=3)
+            entry.bind("<Return>", lambda e: self.apply_history_filter())
+            self.create_modern_entry_style(entry)
+        self.create_modern_button(filter_frame, "Filter", self.apply_history_filter,
+                                  style='secondary', size='small').pack(side=tk.LEFT)
+        self.create_modern_button(filter_frame, "All", self.clear_history_filter,
+                                  style='secondary', size='small').pack(side=tk.LEFT, padx=(4, 0))
+        
         # Modern history list
         list_frame = tk.Frame(history_container, bg=self.colors['bg'])
         list_frame.pack(fill=tk.BOTH, expand=True)
@@ -390,18 +5397,106 @@ class AnimatedMarThaba:
                                    pady=12,
                                    selectbackground=self.colors['accent'])
         
-        scrollbar = tk.Scrollbar(list_frame, orient=tk.VERTICAL,
-                                bg=self.colors['border'], 
-                                troughcolor=self.colors['bg'],
-                                activebackground=self.colors['accent'])
-        scrollbar.config(command=self.history_text.yview)
-        self.history_text.config(yscrollcommand=scrollbar.set)
+        # The scrollbar spans the whole index; only the visible rows are rendered
+        self.history_scrollbar = tk.Scrollbar(list_frame, orient=tk.VERTICAL,
+                                             bg=self.colors['border'], 
+                                             troughcolor=self.colors['bg'],
+                                             activebackground=self.colors['accent'])
+        self.history_scrollbar.config(command=self.scroll_history)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.history_text.bind(sequence, self.on_history_wheel)
         
         self.history_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.history_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        pager = tk.Frame(history_container, bg=self.colors['bg'])
+        pager.pack(fill=tk.X, pady=(8, 0))
+        self.create_modern_button(pager, "◀ Newer", lambda: self.scroll_history('scroll', -1, 'pages'),
+                                  style='secondary', size='small').pack(side=tk.LEFT)
+        self.create_modern_button(pager, "Older ▶", lambda: self.scroll_history('scroll', 1, 'pages'),
+                                  style='secondary', size='small').pack(side=tk.RIGHT)
+        self.history_position = tk.Label(pager, text="", font=('Arial', 9),
+                                        bg=self.colors['bg'], fg=self.colors['text_light'])
+        self.history_position.pack()
         
         self.load_history_data()
     
+    def create_analytics_panels(self, parent):
+        card = self.create_modern_card(parent)
+        card.pack(fill=tk.X, pady=(0, 15))
+        
+        stats_frame = tk.Frame(card, bg=self.colors['card_bg'])
+        stats_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        self.stats_labels = {}
+        stats = [("Today", "today"), ("This Week", "week"), ("Streak", "streak"), ("Completed", "completion")]
+        for i, (title, key) in enumerate(stats):
+            cell = tk.Frame(stats_frame, bg=self.colors['card_bg'])
+            cell.grid(row=0, column=i, sticky='nsew')
+            stats_frame.columnconfigure(i, weight=1)
+            
+            value = tk.Label(cell, text="-", font=('Arial', 13, 'bold'),
+                            bg=self.colors['card_bg'], fg=self.colors['accent'])
+            value.pack()
+            tk.Label(cell, text=title, font=('Arial', 8),
+                    bg=self.colors['card_bg'], fg=self.colors['text_light']).pack()
+            self.stats_labels[key] = value
+        
+        self.attempts_label = tk.Label(card, text="", font=('Arial', 9), wraplength=360,
+                                       bg=self.colors['card_bg'], fg=self.colors['text_light'])
+        self.attempts_label.pack(padx=10, pady=(0, 8))
+        
+        # Weekday x hour heatmap of focus time
+        self.heatmap_cell = 14
+        self.heatmap_canvas = tk.Canvas(card, width=24 * self.heatmap_cell + 30, height=7 * self.heatmap_cell,
+                                        bg=self.colors['card_bg'], highlightthickness=0)
+        self.heatmap_canvas.pack(padx=10, pady=(0, 10))
+        self.heatmap_rects = []
+        for day, name in enumerate("MTWTFSS"):
+            self.heatmap_canvas.create_text(10, day * self.heatmap_cell + self.heatmap_cell // 2, text=name,
+                                            fill=self.colors['text_light'], font=('Arial', 7),
+                                            tags='heatmap_label')
+            row = []
+            for hour in range(24):
+                x = 30 + hour * self.heatmap_cell
+                y = day * self.heatmap_cell
+                row.append(self.heatmap_canvas.create_rectangle(x, y, x + self.heatmap_cell - 2,
+                                                                y + self.heatmap_cell - 2,
+                                                                fill=self.colors['border'], width=0))
+            self.heatmap_rects.append(row)
+        
+        self.refresh_analytics_panels()
+    
+    def refresh_analytics_panels(self):
+        """Render the History tab panels from the cached aggregates"""
+        analytics = self.service.analytics
+        rate = analytics.completion_rate()
+        self.stats_labels['today'].config(text=f"{analytics.today_seconds() / 3600:.1f}h")
+        self.stats_labels['week'].config(text=f"{analytics.week_seconds() / 3600:.1f}h")
+        self.stats_labels['streak'].config(text=f"{analytics.streak()}d")
+        self.stats_labels['completion'].config(text=f"{rate * 100:.0f}%" if rate is not None else "-")
+        attempts = analytics.blocked_attempts()
+        if attempts:
+            top = ", ".join(f"{domain} ({count})" for domain, count in analytics.blocked.most_common(3))
+            self.attempts_label.config(text=f"🚫 {attempts:,} blocked attempts — {top}",
+                                       fg=self.colors['text_light'])
+        else:
+            self.attempts_label.config(text="", fg=self.colors['text_light'])
+        
+        self.heatmap_canvas.itemconfig('heatmap_label', fill=self.colors['text_light'])
+        peak = max(max(row) for row in analytics.heatmap) or 1
+        for day, row in enumerate(analytics.heatmap):
+            for hour, seconds in enumerate(row):
+                color = self.blend_color(self.colors['border'], self.colors['success'], seconds / peak)
+                self.heatmap_canvas.itemconfig(self.heatmap_rects[day][hour], fill=color)
+    
+    @staticmethod
+    def blend_color(start, end, amount):
+        amount = min(1.0, max(0.0, amount))
+        a = [int(start[i:i + 2], 16) for i in (1, 3, 5)]
+        b = [int(end[i:i + 2], 16) for i in (1, 3, 5)]
+        return "#" + "".join(f"{round(x + (y - x) * amount):02x}" for x, y in zip(a, b))
+    
     def create_settings_ui(self):
         settings_container = tk.Frame(self.settings_frame, bg=self.colors['bg'])
         settings_container.pack(fill=tk.BOTH, expand=True, padx=15, pady=15)
@@ -450,20 +5545,21 @@ class AnimatedMarThaba:
         return card
     
     def create_modern_button(self, parent, text, command, style='primary', size='normal'):
+        # Palette roles, looked up on every hover so theme switches apply
         if style == 'primary':
-            bg, fg, hover_bg = self.colors['accent'], 'black', self.colors['accent_hover']
+            bg, fg, hover_bg = 'accent', 'black', 'accent_hover'
         elif style == 'danger':
-            bg, fg, hover_bg = self.colors['danger'], 'white', self.colors['danger_hover']
+            bg, fg, hover_bg = 'danger', 'white', 'danger_hover'
         elif style == 'secondary':
-            bg, fg, hover_bg = self.colors['card_bg'], self.colors['text_light'], self.colors['card_hover']
+            bg, fg, hover_bg = 'card_bg', 'text_light', 'card_hover'
         else:
-            bg, fg, hover_bg = self.colors['card_bg'], self.colors['text'], self.colors['card_hover']
+            bg, fg, hover_bg = 'card_bg', 'text', 'card_hover'
         
         font_size = 9 if size == 'small' else 11 if size == 'normal' else 12
         padding = 8 if size == 'small' else 12 if size == 'normal' else 14
         
         btn = tk.Label(parent, text=text, font=('Arial', font_size, 'bold'),
-                      bg=bg, fg=fg, relief='flat', bd=0,
+                      bg=self.colors[bg], fg=self.colors.get(fg, fg), relief='flat', bd=0,
                       padx=padding, pady=padding)
         
         btn.bind("<Button-1>", lambda e: command())
@@ -471,10 +5567,10 @@ class AnimatedMarThaba:
         # Enhanced hover effect
         def on_enter(e):
             if btn.cget('state') != 'disabled':
-                btn.config(bg=hover_bg, cursor='hand2')
+                btn.config(bg=self.colors[hover_bg], cursor='hand2')
         def on_leave(e):
             if btn.cget('state') != 'disabled':
-                btn.config(bg=bg, cursor='')
+                btn.config(bg=self.colors[bg], cursor='')
             
         btn.bind("<Enter>", on_enter)
         btn.bind("<Leave>", on_leave)
@@ -495,6 +5591,10 @@ class AnimatedMarThaba:
         entry.bind("<FocusOut>", on_focusout)
     
     def animate_logo_enhanced(self):
+        # Keyed by name, so starting it twice still runs a single animation
+        self.scheduler.add('logo', self.step_logo, interval=1.5, slack=0.5, animation=True)
+    
+    def step_logo(self):
         if not self.animation_running:
             return
             
@@ -509,7 +5609,7 @@ class AnimatedMarThaba:
         next_index = (current_index + 1) % len(colors)
         
         self.logo_label.config(fg=colors[next_index])
-        self.root.after(1500, self.animate_logo_enhanced)
+        return 1.5
     
     def update_check_display(self):
         """Update the notification checkbox display"""
@@ -525,27 +5625,27 @@ class AnimatedMarThaba:
     
     def add_site(self):
         # Check if focus session is active
-        if self.config.get('active', False):
+        if self.session.active:
             self.show_notification("❌ Cannot add sites during an active focus session!\nPlease wait until the session ends.")
             return
             
-        site_url = simpledialog.askstring("Add Allowed Site", 
-                                        "Enter website URL (e.g., youtube.com, facebook.com):")
+        from tkinter import simpledialog
+        site_url = self.modal('askstring', simpledialog.askstring, "Add Allowed Site",
+                              "Enter website URL (e.g., youtube.com, facebook.com):")
         
         if site_url:
-            # Clean the URL
-            site_url = site_url.lower().replace('https://', '').replace('http://', '').replace('www.', '')
-            sites = self.config.get('allowed_sites', [])
-            if site_url not in sites:
-                sites.append(site_url)
-                self.config['allowed_sites'] = sites
-                self.save_config()
+            try:
+                site_url = self.service.add_site(site_url)
+            except ValueError as e:
+                self.modal('showerror', messagebox.showerror, "MarThaba Pro", f"❌ {e}")
+                return
+            if site_url:
                 self.load_sites_list()
                 self.show_notification(f"✅ Site added: {site_url}")
     
     def remove_site(self):
         # Check if focus session is active
-        if self.config.get('active', False):
+        if self.session.active:
             self.show_notification("❌ Cannot remove sites during an active focus session!\nPlease wait until the session ends.")
             return
             
@@ -554,11 +5654,7 @@ class AnimatedMarThaba:
             site = self.sites_listbox.get(selection[0])
             # Extract site name from display text
             site_name = site.replace("🌐 ", "")
-            sites = self.config.get('allowed_sites', [])
-            if site_name in sites:
-                sites.remove(site_name)
-                self.config['allowed_sites'] = sites
-                self.save_config()
+            if self.service.remove_site(site_name):
                 self.load_sites_list()
                 self.show_notification(f"✅ Site removed: {site_name}")
     
@@ -576,27 +5672,103 @@ class AnimatedMarThaba:
     
     def show_notification(self, message):
         if self.config.get('notifications', True):
-            messagebox.showinfo("MarThaba Pro", message)
+            self.modal('showinfo', messagebox.showinfo, "MarThaba Pro", message)
+    
+    def modal(self, kind, dialog, *args):
+        """Run a modal dialog, recording how long it held up the UI"""
+        if not METRICS.enabled:
+            return dialog(*args)
+        started = time.perf_counter()
+        try:
+            return dialog(*args)
+        finally:
+            METRICS.observe('marthaba_ui_dialog_seconds', time.perf_counter() - started, dialog=kind)
+    
+    HISTORY_ROWS = 6
     
     def load_history_data(self):
+        """Render the visible page of sessions, newest first"""
         self.history_text.delete(1.0, tk.END)
+        low, high = self.history_range
+        total = high - low
+        self.history_top = max(0, min(self.history_top, total - self.HISTORY_ROWS))
         
-        if not self.history:
-            self.history_text.insert(tk.END, "🌟 No focus sessions yet.\n\nStart your first focus session to build your productivity history!")
+        if not total:
+            if len(self.history_index):
+                message = "🔍 No focus sessions in this date range."
+            else:
+                message = "🌟 No focus sessions yet.\n\nStart your first focus session to build your productivity history!"
+            self.history_text.insert(tk.END, message)
             self.history_text.tag_configure("center", justify='center')
             self.history_text.tag_add("center", "1.0", "end")
+            self.history_scrollbar.set(0, 1)
+            self.history_position.config(text="")
             return
         
-        for session in reversed(self.history[-10:]):  # Show last 10 sessions
-            start_time = datetime.datetime.fromisoformat(session['start_time'])
-            end_time = datetime.datetime.fromisoformat(session['end_time'])
-            duration = session['duration']
+        last = min(total, self.history_top + self.HISTORY_ROWS)
+        for session in reversed(self.history_index.page(high - last, high - self.history_top)):
+            start_time = datetime.datetime.fromtimestamp(session.start)
+            duration = session.duration
+            if session.status == SessionIndex.ENDED:
+                status = "🆘 Status: Ended early"
+            elif self.session.active and session.key == (int(self.session.start_time),
+                                                          self.session.session_id):
+                status = "🛡️ Status: In progress"
+            else:
+                status = "✅ Status: Completed"
+            if session.attempts:
+                status += f"\n🚫 Blocked attempts: {session.attempts}"
             
             self.history_text.insert(tk.END, 
                                    f"📅 {start_time.strftime('%Y-%m-%d %H:%M')}\n"
                                    f"⏰ Duration: {duration:.1f} hours\n"
-                                   f"✅ Status: Completed\n"
+                                   f"{status}\n"
                                    f"─────────────────────\n\n")
+        self.history_scrollbar.set(self.history_top / total, last / total)
+        self.history_position.config(text=f"{self.history_top + 1}–{last} of {total:,}")
+    
+    def scroll_history(self, action, amount, unit=None):
+        """Scrollbar protocol: ('moveto', fraction) or ('scroll', n, 'units'|'pages')"""
+        low, high = self.history_range
+        if action == 'moveto':
+            self.history_top = int(float(amount) * (high - low))
+        else:
+            step = self.HISTORY_ROWS if unit == 'pages' else 1
+            self.history_top += int(amount) * step
+        self.history_top = max(0, self.history_top)
+        self.load_history_data()
+    
+    def on_history_wheel(self, event):
+        if event.num == 4 or getattr(event, 'delta', 0) > 0:
+            self.scroll_history('scroll', -1)
+        else:
+            self.scroll_history('scroll', 1)
+        return "break"
+    
+    def parse_history_date(self, text):
+        text = text.strip()
+        if not text:
+            return None
+        return datetime.datetime.combine(datetime.date.fromisoformat(text), datetime.time())
+    
+    def apply_history_filter(self):
+        try:
+            start = self.parse_history_date(self.history_from_var.get())
+            end = self.parse_history_date(self.history_to_var.get())
+        except ValueError:
+            self.show_notification("Please enter dates as YYYY-MM-DD")
+            return
+        # The "To" day is included
+        self.history_range = self.history_index.between(
+            start.timestamp() if start else None,
+            (end + datetime.timedelta(days=1)).timestamp() if end else None)
+        self.history_top = 0
+        self.load_history_data()
+    
+    def clear_history_filter(self):
+        self.history_from_var.set("")
+        self.history_to_var.set("")
+        self.apply_history_filter()
     
     def start_focus(self):
         try:
@@ -613,212 +5785,612 @@ class AnimatedMarThaba:
             self.show_notification("Please enter valid numbers")
             return
         
-        self.start_time = datetime.datetime.now()
-        end_time = self.start_time + datetime.timedelta(seconds=total_seconds)
-        total_hours = total_seconds / 3600
-        
-        self.config.update({
-            'active': True,
-            'start_time': self.start_time.isoformat(),
-            'end_time': end_time.isoformat(),
-            'duration': total_hours
-        })
-        self.save_config()
-        
-        # Add to history
-        self.history.append({
-            'start_time': self.config['start_time'],
-            'end_time': self.config['end_time'],
-            'duration': total_hours,
-            'sites': self.config.get('allowed_sites', [])
-        })
-        self.save_history()
-        
-        # Start blocking
-        threading.Thread(target=self.block_sites, daemon=True).start()
-        
-        # Update UI
-        self.focus_btn.config(text="🛡️ FOCUS ACTIVE", bg=self.colors['warning'])
-        self.status_label.config(text=f"🛡️ FOCUS MODE ACTIVE", 
-                               fg=self.colors['warning'])
-        
-        # Show timer and emergency button
-        self.timer_frame.pack(fill=tk.X, pady=10)
-        self.countdown_frame.pack(fill=tk.X, pady=5)
-        self.emergency_btn.pack(fill=tk.X, padx=10, pady=5)
-        self.emergency_used = False
-        
-        # Disable site buttons
-        self.update_site_buttons_state()
+        try:
+            session = self.service.start(total_seconds)
+        except ValueError as e:
+            self.show_notification(str(e))
+            return
+        self.add_history(session)
+        self.show_session_started()
         
-        self.show_notification(f"Focus started for {total_hours:.1f} hours!")
+        self.show_notification(f"Focus started for {session.duration:.1f} hours!")
     
-    def block_sites(self):
-        hosts_file = "/etc/hosts"
-        redirect_ip = "127.0.0.1"
-        
-        while self.config.get('active', False):
-            end_time = datetime.datetime.fromisoformat(self.config['end_time'])
-            if datetime.datetime.now() > end_time:
-                self.config['active'] = False
-                self.save_config()
-                self.check_block_status()
-                break
-            
-            try:
-                subprocess.run(['sudo', 'sed', '-i', '/# MarThaba Focus/d', hosts_file], capture_output=True)
-                
-                # Default blocked sites
-                block_entries = [
-                    f"{redirect_ip} www.youtube.com",
-                    f"{redirect_ip} youtube.com", 
-                    f"{redirect_ip} m.youtube.com",
-                    f"{redirect_ip} www.youtube.com/shorts",
-                    f"{redirect_ip} www.youtube.com/reel",
-                    f"{redirect_ip} m.youtube.com/shorts",
-                    f"{redirect_ip} www.facebook.com",
-                    f"{redirect_ip} facebook.com",
-                    f"{redirect_ip} m.facebook.com",
-                    f"{redirect_ip} www.facebook.com/reel",
-                    f"{redirect_ip} www.facebook.com/watch",
-                    f"{redirect_ip} www.instagram.com",
-                    f"{redirect_ip} instagram.com",
-                    f"{redirect_ip} www.instagram.com/reels"
-                ]
-                
-                # Unblock allowed sites
-                allowed_sites = self.config.get('allowed_sites', [])
-                for site in allowed_sites:
-                    subprocess.run(['sudo', 'sed', '-i', f'/{site}/d', hosts_file], capture_output=True)
-                
-                if block_entries:
-                    with open(hosts_file, "a") as f:
-                        f.write("\n# MarThaba Focus\n" + "\n".join(block_entries) + "\n")
-                
-            except Exception as e:
-                print(f"Blocking error: {e}")
-            
-            time.sleep(30)
+    def show_session_started(self):
+        # Timer, emergency button and site buttons follow the new state
+        self.emergency_btn.config(text="🆘 EMERGENCY STOP (30min)", bg=self.colors['danger'])
+        self.timer.start(self.session.start_time, self.session.end_time)
+        self.schedule_tick()
+    
+    def schedules_run_here(self):
+        # A running daemon starts scheduled sessions itself
+        return daemon_pid(self.service.paths.daemon_pid) is None
+    
+    def auto_resume_session(self):
+        """Restore the session at launch: one still running, or one a schedule says should be"""
+        if self.schedules_run_here():
+            # Uses the occurrences stored in the config; nothing is expanded at launch
+            self.add_history(self.service.start_due())
+        if not self.session.active:
+            return
+        self.timer.start(self.session.start_time, self.session.end_time)
+        self.set_ui_state('active')
+        if self.session.emergency_used:
+            self.emergency_btn.config(text="🆘 EMERGENCY USED", bg=self.colors['text_light'])
+    
+    def on_schedule_due(self, event=None):
+        if not self.schedules_run_here():
+            return
+        session = self.service.start_due()
+        if session is None:
+            return
+        self.add_history(session)
+        self.show_session_started()
+        self.show_notification(f"Scheduled focus started: {session.schedule}")
     
     def emergency_stop(self):
-        if self.emergency_used:
+        # Set focus to end in 30 minutes
+        emergency_end_time = self.service.emergency()
+        if emergency_end_time is None:
             self.show_notification("Emergency stop can only be used once per session!")
             return
-            
-        # Set focus to end in 30 minutes
-        emergency_end_time = datetime.datetime.now() + datetime.timedelta(minutes=30)
-        self.config['end_time'] = emergency_end_time.isoformat()
-        self.save_config()
-        
-        self.emergency_used = True
-        self.emergency_btn.config(text="🆘 EMERGENCY USED", bg=self.colors['text_light'])
         
+        self.show_emergency_used(emergency_end_time)
         self.show_notification("Emergency stop activated! Focus will end in 30 minutes.")
     
-    def update_timer_display(self):
-        if self.config.get('active', False):
-            current_time = datetime.datetime.now()
-            start_time = datetime.datetime.fromisoformat(self.config['start_time'])
-            end_time = datetime.datetime.fromisoformat(self.config['end_time'])
-            
-            # Calculate elapsed time
-            elapsed = current_time - start_time
-            elapsed_hours = int(elapsed.total_seconds() // 3600)
-            elapsed_minutes = int((elapsed.total_seconds() % 3600) // 60)
-            elapsed_seconds = int(elapsed.total_seconds() % 60)
-            
-            # Calculate remaining time
-            remaining = end_time - current_time
-            if remaining.total_seconds() > 0:
-                remaining_hours = int(remaining.total_seconds() // 3600)
-                remaining_minutes = int((remaining.total_seconds() % 3600) // 60)
-                remaining_seconds = int(remaining.total_seconds() % 60)
-                
-                # Update labels
-                self.elapsed_label.config(text=f"Elapsed: {elapsed_hours:02d}:{elapsed_minutes:02d}:{elapsed_seconds:02d}")
-                self.remaining_label.config(text=f"Remaining: {remaining_hours:02d}:{remaining_minutes:02d}:{remaining_seconds:02d}")
-                
-                # Update countdown
-                if remaining.total_seconds() > 3600:  # More than 1 hour
-                    countdown_text = f"⏳ {remaining_hours}h {remaining_minutes}m {remaining_seconds}s"
-                elif remaining.total_seconds() > 60:  # More than 1 minute
-                    countdown_text = f"⏳ {remaining_minutes}m {remaining_seconds}s"
-                else:  # Less than 1 minute
-                    countdown_text = f"⏳ {remaining_seconds}s"
-                
-                self.countdown_label.config(text=countdown_text)
+    def show_emergency_used(self, end_time):
+        self.timer.set_end(end_time)
+        self.schedule_tick()
+        self.emergency_btn.config(text="🆘 EMERGENCY USED", bg=self.colors['text_light'])
     
-    def check_block_status(self):
-        self.update_timer_display()
-        
-        if self.config.get('active', False):
-            end_time = datetime.datetime.fromisoformat(self.config['end_time'])
-            remaining = end_time - datetime.datetime.now()
-            
-            if remaining.total_seconds() > 0:
-                hours = int(remaining.total_seconds() // 3600)
-                mins = int((remaining.total_seconds() % 3600) // 60)
-                secs = int(remaining.total_seconds() % 60)
-                
-                status_text = f"🛡️ FOCUS ACTIVE"
-                self.status_label.config(text=status_text, fg=self.colors['warning'])
-                
-                # Show emergency button and timer
-                self.emergency_btn.pack(fill=tk.X, padx=10, pady=5)
-                self.timer_frame.pack(fill=tk.X, pady=10)
-                self.countdown_frame.pack(fill=tk.X, pady=5)
+    def handle_instance_command(self, op):
+        """A command forwarded by a second launch (see SingleInstance); runs on the Tk thread"""
+        name = op.get('op')
+        if name == 'show':
+            self.root.deiconify()
+            self.root.lift()
+            self.root.focus_force()
+            return True
+        if name == 'start':
+            session = self.service.start(op['seconds'])
+            self.add_history(session)
+            self.show_session_started()
+            return session.as_dict()
+        if name == 'stop':
+            if not self.session.active:
+                raise ValueError("No focus session is running")
+            end_time = self.service.emergency()
+            if end_time is None:
+                raise ValueError("Emergency stop can only be used once per session!")
+            self.show_emergency_used(end_time)
+            return end_time
+        if name == 'status':
+            return self.service.status()
+        raise ValueError(f"unknown command: {name}")
+    
+    def on_config_file_event(self):
+        # Watcher thread; our own writes are filtered out by the store's stamp
+        if self.service.config_store.changed_on_disk():
+            self.root.event_generate('<<ConfigChanged>>', when='tail')
+    
+    def on_config_changed(self, event=None):
+        """Another process (CLI, daemon) rewrote the config"""
+        if not self.service.config_store.changed_on_disk():
+            return
+        session_changed = self.service.reload()
+        self.load_sites_list()
+        if self.notify_var.get() != self.config.get('notifications', True):
+            self.notify_var.set(self.config.get('notifications', True))
+            self.update_check_display()
+        if session_changed:
+            self.timer.stop()
+            if self.session.active:
+                self.show_session_started()
+                if self.session.emergency_used:
+                    self.emergency_btn.config(text="🆘 EMERGENCY USED", bg=self.colors['text_light'])
             else:
-                self.config['active'] = False
-                self.save_config()
-                self.status_label.config(text="✅ FOCUS COMPLETE", fg=self.colors['success'])
-                self.focus_btn.config(text="🛡️ START FOCUS SESSION", bg=self.colors['accent'])
-                self.emergency_btn.pack_forget()
-                self.timer_frame.pack_forget()
-                self.countdown_frame.pack_forget()
-                self.countdown_label.config(text="")
-                self.emergency_used = False
-                
-                # Enable site buttons after focus session ends
-                self.update_site_buttons_state()
-                
-                self.show_notification("Focus session completed!")
+                self.schedule_tick()
+            # The other process logged the start or end
+            self.refresh_history()
+    
+    def set_label_text(self, label, text):
+        """Configure a label only when its text actually changes"""
+        if self.label_texts.get(label) != text:
+            self.label_texts[label] = text
+            label.config(text=text)
+    
+    def set_ui_state(self, state):
+        """Show or hide the session widgets; only does work on transitions"""
+        if state == self.ui_state:
+            return
+        self.ui_state = state
+        if state == 'active':
+            self.focus_btn.config(text="🛡️ FOCUS ACTIVE", bg=self.colors['warning'])
+            self.status_label.config(text="🛡️ FOCUS ACTIVE", fg=self.colors['warning'])
+            self.timer_frame.pack(fill=tk.X, pady=10)
+            self.countdown_frame.pack(fill=tk.X, pady=5)
+            self.emergency_btn.pack(fill=tk.X, padx=10, pady=5)
         else:
-            self.status_label.config(text="🛡️ SYSTEM READY", fg=self.colors['accent'])
+            if state == 'complete':
+                self.status_label.config(text="✅ FOCUS COMPLETE", fg=self.colors['success'])
+            else:
+                self.status_label.config(text="🛡️ SYSTEM READY", fg=self.colors['accent'])
+            self.focus_btn.config(text="🛡️ START FOCUS SESSION", bg=self.colors['accent'])
             self.emergency_btn.pack_forget()
             self.timer_frame.pack_forget()
             self.countdown_frame.pack_forget()
-            self.countdown_label.config(text="")
-            self.emergency_used = False
-            
-            # Enable site buttons when no focus session is active
-            self.update_site_buttons_state()
+            self.set_label_text(self.countdown_label, "")
         
-        self.root.after(1000, self.check_block_status)
+        # Sites can only be edited outside a session
+        self.update_site_buttons_state()
     
-    def load_config(self):
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {'active': False, 'allowed_sites': [], 'notifications': True}
+    def update_site_buttons_state(self):
+        state = 'disabled' if self.session.active else 'normal'
+        fg = self.colors['text_light'] if state == 'disabled' else 'black'
+        self.add_btn.config(state=state, fg=fg)
+        self.remove_btn.config(state=state, fg=self.colors['text_light'] if state == 'disabled' else 'white')
+    
+    def update_timer_display(self):
+        elapsed_text, remaining_text, countdown_text = self.timer.texts()
+        self.set_label_text(self.elapsed_label, elapsed_text)
+        self.set_label_text(self.remaining_label, remaining_text)
+        self.set_label_text(self.countdown_label, countdown_text)
+    
+    def check_block_status(self):
+        """Timer tick: aligned to whole seconds of the countdown, idle when no session runs.
+
+        Returns the seconds until the next tick for the scheduler, or None to stop ticking.
+        """
+        if not self.session.active:
+            self.timer.stop()
+            self.set_ui_state('idle')
+            return
+        
+        if not self.timer.running:
+            # Anchor the countdown once per session (start, resume)
+            self.timer.start(self.session.start_time, self.session.end_time)
+        
+        if self.timer.remaining() > 0:
+            self.set_ui_state('active')
+            if self.scheduler.paused:
+                # Hidden: nothing to redraw, only the deadline matters
+                return self.timer.remaining()
+            self.update_timer_display()
+            return self.timer.next_tick_ms() / 1000
+        
+        self.add_history(self.service.finish())
+        self.timer.stop()
+        self.set_ui_state('complete')
+        self.show_notification("Focus session completed!")
+    
+    def schedule_tick(self):
+        """(Re)start the timer tick right away, e.g. after the deadline moved"""
+        self.scheduler.add('timer', self.check_block_status)
+    
+    def on_visibility(self, event):
+        # Child widgets report their own Map/Unmap through the toplevel binding
+        if event.widget is not self.root:
+            return
+        if event.type == tk.EventType.Unmap:
+            self.scheduler.pause()
+        else:
+            self.scheduler.resume()
+            self.schedule_tick()
     
     def save_config(self):
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(self.config, f)
+        # Coalesced and written off the UI thread
+        self.service.config_store.save()
     
-    def load_history(self):
-        try:
-            with open(HISTORY_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return []
+    def on_close(self):
+        self.config_watcher.close()
+        self.schedule_runner.close()
+        self.session.close()
+        if self.service.block_page is not None:
+            self.service.block_page.stop()
+        self.service.config_store.flush()
+        self.root.destroy()
+    
+    def add_history(self, record):
+        """Show a record the service just logged"""
+        if record is not None:
+            self.refresh_history()
     
-    def save_history(self):
-        with open(HISTORY_FILE, 'w') as f:
-            json.dump(self.history, f)
+    def refresh_history(self):
+        if self.history_index is not None and self.history_index.refresh():
+            if self.history_from_var.get().strip() or self.history_to_var.get().strip():
+                self.apply_history_filter()
+            else:
+                self.history_range = (0, len(self.history_index))
+                self.load_history_data()
+        if hasattr(self, 'stats_labels'):
+            self.refresh_analytics_panels()
 
-if __name__ == "__main__":
+
+def parse_duration(text):
+    """'25m', '1h30m', '90s' or plain minutes ('45') -> seconds"""
+    text = text.strip().lower()
+    units = {'h': 3600, 'm': 60, 's': 1}
+    if text.replace('.', '', 1).isdigit():
+        return float(text) * 60
+    total = 0.0
+    number = ''
+    for char in text:
+        if char.isdigit() or char == '.':
+            number += char
+        elif char in units and number:
+            total += float(number) * units[char]
+            number = ''
+        else:
+            raise ValueError(f"invalid duration: {text!r}")
+    if number or total <= 0:
+        raise ValueError(f"invalid duration: {text!r}")
+    return total
+
+
+def format_seconds(seconds):
+    hours, minutes, seconds = FocusTimer.split(math.ceil(seconds))
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def show_metrics(directory):
+    """Print the latest snapshot of every process that recorded metrics"""
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".prom"))
+    except OSError:
+        names = []
+    snapshots = [latest_metrics(os.path.join(directory, name)) for name in names]
+    snapshots = [snapshot for snapshot in snapshots if snapshot]
+    if not snapshots:
+        print("No metrics recorded yet. Enable them with `marthaba metrics on` "
+              "and restart the window or daemon.")
+        return 1
+    print("\n".join(snapshots), end="")
+    return 0
+
+
+def ensure_daemon(args, paths):
+    if daemon_pid(paths.daemon_pid) is None:
+        options = ['--hosts', paths.hosts]
+        if args.data_dir:
+            options += ['--data-dir', args.data_dir]
+        spawn_daemon(options)
+
+
+def format_occurrence(occurrence):
+    start, end, name = occurrence
+    start = datetime.datetime.fromtimestamp(start)
+    return f"{start:%a %d %b %H:%M}-{datetime.datetime.fromtimestamp(end):%H:%M} {name}"
+
+
+def print_started(session):
+    print(f"🛡️ Focus started for {format_seconds(session.end - session.start)} "
+          f"(until {datetime.datetime.fromtimestamp(session.end):%H:%M:%S})")
+
+
+def print_stopped(end_time):
+    print(f"🆘 Emergency stop activated! Focus will end in {format_seconds(end_time - time.time())}.")
+
+
+def print_status(status):
+    if status['active']:
+        print(f"🛡️ FOCUS ACTIVE - {format_seconds(status['remaining'])} remaining")
+        if status['emergency_used']:
+            print("🆘 Emergency stop used")
+    else:
+        print("🛡️ SYSTEM READY")
+    if status['next_scheduled']:
+        print(f"Next scheduled: {format_occurrence(status['next_scheduled'])}")
+    daemon = status['daemon']
+    print(f"Daemon: running (pid {daemon})" if daemon else "Daemon: not running")
+
+
+def forward_cli(args, instance):
+    """Run start / stop / status in the open window; None if no window is running"""
+    try:
+        if args.command == 'start':
+            op = {'op': 'start', 'seconds': parse_duration(args.duration)}
+        else:
+            op = {'op': args.command}
+        result = instance.forward(op)
+    except (ValueError, OSError) as e:
+        print(f"❌ {e}")
+        return 1
+    if result is None:
+        return None
+    if args.command == 'start':
+        print_started(SessionRecord.from_dict(result))
+    elif args.command == 'stop':
+        print_stopped(result)
+    else:
+        print_status(result)
+        print("Window: running")
+    return 0
+
+
+def run_cli(args, paths):
+    """start / status / stop / allow / schedule / metrics / proxy / export without tkinter; the daemon enforces"""
+    service = FocusService(paths)
+    try:
+        if args.command == 'start':
+            session = service.start(parse_duration(args.duration))
+            service.config_store.flush()
+            ensure_daemon(args, paths)
+            print_started(session)
+        elif args.command == 'stop':
+            if not service.session.active:
+                print("No focus session is running")
+                return 1
+            end_time = service.emergency()
+            if end_time is None:
+                print("Emergency stop can only be used once per session!")
+                return 1
+            service.config_store.flush()
+            print_stopped(end_time)
+        elif args.command == 'allow':
+            if args.action == 'add':
+                site = service.add_site(args.site)
+                print(f"✅ Site added: {site}" if site else f"{normalize_host(args.site)} is already allowed")
+            elif args.action == 'remove':
+                if not service.remove_site(args.site):
+                    print(f"{args.site} is not in the allowed list")
+                    return 1
+                print(f"✅ Site removed: {args.site}")
+            else:
+                for site in service.config.get('allowed_sites', []):
+                    print(site)
+            service.config_store.flush()
+        elif args.command == 'schedule':
+            if args.action == 'add':
+                start, _, end = args.time.partition('-')
+                schedule = FocusSchedule(args.name, args.kind, start, end or None, parse_days(args.days),
+                                         args.focus, args.pause, args.rounds)
+                service.add_schedule(schedule)
+                service.config_store.flush()
+                ensure_daemon(args, paths)
+                print(f"✅ Schedule saved: {schedule.name}")
+            elif args.action == 'remove':
+                if not service.remove_schedule(args.name):
+                    print(f"No schedule named {args.name}")
+                    return 1
+                service.config_store.flush()
+                print(f"✅ Schedule removed: {args.name}")
+            else:
+                for data in service.config.get('schedules', []):
+                    days = ",".join(DAY_NAMES[day] for day in data['days'])
+                    if data['kind'] == 'weekly':
+                        print(f"{data['name']}: {days} {data['start']}-{data['end']}")
+                    else:
+                        print(f"{data['name']}: {days} {data['start']}, {data['rounds']} x "
+                              f"{data['focus']:g}m focus / {data['pause']:g}m break")
+                upcoming = service.schedule.upcoming(time.time(), 5)
+                if upcoming:
+                    print("Upcoming:")
+                    for occurrence in upcoming:
+                        print(f"  {format_occurrence(occurrence)}")
+        elif args.command == 'metrics':
+            if args.action == 'show':
+                return show_metrics(paths.metrics)
+            service.config['metrics'] = args.action == 'on'
+            service.config_store.save()
+            service.config_store.flush()
+            print(f"Metrics {'enabled' if args.action == 'on' else 'disabled'}; "
+                  f"takes effect when the window or daemon next starts")
+        elif args.command == 'proxy':
+            if args.action == 'status':
+                address = service.config.get('proxy')
+                print(f"Proxy: {address} (set it as the browser's HTTP and HTTPS proxy)" if address
+                      else "Proxy: off")
+                return 0
+            if args.action == 'on':
+                address = args.address or f"{PROXY_LISTEN[0]}:{PROXY_LISTEN[1]}"
+                try:
+                    split_authority(address, PROXY_LISTEN[1])
+                except ValueError:
+                    raise ValueError(f"Invalid proxy address: {address}")
+                service.config['proxy'] = address
+            else:
+                service.config.pop('proxy', None)
+            service.config_store.save()
+            service.config_store.flush()
+            print(f"Proxy {'enabled on ' + service.config['proxy'] if args.action == 'on' else 'disabled'}; "
+                  f"takes effect when the window or daemon next starts")
+        elif args.command == 'export':
+            return export_history(args, service)
+        elif args.command == 'attempts':
+            if args.action == 'status':
+                analytics = service.analytics
+                print(f"Block page: {service.config.get('block_page') or 'off'}")
+                print(f"Blocked attempts: {analytics.blocked_attempts():,}")
+                for domain, count in analytics.blocked.most_common(10):
+                    print(f"  {count:>8,}  {domain}")
+                return 0
+            if args.action == 'on':
+                import ipaddress
+                address = args.address or REDIRECT_IP
+                try:
+                    ipaddress.ip_address(address)
+                except ValueError:
+                    raise ValueError(f"Invalid block page address: {address}")
+                service.config['block_page'] = address
+            else:
+                service.config.pop('block_page', None)
+            service.config_store.save()
+            service.config_store.flush()
+            print(f"Block page {'enabled on ' + service.config['block_page'] if args.action == 'on' else 'disabled'}; "
+                  f"takes effect when the window or daemon next starts")
+        else:
+            print_status(service.status())
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+def export_history(args, service):
+    """Stream the sessions of the local history or of --input files to CSV/NDJSON"""
+    def day(text, name):
+        try:
+            return datetime.datetime.combine(datetime.date.fromisoformat(text), datetime.time()) if text else None
+        except ValueError:
+            raise ValueError(f"Invalid {name} date: {text} (use YYYY-MM-DD)")
+    start, end = day(args.since, '--from'), day(args.until, '--to')
+    start = start.timestamp() if start else None
+    # The --to day is included
+    end = (end + datetime.timedelta(days=1)).timestamp() if end else None
+
+    if args.inputs:
+        streams = []
+        for path in args.inputs:
+            try:
+                records, snapshots = history_source(path)
+            except OSError as e:
+                raise ValueError(f"Cannot read {path}: {e}")
+            streams.append(export_rows(iter_sessions(records), snapshots, path, start, end))
+        # Each history is in start order, so a merge keeps the output sorted
+        rows = heapq.merge(*streams, key=lambda row: row['start'])
+    else:
+        log = service.history_log
+        rows = export_rows(iter_sessions(iter(log)), log.snapshots, socket.gethostname(), start, end)
+    fields = EXPORT_FIELDS
+    if args.group:
+        rows, fields = report_rows(rows, args.group), REPORT_FIELDS
+
+    out = open(args.output, 'w', newline='') if args.output != '-' else sys.stdout
+    try:
+        count = write_rows(rows, fields, out, args.format)
+        out.flush()
+    except BrokenPipeError:
+        # `marthaba export | head`; keep Python from complaining at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if args.output != '-':
+        print(f"✅ Exported {count:,} {'periods' if args.group else 'sessions'} to {args.output}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MarThaba Pro - Ultimate Focus System")
+    parser.add_argument('--helper', action='store_true',
+                        help="run the privileged hosts helper (as root)")
+    parser.add_argument('--socket', default=HELPER_SOCKET, help="helper socket path")
+    parser.add_argument('--hosts', default=HOSTS_FILE,
+                        help="hosts file to manage (helper, window and daemon)")
+    parser.add_argument('--data-dir', metavar='DIR',
+                        help="keep config, history and blocklists in DIR instead of ~")
+    parser.add_argument('--storage', choices=['json', 'sqlite'],
+                        help="config/history format; sqlite migrates the JSON files once "
+                             "(default: sqlite if the database exists)")
+    parser.add_argument('--owner', type=int, action='append',
+                        help="uid allowed to talk to the helper (repeatable)")
+    parser.add_argument('--dns', metavar='ADDR[:PORT]',
+                        help="also run the DNS sinkhole backend on this address (e.g. 127.0.0.77)")
+    parser.add_argument('--upstream', default=f"{DNS_UPSTREAM[0]}:{DNS_UPSTREAM[1]}",
+                        help="upstream resolver for the DNS sinkhole")
+    parser.add_argument('--nxdomain', action='store_true',
+                        help="answer blocked names with NXDOMAIN instead of 0.0.0.0")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="print an import and GUI construction timing breakdown")
+    parser.add_argument('--metrics', action='store_true',
+                        help="record metrics for this run even if they are off in the config")
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND',
+                                     help="run headless instead of opening the window")
+    start = commands.add_parser('start', help="start a focus session, e.g. `start 25m` or `start 1h30m`")
+    start.add_argument('duration', help="1h30m, 25m, 90s or plain minutes")
+    commands.add_parser('status', help="show the current session")
+    commands.add_parser('stop', help="emergency stop: end the session in 30 minutes (once)")
+    allow = commands.add_parser('allow', help="manage the allowed sites")
+    allow.add_argument('action', choices=['add', 'remove', 'list'])
+    allow.add_argument('site', nargs='?')
+    schedule = commands.add_parser('schedule', help="recurring sessions, e.g. `schedule add work weekly "
+                                   "09:00-12:00 --days mon-fri` or `schedule add pomo pomodoro 14:00`")
+    schedule.add_argument('action', choices=['add', 'remove', 'list'])
+    schedule.add_argument('name', nargs='?')
+    schedule.add_argument('kind', nargs='?', help="weekly or pomodoro")
+    schedule.add_argument('time', nargs='?', help="HH:MM-HH:MM for weekly, the first start HH:MM for pomodoro")
+    schedule.add_argument('--days', default='daily', help="mon-fri, mon,wed,fri, weekdays, weekends or daily")
+    schedule.add_argument('--focus', type=float, default=25, help="pomodoro focus minutes")
+    schedule.add_argument('--break', dest='pause', type=float, default=5, help="pomodoro break minutes")
+    schedule.add_argument('--rounds', type=int, default=4, help="pomodoro focus sessions in the chain")
+    metrics = commands.add_parser('metrics', help="show recorded metrics (Prometheus text) or turn them on/off")
+    metrics.add_argument('action', nargs='?', choices=['show', 'on', 'off'], default='show')
+    proxy = commands.add_parser('proxy', help="local HTTP proxy that also blocks paths such as "
+                                "youtube.com/shorts (plain HTTP) and checks HTTPS by host")
+    proxy.add_argument('action', nargs='?', choices=['status', 'on', 'off'], default='status')
+    proxy.add_argument('address', nargs='?', help=f"listen address (default {PROXY_LISTEN[0]}:{PROXY_LISTEN[1]})")
+    attempts = commands.add_parser('attempts', help="count visits to blocked sites with a local block page "
+                                   "on ports 80/443 (needs root or CAP_NET_BIND_SERVICE)")
+    attempts.add_argument('action', nargs='?', choices=['status', 'on', 'off'], default='status')
+    attempts.add_argument('address', nargs='?', help=f"address blocked hosts point to (default {REDIRECT_IP})")
+    export = commands.add_parser('export', help="stream sessions or per-period totals as CSV or NDJSON")
+    export.add_argument('--from', dest='since', metavar='YYYY-MM-DD', help="first day to include")
+    export.add_argument('--to', dest='until', metavar='YYYY-MM-DD', help="last day to include")
+    export.add_argument('--group', choices=['day', 'week', 'month'], help="totals per period instead of sessions")
+    export.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+    export.add_argument('-o', '--output', default='-', help="file to write (default stdout)")
+    export.add_argument('--input', dest='inputs', action='append', metavar='PATH',
+                        help="history file or database, e.g. from another machine, instead of the local "
+                        "history; repeat to merge several")
+    commands.add_parser('daemon', help="enforce sessions in the background without the GUI")
+    args = parser.parse_args(argv)
+
+    if args.helper:
+        return run_helper(args)
+    if args.data_dir:
+        os.makedirs(args.data_dir, exist_ok=True)
+        paths = Paths.under(os.path.abspath(args.data_dir), args.hosts, args.storage)
+    else:
+        paths = Paths(hosts=args.hosts, storage=args.storage)
+    if args.command == 'daemon':
+        service = FocusService(paths)
+        if args.metrics or service.config.get('metrics'):
+            METRICS.enable(paths.metrics, 'daemon')
+        return run_daemon(service)
+    if args.command == 'allow' and args.action != 'list' and not args.site:
+        parser.error(f"allow {args.action} needs a site")
+    if args.command == 'schedule' and args.action != 'list' and not args.name:
+        parser.error(f"schedule {args.action} needs a name")
+    if args.command == 'schedule' and args.action == 'add' and not args.time:
+        parser.error("schedule add needs a name, a kind and a time")
+    instance = SingleInstance(paths.instance_lock, paths.instance_socket)
+    if args.command in ('start', 'stop', 'status'):
+        # With a window open it owns the session; let it start or show it
+        code = forward_cli(args, instance)
+        if code is not None:
+            return code
+    if args.command:
+        return run_cli(args, paths)
+
+    profile = StartupProfile()
+    if not instance.acquire():
+        # Raise the open window instead of paying for a second Tk startup
+        try:
+            shown = instance.forward({'op': 'show'})
+        except OSError as e:
+            shown = None
+            print(f"❌ {e}")
+        if shown is None:
+            print("MarThaba is already running but did not answer")
+            return 1
+        return 0
+    profile.mark('instance lock')
+    load_tk()
+    profile.mark('import tkinter')
     root = tk.Tk()
-    app = AnimatedMarThaba(root)
-    app.animate_logo_enhanced()
-    root.mainloop()
+    profile.mark('Tk root')
+    service = FocusService(paths)
+    if args.metrics or service.config.get('metrics'):
+        METRICS.enable(paths.metrics, 'gui')
+    AnimatedMarThaba(root, profile, service, instance.server)
+    if args.profile_startup:
+        root.update()
+        profile.mark('first paint')
+        profile.report(import_breakdown())
+    try:
+        root.mainloop()
+    finally:
+        instance.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
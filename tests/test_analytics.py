@@ -0,0 +1,104 @@
+"""FocusAnalytics: per-record updates, the JSON cache and a full rebuild agree."""
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+Record = marthaba.SessionRecord
+
+
+def at(day, hour):
+    return datetime.datetime.combine(day, datetime.time(hour)).timestamp()
+
+
+class FocusAnalyticsTest(unittest.TestCase):
+    TODAY = datetime.date(2026, 3, 12)
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        self.log = marthaba.SessionLog(os.path.join(self.directory, "history.jsonl"), legacy_path=None)
+        self.cache_path = os.path.join(self.directory, "analytics.json")
+
+    def analytics(self):
+        return marthaba.FocusAnalytics(self.log, self.cache_path)
+
+    def sessions(self):
+        """Three days in a row, one emergency stop and one round of blocked attempts"""
+        records = []
+        for offset, hour in ((2, 9), (1, 14), (0, 9)):
+            day = self.TODAY - datetime.timedelta(days=offset)
+            start = at(day, hour)
+            session = "s%d" % offset
+            records.append(Record(start, start + 3600, session=session))
+            if offset == 1:
+                records.append(Record(start, start + 1200, 'end', planned=3600, completed=False,
+                                      session=session))
+            else:
+                records.append(Record(start, start + 3600, 'end', planned=3600, completed=True,
+                                      session=session))
+        records.append(Record(start, start + 60, 'attempts', domains={'a.com': 3, 'b.com': 1},
+                              session="s0"))
+        return records
+
+    def replay(self, analytics, records):
+        for record in records:
+            self.log.append(record)
+            analytics.record(record)
+
+    def check(self, analytics):
+        yesterday = (self.TODAY - datetime.timedelta(days=1)).isoformat()
+        self.assertEqual((analytics.started, analytics.ended, analytics.completed), (3, 3, 2))
+        self.assertEqual(analytics.today_seconds(self.TODAY), 3600)
+        self.assertEqual(analytics.day_seconds[yesterday], 1200)
+        self.assertEqual(analytics.week_seconds(self.TODAY), 3600 * 2 + 1200)
+        self.assertEqual(analytics.heatmap[self.TODAY.weekday()][9], 3600)
+        self.assertEqual(analytics.streak(self.TODAY), 3)
+        self.assertEqual(analytics.best_streak, 3)
+        self.assertAlmostEqual(analytics.completion_rate(), 2 / 3)
+        self.assertEqual(analytics.blocked_attempts(), 4)
+        self.assertEqual(analytics.blocked['a.com'], 3)
+
+    def test_incremental_updates(self):
+        analytics = self.analytics()
+        self.assertEqual(analytics.started, 0)
+        self.assertIsNone(analytics.completion_rate())
+        self.replay(analytics, self.sessions())
+        self.check(analytics)
+
+    def test_rebuild_matches_incremental(self):
+        self.replay(self.analytics(), self.sessions())
+        os.remove(self.cache_path)
+        self.check(self.analytics())
+
+    def test_cache_is_used_while_the_log_is_unchanged(self):
+        self.replay(self.analytics(), self.sessions())
+        loaded = self.analytics()
+        self.assertEqual(loaded.log_bytes, self.log.size())
+        self.check(loaded)
+        # A record appended behind the cache's back makes it stale
+        start = at(self.TODAY, 20)
+        self.log.append(Record(start, start + 600, session="late"))
+        stale = self.analytics()
+        self.assertEqual(stale.started, 4)
+        self.assertEqual(stale.today_seconds(self.TODAY), 3600 + 600)
+
+    def test_streak_breaks_after_a_missed_day(self):
+        analytics = self.analytics()
+        self.replay(analytics, self.sessions())
+        self.assertEqual(analytics.streak(self.TODAY + datetime.timedelta(days=1)), 3)
+        self.assertEqual(analytics.streak(self.TODAY + datetime.timedelta(days=2)), 0)
+        start = at(self.TODAY + datetime.timedelta(days=2), 9)
+        self.replay(analytics, [Record(start, start + 60, session="gap")])
+        self.assertEqual(analytics.current_streak, 1)
+        self.assertEqual(analytics.best_streak, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
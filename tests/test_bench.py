@@ -0,0 +1,85 @@
+"""Paths redirection and the headless benchmark suite at tiny sizes."""
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_marthaba  # noqa: E402
+import marthaba  # noqa: E402
+
+
+class PathsTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+
+    def test_under_keeps_everything_in_the_directory(self):
+        paths = marthaba.Paths.under(self.directory)
+        for name, value in vars(paths).items():
+            if name == 'storage':
+                self.assertEqual(value, 'json')
+            elif value is not None:
+                self.assertEqual(os.path.dirname(value), self.directory, name)
+        self.assertIsNone(paths.legacy_history)
+        self.assertEqual(marthaba.Paths.under(self.directory, hosts="/x/hosts").hosts, "/x/hosts")
+
+    def test_storage_follows_an_existing_database(self):
+        open(os.path.join(self.directory, "marthaba.db"), 'w').close()
+        self.assertEqual(marthaba.Paths.under(self.directory).storage, 'sqlite')
+        self.assertEqual(marthaba.Paths.under(self.directory, storage='json').storage, 'json')
+
+    def test_service_writes_only_under_its_paths(self):
+        service = marthaba.FocusService(marthaba.Paths.under(self.directory))
+        self.addCleanup(service.session.close)
+        service.start(60)
+        service.finish()
+        service.config_store.flush()
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "config.json")))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "history.jsonl")))
+        self.assertEqual(len(list(service.history_log)), 2)
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_small_runs(self):
+        hosts = bench_marthaba.bench_hosts(lines=50, cycles=2)
+        self.assertEqual(hosts['lines'], 50)
+        self.assertGreater(hosts['apply_bytes_written'], 0)
+        config = bench_marthaba.bench_config(saves=20, sites=5)
+        self.assertEqual(config['writes_for_burst'], 1)
+        self.assertIn('tick_us', bench_marthaba.bench_timer(ticks=50))
+        self.assertIn('10', bench_marthaba.sized(lambda size: {'n': size}, (10,)))
+
+    def test_flatten_and_compare(self):
+        results = {'hosts': {'100': {'apply_ms': 2.0, 'name': "x"}}, 'timer': {'tick_us': 1.0}}
+        self.assertEqual(bench_marthaba.flatten(results),
+                         {'hosts.100.apply_ms': 2.0, 'hosts.100.name': "x", 'timer.tick_us': 1.0})
+        with tempfile.NamedTemporaryFile('w', suffix=".json", delete=False) as f:
+            json.dump({'results': {'hosts': {'100': {'apply_ms': 4.0}}, 'timer': {'tick_us': 0}}}, f)
+        self.addCleanup(os.unlink, f.name)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            bench_marthaba.compare(results, f.name)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ["hosts.100.apply_ms: 4.0 -> 2.0 (-50.0%)", "timer.tick_us: 0 -> 1.0 (n/a)"])
+
+    def test_main_writes_json(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            with redirect_stdout(io.StringIO()):
+                bench_marthaba.main(['timer', '--json', path])
+            with open(path) as f:
+                document = json.load(f)
+        self.assertEqual(list(document['results']), ['timer'])
+        self.assertIn('python', document['meta'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+"""BlockPageServer: blocked attempts counted from Host headers and SNI, flushed per session."""
+import os
+import socket
+import struct
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+SESSION = (1700000000, "aa")
+
+
+def client_hello(server_name):
+    """A minimal TLS 1.2 ClientHello record naming `server_name`"""
+    name = server_name.encode()
+    entry = b"\x00" + struct.pack("!H", len(name)) + name
+    extensions = struct.pack("!HHH", 0, len(entry) + 2, len(entry)) + entry
+    body = (b"\x03\x03" + bytes(32) + b"\x00" + struct.pack("!H", 2) + b"\x13\x01" + b"\x01\x00"
+            + struct.pack("!H", len(extensions)) + extensions)
+    handshake = b"\x01" + len(body).to_bytes(3, 'big') + body
+    return b"\x16\x03\x01" + struct.pack("!H", len(handshake)) + handshake
+
+
+class BlockPageServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flushed = []
+        self.server = marthaba.BlockPageServer("127.0.0.1", ports=(0, 0),
+                                               on_flush=lambda session, counts: self.flushed.append(
+                                                   (session, counts)))
+        self.server.READ_TIMEOUT = 1.0
+        self.server.start_in_thread()
+        self.addCleanup(self.server.stop)
+        self.server.configure(SESSION)
+
+    def send(self, payload, port=None):
+        """The server's answer to `payload`; returns once it closed the connection"""
+        address = ("127.0.0.1", port or self.server.ports[0])
+        with socket.create_connection(address, timeout=5) as sock:
+            sock.sendall(payload)
+            chunks = []
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    return b"".join(chunks)
+                chunks.append(data)
+
+    def wait_for(self, predicate, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if predicate():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_http_gets_the_page_and_is_counted(self):
+        reply = self.send(b"GET / HTTP/1.1\r\nHost: WWW.Example.com:80\r\n\r\n")
+        self.assertTrue(reply.startswith(b"HTTP/1.1 403 Forbidden\r\n"))
+        self.assertTrue(reply.endswith(marthaba.BLOCK_PAGE))
+        self.assertTrue(self.wait_for(lambda: self.server.stats['attempts'] == 1))
+        self.assertEqual(self.server.counts, {"www.example.com": 1})
+
+    def test_tls_is_counted_by_server_name(self):
+        hello = client_hello("reddit.com")
+        self.assertEqual(self.send(hello, self.server.ports[1]), b"")
+        with socket.create_connection(("127.0.0.1", self.server.ports[1]), timeout=5) as sock:
+            for start in range(0, len(hello), 9):
+                sock.sendall(hello[start:start + 9])
+            self.assertEqual(sock.recv(1), b"")
+        self.assertTrue(self.wait_for(lambda: self.server.counts == {"reddit.com": 2}))
+
+    def test_garbage_is_not_counted(self):
+        # Each connection is closed only after it was looked at
+        self.assertEqual(self.send(b"\x16\x03\x01\x00\x02\x01\x00"), b"")
+        self.assertTrue(self.send(b"nonsense\r\n\r\n").startswith(b"HTTP/1.1 403"))
+        self.assertEqual(self.server.stats['attempts'], 0)
+        self.assertEqual(self.server.counts, {})
+
+    def test_counts_are_flushed_when_the_session_changes(self):
+        self.server.count("a.com")
+        self.server.count("a.com")
+        self.server.count("b.com")
+        self.server.configure(SESSION)
+        self.assertEqual(self.flushed, [])
+        self.server.configure(None)
+        self.assertEqual(self.flushed, [(SESSION, {"a.com": 2, "b.com": 1})])
+        self.server.count("c.com")
+        self.server.flush()
+        self.assertEqual(len(self.flushed), 1)
+
+    def test_flush_errors_are_reported(self):
+        self.server.on_flush = lambda session, counts: 1 / 0
+        self.server.count("a.com")
+        with mock.patch('builtins.print') as printed:
+            self.server.flush()
+        self.assertIn("Blocked attempts flush error", printed.call_args[0][0])
+        self.assertEqual(self.server.counts, {})
+
+
+class AttemptLogTest(unittest.TestCase):
+
+    def test_attempts_reach_the_log_and_analytics(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        service = marthaba.FocusService(marthaba.Paths.under(tmp_dir.name))
+        self.addCleanup(service.session.close)
+        self.addCleanup(service.config_store.flush)
+        record = service.start(60)
+        server = marthaba.BlockPageServer("127.0.0.1", ports=(), on_flush=service.log_attempts)
+        server.configure(record.key)
+        server.count("youtube.com")
+        server.count("youtube.com")
+        server.configure(None)
+        service.finish()
+        self.assertEqual(service.analytics.blocked, {"youtube.com": 2})
+        pairs = list(marthaba.iter_sessions(iter(service.history_log)))
+        self.assertEqual([(session.session, session.attempts) for session, _ in pairs], [(record.session, 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
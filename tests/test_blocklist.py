@@ -0,0 +1,139 @@
+"""Blocklist import: parsing, external sort, CompactDomainSet and BlocklistStore."""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_hosts_and_domain_list_formats(self):
+        lines = [
+            "# comment",
+            "0.0.0.0 ads.example.com tracker.example.net  # trailing",
+            "127.0.0.1 localhost",
+            "::1 ip6-localhost",
+            "Plain.Example.org",
+            "! adblock comment",
+            "",
+            "0.0.0.0 0.0.0.0",
+            "nodot",
+            "bad_char$.com",
+            "Some.Site/path",
+        ]
+        self.assertEqual(list(marthaba.parse_blocklist(lines)),
+                         ["ads.example.com", "tracker.example.net", "plain.example.org", "some.site"])
+
+    def test_external_sort_with_small_chunks(self):
+        hosts = ["b.com", "a.com", "x.a.com", "b.com", "c.org", "a.com"] * 3
+        keys = list(marthaba.sorted_unique_keys(hosts, chunk_size=2))
+        self.assertEqual(keys, sorted(set(marthaba.host_key(host) for host in hosts)))
+        self.assertEqual(keys, list(marthaba.sorted_unique_keys(hosts)))
+
+
+class CompactDomainSetTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        self.path = os.path.join(self.directory, "set.bin")
+
+    def open(self, hosts):
+        keys = sorted(set(marthaba.host_key(host) for host in hosts))
+        self.assertEqual(marthaba.CompactDomainSet.write(self.path, keys), len(keys))
+        domains = marthaba.CompactDomainSet(self.path)
+        self.addCleanup(domains.close)
+        return domains
+
+    def test_entry_blocks_host_and_subdomains(self):
+        domains = self.open(["ads.example.com", "tracker.net"])
+        self.assertEqual(len(domains), 2)
+        self.assertIn("ads.example.com", domains)
+        self.assertIn("x.y.ads.example.com", domains)
+        self.assertIn("TRACKER.net", domains)
+        self.assertNotIn("example.com", domains)
+        self.assertNotIn("badtracker.net", domains)
+        self.assertNotIn("net", domains)
+
+    def test_iterates_in_key_order(self):
+        domains = self.open(["b.org", "a.com", "z.a.com"])
+        self.assertEqual(list(domains), ["a.com", "z.a.com", "b.org"])
+
+    def test_empty_set(self):
+        domains = self.open([])
+        self.assertEqual(len(domains), 0)
+        self.assertNotIn("a.com", domains)
+
+    def test_rejects_other_files(self):
+        for content in (b"", b"MTBL", b"NOTASET" + bytes(16)):
+            with open(self.path, 'wb') as f:
+                f.write(content)
+            with self.assertRaises(ValueError):
+                marthaba.CompactDomainSet(self.path)
+
+
+class BlocklistStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        self.store = marthaba.BlocklistStore(os.path.join(self.directory, "store"))
+        self.first = self.source("first.txt", "0.0.0.0 a.com\n0.0.0.0 b.com\n")
+        self.second = self.source("second.txt", "b.com\nc.org\n")
+
+    def source(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def hosts(self):
+        domains = self.store.open()
+        try:
+            return list(domains)
+        finally:
+            domains.close()
+
+    def test_sources_are_merged(self):
+        self.assertIsNone(self.store.open())
+        summary = self.store.import_sources([self.first, self.second])
+        self.assertEqual(summary['entries'], 3)
+        self.assertEqual(sorted(summary['imported']), sorted([self.first, self.second]))
+        self.assertEqual(sorted(self.hosts()), ["a.com", "b.com", "c.org"])
+
+    def test_unchanged_sources_are_skipped(self):
+        self.store.import_sources([self.first, self.second])
+        mtime = os.stat(self.store.combined_path).st_mtime_ns
+        summary = self.store.import_sources([self.first, self.second])
+        self.assertEqual(summary['imported'], [])
+        self.assertEqual(summary['entries'], 3)
+        self.assertEqual(os.stat(self.store.combined_path).st_mtime_ns, mtime)
+
+    def test_changed_and_removed_sources(self):
+        self.store.import_sources([self.first, self.second])
+        self.source("first.txt", "d.net\n")
+        summary = self.store.import_sources([self.first])
+        self.assertEqual(summary['imported'], [self.first])
+        self.assertEqual(summary['removed'], [self.second])
+        self.assertEqual(self.hosts(), ["d.net"])
+        shard = os.path.basename(self.store.shard_path(self.first))
+        self.assertEqual(sorted(os.listdir(self.store.directory)), sorted(["blocklist.bin", "manifest.json", shard]))
+
+    def test_enforcer_blocks_imported_hosts(self):
+        self.store.import_sources([self.first])
+        hosts_file = self.source("hosts", "127.0.0.1 localhost\n")
+        marthaba.HostsEnforcer(hosts_file).apply(["x.com"], ["b.com"], self.store.combined_path)
+        with open(hosts_file) as f:
+            content = f.read()
+        self.assertIn("127.0.0.1 x.com\n127.0.0.1 a.com\n", content)
+        self.assertNotIn("b.com", content)
+
+
+if __name__ == "__main__":
+    unittest.main()
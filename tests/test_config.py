@@ -0,0 +1,98 @@
+"""ConfigStore: coalesced background writes, atomic replace and reloads."""
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+
+class ConfigStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        self.path = os.path.join(self.directory, "config.json")
+
+    def store(self, delay=0.05):
+        store = marthaba.ConfigStore(self.path, delay=delay)
+        self.addCleanup(store.flush)
+        return store
+
+    def on_disk(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    def wait_for_writes(self, store, count, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if store.writes >= count and not store.dirty:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_missing_or_broken_file_gives_defaults(self):
+        self.assertEqual(self.store().data, marthaba.ConfigStore.DEFAULTS)
+        with open(self.path, 'w') as f:
+            f.write("{not json")
+        store = self.store()
+        self.assertEqual(store.data, marthaba.ConfigStore.DEFAULTS)
+        store.data['allowed_sites'].append("a.com")
+        self.assertEqual(marthaba.ConfigStore.DEFAULTS['allowed_sites'], [])
+
+    def test_burst_of_saves_is_one_write(self):
+        store = self.store(delay=0.2)
+        for i in range(50):
+            store.data['count'] = i
+            store.save()
+        self.assertTrue(self.wait_for_writes(store, 1))
+        self.assertEqual(store.writes, 1)
+        self.assertEqual(self.on_disk()['count'], 49)
+
+    def test_flush_writes_now(self):
+        store = self.store(delay=60)
+        store.data['active'] = True
+        store.save()
+        self.assertFalse(os.path.exists(self.path))
+        store.flush()
+        self.assertTrue(self.on_disk()['active'])
+        store.flush()
+        self.assertEqual(store.writes, 1)
+
+    def test_failed_write_stays_pending(self):
+        store = self.store(delay=60)
+        store.data['active'] = True
+        store.save()
+        with mock.patch.object(marthaba.os, 'replace', side_effect=OSError("disk full")):
+            store.flush()
+        self.assertTrue(store.dirty)
+        self.assertEqual(os.listdir(self.directory), [])
+        store.flush()
+        self.assertTrue(self.on_disk()['active'])
+
+    def test_other_writers_are_noticed(self):
+        store = self.store()
+        store.data['active'] = True
+        store.save()
+        store.flush()
+        self.assertFalse(store.changed_on_disk())
+        data = dict(store.data, allowed_sites=["b.com"])
+        with open(self.path + ".new", 'w') as f:
+            json.dump(data, f)
+        os.replace(self.path + ".new", self.path)
+        self.assertTrue(store.changed_on_disk())
+        current = store.data
+        store.reload()
+        self.assertIs(store.data, current)
+        self.assertEqual(store.data['allowed_sites'], ["b.com"])
+        self.assertFalse(store.changed_on_disk())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+"""DnsSinkhole end to end against FakeDnsUpstream, plus the DnsCache TTL rules."""
+import os
+import socket
+import struct
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+
+def answer_address(response):
+    """rdata of the single A answer, or None"""
+    if not marthaba.DNS_HEADER.unpack_from(response, 0)[3]:
+        return None
+    return socket.inet_ntoa(response[-4:])
+
+
+class SinkholeTest(unittest.TestCase):
+    TTL = 1
+
+    def setUp(self):
+        self.upstream = marthaba.FakeDnsUpstream(ttl=self.TTL).__enter__()
+        self.addCleanup(self.upstream.__exit__, None, None, None)
+        self.sinkhole = marthaba.DnsSinkhole(("127.0.0.1", 0), self.upstream.address)
+        self.sinkhole.start_in_thread()
+        self.addCleanup(self.sinkhole.stop)
+        self.sinkhole.configure(True, ["youtube.com", "*.reddit.com"], ["m.youtube.com"])
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(5)
+        self.addCleanup(self.sock.close)
+
+    def query(self, name, qid=0x1234, qtype=marthaba.DNS_TYPE_A):
+        self.sock.sendto(marthaba.dns_build_query(qid, name, qtype), self.sinkhole.listen)
+        response, _ = self.sock.recvfrom(4096)
+        self.assertEqual(struct.unpack_from("!H", response, 0)[0], qid)
+        return response
+
+    def wait_configured(self):
+        # configure() is applied on the sinkhole's loop; a query round trip flushes it
+        self.query("flush.invalid")
+
+    def test_blocked_domain_gets_sink_answer(self):
+        self.assertEqual(answer_address(self.query("youtube.com")), "0.0.0.0")
+        self.assertEqual(answer_address(self.query("www.reddit.com")), "0.0.0.0")
+        self.assertEqual(self.upstream.queries, 0)
+        self.assertEqual(self.sinkhole.stats['blocked'], 2)
+
+    def test_allowed_domain_is_forwarded(self):
+        self.assertEqual(answer_address(self.query("m.youtube.com")), "192.0.2.1")
+        self.assertEqual(answer_address(self.query("example.com")), "192.0.2.1")
+        self.assertEqual(self.upstream.queries, 2)
+
+    def test_nothing_blocked_when_inactive(self):
+        self.sinkhole.configure(False)
+        self.wait_configured()
+        self.assertEqual(answer_address(self.query("youtube.com")), "192.0.2.1")
+
+    def test_nxdomain_mode(self):
+        self.sinkhole.nxdomain = True
+        response = self.query("youtube.com")
+        self.assertEqual(response[3] & 0x0F, marthaba.DNS_RCODE_NXDOMAIN)
+        self.assertIsNone(answer_address(response))
+
+    def test_cache_hit_keeps_query_id(self):
+        self.query("example.com", qid=1)
+        response = self.query("example.com", qid=2)
+        self.assertEqual(answer_address(response), "192.0.2.1")
+        self.assertEqual(self.upstream.queries, 1)
+        self.assertEqual(self.sinkhole.cache.hits, 1)
+
+    def test_cache_entry_expires_with_ttl(self):
+        self.query("example.com")
+        time.sleep(self.TTL + 0.1)
+        self.query("example.com")
+        self.assertEqual(self.upstream.queries, 2)
+
+    def test_tcp_query(self):
+        query = marthaba.dns_build_query(7, "youtube.com")
+        with socket.create_connection(self.sinkhole.listen, timeout=5) as sock:
+            sock.sendall(struct.pack("!H", len(query)) + query)
+            reader = sock.makefile('rb')
+            length = struct.unpack("!H", reader.read(2))[0]
+            response = reader.read(length)
+        self.assertEqual(answer_address(response), "0.0.0.0")
+
+    def test_malformed_tcp_query_closes_only_its_connection(self):
+        for query in (b"\x00\x01", marthaba.dns_build_query(8, "youtube.com")[:-3]):
+            with socket.create_connection(self.sinkhole.listen, timeout=5) as sock:
+                sock.sendall(struct.pack("!H", len(query)) + query)
+                self.assertEqual(sock.recv(512), b"")
+        self.assertEqual(self.sinkhole.stats['errors'], 2)
+        self.test_tcp_query()
+
+
+class DnsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.upstream = marthaba.FakeDnsUpstream(ttl=300)
+        self.addCleanup(self.upstream.sock.close)
+        self.query = marthaba.dns_build_query(1, "example.com")
+        parsed = marthaba.dns_parse_query(self.query)
+        self.question = self.query[marthaba.DNS_HEADER.size:parsed[-1]]
+        self.key = ("example.com", marthaba.DNS_TYPE_A, 1)
+        self.cache = marthaba.DnsCache()
+        self.clock = 1000.0
+        patcher = mock.patch.object(marthaba.time, 'monotonic', lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache.put(self.key, self.upstream.answer(self.query), parsed[-1])
+
+    def ttl(self, response):
+        return struct.unpack_from("!I", response, len(response) - 4 - 2 - 4)[0]
+
+    def test_ttl_counts_down(self):
+        self.clock += 100
+        response = self.cache.get(self.key, 9, self.question)
+        self.assertEqual(self.ttl(response), 200)
+        self.assertEqual(struct.unpack_from("!H", response, 0)[0], 9)
+
+    def test_expired_entry_is_dropped(self):
+        self.clock += 300
+        self.assertIsNone(self.cache.get(self.key, 9, self.question))
+        self.assertNotIn(self.key, self.cache.entries)
+
+    def test_lru_capacity(self):
+        self.cache.capacity = 1
+        other = marthaba.dns_build_query(2, "example.org")
+        self.cache.put(("example.org", marthaba.DNS_TYPE_A, 1), self.upstream.answer(other),
+                       marthaba.dns_parse_query(other)[-1])
+        self.assertIsNone(self.cache.get(self.key, 1, self.question))
+
+
+if __name__ == "__main__":
+    unittest.main()
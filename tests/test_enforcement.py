@@ -0,0 +1,78 @@
+"""EnforcementWorker against a scripted backend."""
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+
+class FlakyBackend:
+    """Fails the first `failures` applies, like a helper that is not up yet"""
+
+    def __init__(self, hosts_file, failures):
+        self.hosts_file = hosts_file
+        self.failures = failures
+        self.applies = 0
+        self.clears = 0
+        self.applied = threading.Event()
+
+    def apply(self, blocked, allowed=(), blocklist=None):
+        self.applies += 1
+        if self.applies <= self.failures:
+            raise OSError("helper is down")
+        self.applied.set()
+        stats = marthaba.CycleStats()
+        stats.changed = True
+        return stats
+
+    def clear(self):
+        self.clears += 1
+        return marthaba.CycleStats()
+
+
+class EnforcementWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        hosts_file = os.path.join(tmp_dir.name, "hosts")
+        open(hosts_file, 'w').close()
+        self.backend = FlakyBackend(hosts_file, failures=2)
+        patcher = mock.patch.object(marthaba, 'enforcement_backend', lambda kind, hosts: self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.session = marthaba.SessionState()
+        self.addCleanup(self.session.close)
+        self.worker = marthaba.EnforcementWorker(self.session, hosts_file=hosts_file)
+        self.worker.RETRY_MIN = 0.05
+
+    def test_failed_apply_is_retried(self):
+        self.worker.start()
+        self.session.start(time.time(), time.time() + 60, [])
+        self.assertTrue(self.backend.applied.wait(5))
+        self.assertEqual(self.backend.applies, 3)
+
+    def test_no_retry_after_success(self):
+        self.backend.failures = 0
+        self.worker.start()
+        self.session.start(time.time(), time.time() + 60, [])
+        self.assertTrue(self.backend.applied.wait(5))
+        time.sleep(0.3)
+        self.assertEqual(self.backend.applies, 1)
+
+    def test_apply_is_quiet(self):
+        self.backend.failures = 0
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            self.assertTrue(self.worker.apply(self.backend, ()))
+        self.assertEqual(stdout.getvalue(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
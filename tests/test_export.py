@@ -0,0 +1,59 @@
+"""`marthaba export` inputs are read, never modified."""
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+
+class ExportInputTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        paths = marthaba.Paths.under(os.path.join(self.directory, "machine"), storage='sqlite')
+        os.makedirs(os.path.dirname(paths.database))
+        service = marthaba.FocusService(paths)
+        start = int(time.time()) - 7200
+        service.log(marthaba.SessionRecord(start, start + 1800, sites=service.history_log.snapshots.put(["a.com"])))
+        service.log(marthaba.SessionRecord(start, start + 1200, event='end', planned=1800, completed=False))
+        service.history_log.database.close()
+        # A copy as it would arrive from another machine: rollback journal, read-only
+        self.database = os.path.join(self.directory, "copy.db")
+        connection = sqlite3.connect(paths.database)
+        connection.execute("PRAGMA journal_mode=DELETE")
+        connection.execute("VACUUM INTO ?", (self.database,))
+        connection.close()
+        os.chmod(self.database, 0o444)
+
+    def digest(self):
+        with open(self.database, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def test_database_input_is_untouched(self):
+        before = self.digest()
+        records, snapshots = marthaba.history_source(self.database)
+        rows = list(marthaba.export_rows(marthaba.iter_sessions(records), snapshots, "copy"))
+        self.assertEqual([(row['status'], row['sites']) for row in rows], [('ended_early', "a.com")])
+        self.assertEqual(self.digest(), before)
+        self.assertEqual(sorted(os.listdir(self.directory)), ["copy.db", "machine"])
+        connection = sqlite3.connect(self.database)
+        self.assertEqual(connection.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+        connection.close()
+
+    def test_readonly_database_refuses_writes(self):
+        database = marthaba.Database(self.database, readonly=True)
+        self.addCleanup(database.close)
+        with self.assertRaises(sqlite3.OperationalError):
+            database.put_snapshot("x", ["b.com"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+"""HelperServer protocol against MockHelper (a temp hosts file, no root needed)."""
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+
+class HelperProtocolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.helper = marthaba.MockHelper().__enter__()
+        self.addCleanup(self.helper.__exit__, None, None, None)
+        self.client = marthaba.HelperClient(self.helper.socket_path)
+        self.addCleanup(self.client.close)
+
+    def hosts(self):
+        with open(self.helper.enforcer.hosts_file) as f:
+            return f.read()
+
+    def raw_request(self, payload):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        sock.connect(self.helper.socket_path)
+        try:
+            sock.sendall(payload)
+            return json.loads(sock.makefile('rb').readline())
+        finally:
+            sock.close()
+
+    def test_status_reports_managed_file(self):
+        self.assertTrue(self.client.available())
+        self.assertEqual(self.client.hosts_file, self.helper.enforcer.hosts_file)
+        self.assertFalse(self.client.status()['active'])
+
+    def test_apply_and_clear(self):
+        self.client.apply(["example.com", "Example.ORG"], ["m.example.com"])
+        hosts = self.hosts()
+        self.assertIn("127.0.0.1 example.com\n", hosts)
+        self.assertIn("127.0.0.1 example.org\n", hosts)
+        self.assertTrue(hosts.startswith("127.0.0.1 localhost\n"))
+        self.assertEqual(self.client.status()['entries'], 2)
+
+        self.client.clear()
+        self.assertEqual(self.hosts(), "127.0.0.1 localhost\n")
+        self.assertFalse(self.client.status()['active'])
+
+    def test_allowed_sites_are_not_written(self):
+        self.client.apply(["youtube.com", "m.youtube.com"], ["m.youtube.com"])
+        self.assertNotIn("m.youtube.com", self.hosts())
+
+    def test_batch_runs_in_order(self):
+        results = self.client.batch({'op': 'apply', 'blocked': ["a.com"]}, {'op': 'status'},
+                                    {'op': 'clear'}, {'op': 'status'})
+        self.assertTrue(results[1]['active'])
+        self.assertFalse(results[3]['active'])
+
+    def test_injected_lines_are_rejected(self):
+        for blocked in (["evil.com\n6.6.6.6 bank.example.com"], ["a.com 6.6.6.6"], ["a.com\tb.com"],
+                        ["-bad.com"], ["a..com"], [""], [5], "a.com"):
+            with self.subTest(blocked=blocked):
+                with self.assertRaises(OSError):
+                    self.client.batch({'op': 'apply', 'blocked': blocked})
+        self.assertEqual(self.hosts(), "127.0.0.1 localhost\n")
+
+    def test_rejected_request_leaves_connection_usable(self):
+        with self.assertRaises(OSError):
+            self.client.batch({'op': 'apply', 'blocked': ["bad host"]})
+        self.assertFalse(self.client.status()['active'])
+
+    def test_bad_allowlist_and_blocklist_are_rejected(self):
+        with self.assertRaises(OSError):
+            self.client.batch({'op': 'apply', 'blocked': ["a.com"], 'allowed': [["x"]]})
+        with self.assertRaises(OSError):
+            self.client.batch({'op': 'apply', 'blocked': ["a.com"], 'blocklist': "relative/path"})
+
+    def write_blocklist(self, name, uid):
+        path = os.path.join(self.helper.tmp_dir, name)
+        marthaba.CompactDomainSet.write(path, [marthaba.host_key("bad.com")])
+        os.chown(path, uid, -1)
+        return path
+
+    def test_blocklist_must_belong_to_the_owner(self):
+        owned = self.write_blocklist("owned.set", os.getuid())
+        self.client.batch({'op': 'apply', 'blocked': ["a.com"], 'blocklist': owned})
+        self.assertIn("127.0.0.1 bad.com\n", self.hosts())
+
+        self.helper.allowed_uids.clear()
+        self.helper.allowed_uids.add(os.getuid() + 1)
+        self.client.batch({'op': 'apply', 'blocked': ["a.com"], 'blocklist': owned})
+        self.assertNotIn("bad.com", self.hosts())
+        self.assertIn("127.0.0.1 a.com\n", self.hosts())
+
+    def test_blocklist_must_be_a_regular_file(self):
+        fifo = os.path.join(self.helper.tmp_dir, "fifo")
+        os.mkfifo(fifo)
+        self.client.batch({'op': 'apply', 'blocked': ["a.com"], 'blocklist': fifo})
+        self.assertNotIn("bad.com", self.hosts())
+        with self.assertRaises(ValueError):
+            marthaba.CompactDomainSet(self.write_blocklist("other.set", os.getuid()), {os.getuid() + 1})
+
+    def test_unknown_op(self):
+        with self.assertRaisesRegex(OSError, "unknown op"):
+            self.client.batch({'op': 'bogus'})
+
+    def test_malformed_json(self):
+        response = self.raw_request(b"{not json\n")
+        self.assertFalse(response['ok'])
+
+    def test_dns_ops_need_the_sinkhole(self):
+        with self.assertRaisesRegex(OSError, "sinkhole"):
+            self.client.batch({'op': 'dns_status'})
+
+    def test_only_owner_and_root_are_authorized(self):
+        class Peer:
+            def __init__(self, uid):
+                self.uid = uid
+
+            def getsockopt(self, *args):
+                return struct.pack("3i", 1234, self.uid, self.uid)
+
+        owner = os.getuid() or 1000
+        self.helper.allowed_uids = {owner}
+        self.assertTrue(self.helper.is_authorized(Peer(owner)))
+        self.assertTrue(self.helper.is_authorized(Peer(0)))
+        self.assertFalse(self.helper.is_authorized(Peer(owner + 1)))
+
+    def test_unauthorized_connection_is_refused(self):
+        self.helper.is_authorized = lambda sock: False
+        response = self.raw_request(json.dumps({'op': 'status'}).encode() + b"\n")
+        self.assertEqual(response, {'ok': False, 'error': 'permission denied'})
+
+    def test_socket_is_not_world_accessible(self):
+        mode = stat.S_IMODE(os.stat(self.helper.socket_path).st_mode)
+        self.assertEqual(mode & 0o007, 0)
+
+    def test_server_needs_an_owner(self):
+        with self.assertRaises(ValueError):
+            marthaba.HelperServer(os.path.join(self.helper.tmp_dir, "other.sock"),
+                                  self.helper.enforcer.hosts_file, ())
+
+
+class HostNameTest(unittest.TestCase):
+
+    def test_valid(self):
+        for host in ("example.com", "a-b.example.co.uk", "x_y.example", "localhost", "1.2.3.4"):
+            self.assertTrue(marthaba.is_host_name(host), host)
+
+    def test_invalid(self):
+        for host in ("", "Example.com", "a b", "a\nb", "a.com/path", "*.a.com", "a..b", "-a.com",
+                     "a-.com", "a" * 64 + ".com", None):
+            self.assertFalse(marthaba.is_host_name(host), host)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+"""HostsEnforcer on a temporary hosts file: one read, in-memory diff, atomic write."""
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+ORIGINAL = "127.0.0.1 localhost\n::1 localhost\n# keep me\n10.0.0.2 nas.lan\n"
+
+
+class HostsEnforcerTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        self.hosts_file = os.path.join(self.directory, "hosts")
+        with open(self.hosts_file, 'w') as f:
+            f.write(ORIGINAL)
+        os.chmod(self.hosts_file, 0o644)
+        self.enforcer = marthaba.HostsEnforcer(self.hosts_file)
+
+    def hosts(self):
+        with open(self.hosts_file) as f:
+            return f.read()
+
+    def test_apply_writes_one_section(self):
+        stats = self.enforcer.apply(["a.com", "b.com"])
+        self.assertTrue(stats.changed)
+        self.assertEqual(self.hosts(), ORIGINAL + "\n# BEGIN MarThaba Focus\n127.0.0.1 a.com\n"
+                                                  "127.0.0.1 b.com\n# END MarThaba Focus\n")
+        self.assertEqual(stats.bytes_written, len(self.hosts().encode()))
+        self.assertEqual(stats.bytes_read, len(ORIGINAL))
+        self.assertEqual(stats.subprocesses, 0)
+
+    def test_unchanged_block_is_not_rewritten(self):
+        self.enforcer.apply(["a.com"])
+        inode = os.stat(self.hosts_file).st_ino
+        stats = self.enforcer.apply(["a.com"])
+        self.assertFalse(stats.changed)
+        self.assertEqual(stats.bytes_written, 0)
+        self.assertEqual(os.stat(self.hosts_file).st_ino, inode)
+        self.assertIs(self.enforcer.last_stats, stats)
+
+    def test_new_list_replaces_the_section(self):
+        self.enforcer.apply(["a.com", "b.com"])
+        self.enforcer.apply(["c.com"])
+        content = self.hosts()
+        self.assertEqual(content.count("# BEGIN MarThaba Focus"), 1)
+        self.assertNotIn("a.com", content)
+        self.assertIn("127.0.0.1 c.com\n", content)
+
+    def test_clear_restores_the_original(self):
+        self.enforcer.apply(["a.com"])
+        self.assertTrue(self.enforcer.clear().changed)
+        self.assertEqual(self.hosts(), ORIGINAL)
+        self.assertFalse(self.enforcer.clear().changed)
+
+    def test_allowed_hosts_are_left_out(self):
+        self.enforcer.apply(["youtube.com", "m.youtube.com", "reddit.com"], ["youtube.com"])
+        content = self.hosts()
+        self.assertNotIn("youtube.com", content)
+        self.assertIn("127.0.0.1 reddit.com\n", content)
+
+    def test_nothing_blocked_writes_no_section(self):
+        self.assertFalse(self.enforcer.apply([]).changed)
+        self.assertEqual(self.hosts(), ORIGINAL)
+
+    def test_write_keeps_mode_and_leaves_no_temp_file(self):
+        os.chmod(self.hosts_file, 0o640)
+        self.enforcer.apply(["a.com"])
+        self.assertEqual(stat.S_IMODE(os.stat(self.hosts_file).st_mode), 0o640)
+        self.assertEqual(os.listdir(self.directory), ["hosts"])
+
+    def test_failed_write_keeps_the_old_file(self):
+        with mock.patch.object(marthaba.os, 'replace', side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.enforcer.apply(["a.com"])
+        self.assertEqual(self.hosts(), ORIGINAL)
+        self.assertEqual(os.listdir(self.directory), ["hosts"])
+
+    def test_unwritable_directory_uses_one_sudo_call(self):
+        result = mock.Mock(returncode=0, stderr=b"")
+        with mock.patch.object(marthaba.os, 'access', return_value=False), \
+                mock.patch('subprocess.run', return_value=result) as run:
+            stats = self.enforcer.apply(["a.com"])
+        self.assertEqual(run.call_count, 1)
+        self.assertEqual(stats.subprocesses, 1)
+        self.assertEqual(run.call_args[0][0][:3], ['sudo', 'sh', '-c'])
+        self.assertEqual(run.call_args[0][0][-1], self.hosts_file)
+
+
+class ManagedSectionTest(unittest.TestCase):
+    SECTION = "\n# BEGIN MarThaba Focus\n127.0.0.1 a.com\n# END MarThaba Focus\n"
+
+    def setUp(self):
+        self.enforcer = marthaba.HostsEnforcer(os.devnull)
+
+    def test_strip_and_extract(self):
+        content = ORIGINAL + self.SECTION
+        self.assertEqual(self.enforcer.strip_section(content), ORIGINAL)
+        self.assertEqual(self.enforcer.extract_section(content), self.SECTION)
+        self.assertEqual(self.enforcer.extract_section(ORIGINAL), "")
+
+    def test_lines_after_the_section_survive(self):
+        content = ORIGINAL + self.SECTION + "10.0.0.3 printer.lan\n"
+        self.assertEqual(self.enforcer.strip_section(content), ORIGINAL + "10.0.0.3 printer.lan\n")
+
+    def test_desired_content_is_idempotent(self):
+        once = self.enforcer.desired_content(ORIGINAL, ["a.com"])
+        self.assertEqual(once, ORIGINAL + self.SECTION)
+        self.assertEqual(self.enforcer.desired_content(once, ["a.com"]), once)
+
+    def test_compact_drops_legacy_leftovers(self):
+        legacy = "\n# MarThaba Focus\n127.0.0.1 youtube.com\n127.0.0.1  facebook.com\n\n\n"
+        content = ORIGINAL + legacy * 3 + self.SECTION
+        compacted = self.enforcer.compact_content(content, ["youtube.com", "facebook.com"])
+        self.assertEqual(compacted, ORIGINAL + self.SECTION)
+        self.assertEqual(self.enforcer.compact_content(compacted, ["youtube.com"]), compacted)
+
+
+class TamperWatchTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.hosts_file = os.path.join(tmp_dir.name, "hosts")
+        with open(self.hosts_file, 'w') as f:
+            f.write(ORIGINAL)
+
+    def watcher(self):
+        watcher = marthaba.FileWatcher(self.hosts_file, poll_interval=0.05)
+        self.addCleanup(watcher.close)
+        return watcher
+
+    def test_wait_sees_an_atomic_replace(self):
+        watcher = self.watcher()
+        self.assertFalse(watcher.wait(0.05))
+        marthaba.HostsEnforcer(self.hosts_file).apply(["a.com"])
+        self.assertTrue(watcher.wait(2))
+        watcher.drain()
+        self.assertFalse(watcher.wait(0.05))
+
+    def test_polling_fallback(self):
+        watcher = self.watcher()
+        watcher._release()
+        watcher._wake_r, watcher._wake_w = os.pipe()
+        self.assertFalse(watcher.uses_inotify)
+        with open(self.hosts_file, 'a') as f:
+            f.write("10.0.0.9 other.lan\n")
+        self.assertTrue(watcher.wait(2))
+
+    def test_watch_calls_back_until_closed(self):
+        watcher = self.watcher()
+        changed = threading.Event()
+        thread = threading.Thread(target=watcher.watch, args=(changed.set,), daemon=True)
+        thread.start()
+        with open(self.hosts_file, 'a') as f:
+            f.write("10.0.0.9 other.lan\n")
+        self.assertTrue(changed.wait(2))
+        watcher.close()
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+
+    def test_worker_restores_a_removed_section(self):
+        session = marthaba.SessionState()
+        self.addCleanup(session.close)
+        worker = marthaba.EnforcementWorker(session, hosts_file=self.hosts_file)
+        worker.start()
+        session.start(time.time(), time.time() + 60, [])
+        self.assertTrue(self.wait_for(lambda content: "# BEGIN MarThaba Focus" in content))
+        # Someone saves the file without the section; the watcher wakes the worker at once
+        with open(self.hosts_file + ".new", 'w') as f:
+            f.write(ORIGINAL)
+        os.replace(self.hosts_file + ".new", self.hosts_file)
+        self.assertTrue(self.wait_for(lambda content: "# BEGIN MarThaba Focus" in content))
+        session.finish()
+        self.assertTrue(self.wait_for(lambda content: content == ORIGINAL))
+
+    def wait_for(self, predicate, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with open(self.hosts_file) as f:
+                if predicate(f.read()):
+                    return True
+            time.sleep(0.02)
+        return False
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+"""SingleInstance lock and command hand-off, with a thread standing in for Tk."""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+
+class SingleInstanceTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.lock_path = os.path.join(tmp_dir.name, "instance.lock")
+        self.socket_path = os.path.join(tmp_dir.name, "instance.sock")
+        self.window = self.instance()
+        self.assertTrue(self.window.acquire())
+        self.addCleanup(self.window.close)
+        self.window.server.TIMEOUT = 2.0
+        self.handled = []
+        self.window.server.attach(self.handle, self.notify)
+
+    def instance(self):
+        return marthaba.SingleInstance(self.lock_path, self.socket_path)
+
+    def handle(self, op):
+        self.handled.append(op)
+        if op['op'] == 'fail':
+            raise KeyError(op['op'])
+        if op['op'] == 'bad':
+            raise ValueError("bad command")
+        return {'shown': True}
+
+    def notify(self):
+        # The window runs run_pending() from Tk's after_idle
+        threading.Thread(target=self.window.server.run_pending, daemon=True).start()
+
+    def test_second_launch_forwards_its_command(self):
+        launch = self.instance()
+        self.assertFalse(launch.acquire())
+        self.assertTrue(launch.held())
+        self.assertEqual(launch.forward({'op': 'show'}), {'shown': True})
+        self.assertEqual(self.handled, [{'op': 'show'}])
+
+    def test_handler_errors_are_answered(self):
+        launch = self.instance()
+        for op, message in (('bad', "bad command"), ('fail', "fail")):
+            started = time.monotonic()
+            with self.assertRaisesRegex(OSError, message):
+                launch.forward({'op': op})
+            self.assertLess(time.monotonic() - started, self.window.server.TIMEOUT)
+        # The queue keeps working after a failure
+        self.assertEqual(launch.forward({'op': 'show'}), {'shown': True})
+
+    def test_lock_is_free_after_close(self):
+        self.window.close()
+        launch = self.instance()
+        self.assertFalse(launch.held())
+        self.assertIsNone(launch.forward({'op': 'show'}))
+        self.assertTrue(launch.acquire())
+        launch.close()
+
+    def test_lock_file_names_the_holder(self):
+        with open(self.lock_path) as f:
+            self.assertEqual(f.read(), str(os.getpid()))
+
+    def test_commands_wait_for_the_window_to_attach(self):
+        self.window.close()
+        self.window = self.instance()
+        self.assertTrue(self.window.acquire())
+        self.addCleanup(self.window.close)
+        results = []
+        launch = threading.Thread(target=lambda: results.append(self.instance().forward({'op': 'show'})))
+        launch.start()
+        time.sleep(0.1)
+        self.assertEqual(self.handled, [])
+        self.window.server.attach(self.handle, self.notify)
+        launch.join(5)
+        self.assertEqual(results, [{'shown': True}])
+
+    def test_stale_socket_is_replaced(self):
+        self.window.close()
+        with open(self.socket_path, 'w'):
+            pass
+        window = self.instance()
+        self.assertTrue(window.acquire())
+        self.addCleanup(window.close)
+        window.server.attach(lambda op: op['op'], lambda: window.server.run_pending())
+        self.assertEqual(self.instance().forward({'op': 'show'}), 'show')
+
+    def test_lock_dies_with_its_process(self):
+        self.window.close()
+        code = ("import sys, marthaba; instance = marthaba.SingleInstance(sys.argv[1], sys.argv[2]); "
+                "print(instance.acquire(), flush=True); sys.stdin.read()")
+        holder = subprocess.Popen([sys.executable, '-c', code, self.lock_path, self.socket_path],
+                                  cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        self.addCleanup(holder.wait)
+        self.assertEqual(holder.stdout.readline().strip(), "True")
+        launch = self.instance()
+        self.assertFalse(launch.acquire())
+        self.assertTrue(launch.held())
+        holder.kill()
+        holder.wait()
+        holder.stdin.close()
+        holder.stdout.close()
+        self.assertFalse(launch.held())
+        self.assertTrue(launch.acquire())
+        launch.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
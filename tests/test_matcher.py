@@ -0,0 +1,71 @@
+"""DomainMatcher rules and host normalisation."""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+
+class NormalizeHostTest(unittest.TestCase):
+
+    def test_urls_and_rules(self):
+        cases = {
+            "YouTube.com": "youtube.com",
+            " https://www.YouTube.com/shorts/abc?x=1 ": "www.youtube.com",
+            "example.com:8080": "example.com",
+            "example.com.": "example.com",
+            "example.com?q": "example.com",
+            "": "",
+        }
+        for value, host in cases.items():
+            self.assertEqual(marthaba.normalize_host(value), host, value)
+
+
+class DomainMatcherTest(unittest.TestCase):
+
+    def test_plain_rule_is_exact(self):
+        matcher = marthaba.DomainMatcher(["example.com"])
+        self.assertTrue(matcher.matches("example.com"))
+        self.assertTrue(matcher.matches("EXAMPLE.com."))
+        self.assertFalse(matcher.matches("www.example.com"))
+        self.assertFalse(matcher.matches("badexample.com"))
+
+    def test_wildcard_covers_subdomains_only(self):
+        matcher = marthaba.DomainMatcher(["*.example.com"])
+        self.assertTrue(matcher.matches("a.example.com"))
+        self.assertTrue(matcher.matches("a.b.example.com"))
+        self.assertFalse(matcher.matches("example.com"))
+        self.assertFalse(matcher.matches("notexample.com"))
+
+    def test_include_subdomains(self):
+        matcher = marthaba.DomainMatcher(["youtube.com"], include_subdomains=True)
+        self.assertTrue(matcher.matches("youtube.com"))
+        self.assertTrue(matcher.matches("m.youtube.com"))
+        self.assertFalse(matcher.matches("youtube.com.evil.net"))
+        self.assertFalse(matcher.matches("notyoutube.com"))
+
+    def test_rules_are_normalised(self):
+        matcher = marthaba.DomainMatcher(["https://Reddit.com/r/all", " *.Twitch.TV ", "", "*."])
+        self.assertEqual(matcher.exact, {"reddit.com"})
+        self.assertEqual(matcher.wildcard, {"twitch.tv"})
+        self.assertIn("www.twitch.tv", matcher)
+        self.assertNotIn("", matcher)
+
+    def test_empty_matcher(self):
+        matcher = marthaba.DomainMatcher()
+        self.assertFalse(matcher.matches("example.com"))
+        matcher.add("example.com")
+        self.assertTrue(matcher.matches("example.com"))
+
+    def test_enforcer_reuses_a_compiled_allowlist(self):
+        enforcer = marthaba.HostsEnforcer(os.devnull)
+        first = enforcer.allowed_matcher(["a.com"])
+        self.assertIs(enforcer.allowed_matcher(["a.com"]), first)
+        self.assertIsNot(enforcer.allowed_matcher(["b.com"]), first)
+        self.assertIs(enforcer.allowed_matcher(first), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+"""Metrics: no-op when off, Prometheus text, snapshots and rotation."""
+import io
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        self.metrics = marthaba.Metrics()
+
+    def enable(self, **kwargs):
+        self.metrics.enable(self.directory, 'test', interval=3600, **kwargs)
+        self.addCleanup(setattr, self.metrics, 'enabled', False)
+
+    def test_disabled_records_nothing(self):
+        self.metrics.inc('a_total')
+        self.metrics.set('b', 1)
+        self.metrics.observe('c_seconds', 0.1)
+        self.metrics.record_cycle('apply', marthaba.CycleStats(), 0.1)
+        self.assertEqual(self.metrics.render(), "")
+        self.metrics.flush()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_render(self):
+        self.enable()
+        self.metrics.inc('marthaba_enforcement_errors_total')
+        self.metrics.inc('marthaba_enforcement_errors_total', 2)
+        self.metrics.set('marthaba_hosts_file_bytes', 512)
+        self.metrics.observe('marthaba_ui_task_seconds', 0.003, task='timer')
+        self.metrics.observe('marthaba_ui_task_seconds', 0.02, task='timer')
+        self.metrics.observe('marthaba_ui_task_seconds', 30, task='timer')
+        lines = self.metrics.render().splitlines()
+        self.assertIn("# TYPE marthaba_enforcement_errors_total counter", lines)
+        self.assertIn("marthaba_enforcement_errors_total 3", lines)
+        self.assertIn("# HELP marthaba_hosts_file_bytes Size of the hosts file after the last cycle", lines)
+        self.assertIn("marthaba_hosts_file_bytes 512", lines)
+        self.assertIn("# TYPE marthaba_ui_task_seconds histogram", lines)
+        self.assertIn('marthaba_ui_task_seconds_bucket{task="timer",le="0.001"} 0', lines)
+        self.assertIn('marthaba_ui_task_seconds_bucket{task="timer",le="0.005"} 1', lines)
+        self.assertIn('marthaba_ui_task_seconds_bucket{task="timer",le="0.025"} 2', lines)
+        self.assertIn('marthaba_ui_task_seconds_bucket{task="timer",le="+Inf"} 3', lines)
+        self.assertIn('marthaba_ui_task_seconds_sum{task="timer"} 30.023000', lines)
+        self.assertIn('marthaba_ui_task_seconds_count{task="timer"} 3', lines)
+
+    def test_label_values_are_escaped(self):
+        self.enable()
+        self.metrics.inc('x_total', path='a"b\\c')
+        self.assertIn('x_total{path="a\\"b\\\\c"} 1', self.metrics.render())
+
+    def test_record_cycle(self):
+        self.enable()
+        stats = marthaba.CycleStats.from_dict({'changed': True, 'bytes_read': 100, 'bytes_written': 120,
+                                               'syscalls': 5, 'subprocesses': 1})
+        self.metrics.record_cycle('apply', stats, 0.004)
+        text = self.metrics.render()
+        self.assertIn('marthaba_enforcement_cycles_total{changed="true",op="apply"} 1', text)
+        self.assertIn("marthaba_enforcement_syscalls_total 5", text)
+        self.assertIn("marthaba_hosts_file_bytes 120", text)
+
+    def test_flush_appends_snapshots_only_after_changes(self):
+        self.enable()
+        path = os.path.join(self.directory, "test.prom")
+        self.metrics.inc('a_total')
+        self.metrics.flush()
+        self.metrics.flush()
+        self.metrics.inc('a_total')
+        self.metrics.flush()
+        with open(path) as f:
+            content = f.read()
+        self.assertEqual(content.count(marthaba.Metrics.SNAPSHOT), 2)
+        latest = marthaba.latest_metrics(path)
+        self.assertTrue(latest.startswith(marthaba.Metrics.SNAPSHOT + " test "))
+        self.assertIn("a_total 2", latest)
+        self.assertNotIn("a_total 1", latest)
+
+    def test_rotation(self):
+        self.enable(max_bytes=600)
+        path = os.path.join(self.directory, "test.prom")
+        for _ in range(10):
+            self.metrics.inc('a_total')
+            self.metrics.flush()
+        self.assertTrue(os.path.exists(path + ".1"))
+        self.assertLessEqual(os.path.getsize(path), 600)
+        self.assertIn("a_total 10", marthaba.latest_metrics(path))
+
+    def test_show_metrics(self):
+        self.assertIsNone(marthaba.latest_metrics(os.path.join(self.directory, "none.prom")))
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(marthaba.show_metrics(self.directory), 1)
+        self.enable()
+        self.metrics.inc('a_total')
+        self.metrics.flush()
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(marthaba.show_metrics(self.directory), 0)
+        self.assertIn("a_total 1", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+"""FilterProxy CONNECT tunnels against a local echo server, and plain HTTP path rules."""
+import http.client
+import http.server
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+
+def client_hello(server_name=None):
+    """A minimal TLS 1.2 ClientHello record"""
+    extensions = b""
+    if server_name is not None:
+        name = server_name.encode()
+        entry = b"\x00" + struct.pack("!H", len(name)) + name
+        extensions = struct.pack("!HHH", 0, len(entry) + 2, len(entry)) + entry
+    body = (b"\x03\x03" + bytes(32) + b"\x00" + struct.pack("!H", 2) + b"\x13\x01" + b"\x01\x00"
+            + struct.pack("!H", len(extensions)) + extensions)
+    handshake = b"\x01" + len(body).to_bytes(3, 'big') + body
+    return b"\x16\x03\x01" + struct.pack("!H", len(handshake)) + handshake
+
+
+class EchoHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                break
+            self.request.sendall(data)
+
+
+class TunnelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.echo = socketserver.ThreadingTCPServer(("127.0.0.1", 0), EchoHandler)
+        self.echo.daemon_threads = True
+        threading.Thread(target=self.echo.serve_forever, daemon=True).start()
+        self.addCleanup(self.echo.server_close)
+        self.addCleanup(self.echo.shutdown)
+        self.proxy = marthaba.FilterProxy(("127.0.0.1", 0))
+        self.proxy.TLS_PEEK_TIMEOUT = 0.5
+        self.proxy.start_in_thread()
+        self.addCleanup(self.proxy.stop)
+        self.proxy.configure(True, ["blocked.example"])
+
+    def tunnel(self, payload, close=False):
+        """Bytes echoed back through a CONNECT to the echo server; b'' if the proxy closed it"""
+        sock = socket.create_connection(self.proxy.listen, timeout=5)
+        with sock:
+            target = "127.0.0.1:%d" % self.echo.server_address[1]
+            sock.sendall(f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n".encode())
+            reader = sock.makefile('rb')
+            self.assertIn(b" 200 ", reader.readline())
+            while reader.readline() not in (b"\r\n", b""):
+                pass
+            sock.sendall(payload)
+            if close:
+                sock.shutdown(socket.SHUT_WR)
+            return reader.read(len(payload)) or b""
+
+    def test_blocked_server_name_closes_the_tunnel(self):
+        self.assertEqual(self.tunnel(client_hello("blocked.example")), b"")
+        self.assertEqual(self.proxy.stats['blocked'], 1)
+
+    def test_other_server_name_passes(self):
+        hello = client_hello("fine.example")
+        self.assertEqual(self.tunnel(hello), hello)
+
+    def test_hello_in_pieces_is_read_whole(self):
+        sock = socket.create_connection(self.proxy.listen, timeout=5)
+        with sock:
+            target = "127.0.0.1:%d" % self.echo.server_address[1]
+            sock.sendall(f"CONNECT {target} HTTP/1.1\r\n\r\n".encode())
+            reader = sock.makefile('rb')
+            reader.readline()
+            reader.readline()
+            hello = client_hello("blocked.example")
+            for start in range(0, len(hello), 7):
+                sock.sendall(hello[start:start + 7])
+            self.assertEqual(reader.read(len(hello)), b"")
+
+    def test_truncated_hello_is_blocked(self):
+        self.assertEqual(self.tunnel(client_hello("fine.example")[:20], close=True), b"")
+        self.assertEqual(self.tunnel(b"\x16\x03", close=True), b"")
+
+    def test_hello_without_name_to_an_address_is_blocked(self):
+        self.assertEqual(self.tunnel(client_hello()), b"")
+
+    def test_non_tls_traffic_passes(self):
+        self.assertEqual(self.tunnel(b"SSH-2.0-test\r\n"), b"SSH-2.0-test\r\n")
+
+    def test_nothing_checked_when_inactive(self):
+        self.proxy.configure(False)
+        hello = client_hello()
+        self.assertEqual(self.tunnel(hello), hello)
+
+
+class ServerNameTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(marthaba.tls_server_name(client_hello("Www.Example.com")), "www.example.com")
+        self.assertIsNone(marthaba.tls_server_name(client_hello()))
+
+    def test_garbage(self):
+        for data in (b"", b"\x16", b"\x16\x03\x01\x00\x05\x01", client_hello("a.com")[:30], b"GET / HTTP/1.1"):
+            self.assertIsNone(marthaba.tls_server_name(data))
+
+
+class PathRulesTest(unittest.TestCase):
+
+    def test_prefix_on_exact_host(self):
+        rules = marthaba.PathRules(["www.YouTube.com/shorts/", "example.com/a/b", "nopath.com/", "plain.com"])
+        self.assertEqual(rules.prefixes, {"www.youtube.com": ["/shorts"], "example.com": ["/a/b"]})
+        self.assertTrue(rules.blocks("www.youtube.com", "/shorts"))
+        self.assertTrue(rules.blocks("www.youtube.com", "/Shorts/abc?feature=share"))
+        self.assertTrue(rules.blocks("www.youtube.com", "/shorts/#top"))
+        self.assertFalse(rules.blocks("www.youtube.com", "/shortsville"))
+        self.assertFalse(rules.blocks("www.youtube.com", "/watch?v=shorts"))
+        self.assertFalse(rules.blocks("m.youtube.com", "/shorts"))
+        self.assertFalse(rules.blocks("nopath.com", "/"))
+
+
+class PageHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpForwardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.site = http.server.ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+        self.site.daemon_threads = True
+        threading.Thread(target=self.site.serve_forever, daemon=True).start()
+        self.addCleanup(self.site.server_close)
+        self.addCleanup(self.site.shutdown)
+        self.proxy = marthaba.FilterProxy(("127.0.0.1", 0))
+        self.proxy.start_in_thread()
+        self.addCleanup(self.proxy.stop)
+        self.proxy.configure(True, ["blocked.example"], paths=["127.0.0.1/shorts"])
+        self.base = "http://127.0.0.1:%d" % self.site.server_address[1]
+        self.connection = http.client.HTTPConnection(*self.proxy.listen, timeout=5)
+        self.addCleanup(self.connection.close)
+
+    def request(self, method, path, body=None):
+        self.connection.request(method, self.base + path, body=body)
+        response = self.connection.getresponse()
+        return response.status, response.read()
+
+    def test_allowed_path_is_forwarded(self):
+        self.assertEqual(self.request("GET", "/watch?v=1"), (200, b"/watch?v=1"))
+
+    def test_blocked_path_gets_the_block_page(self):
+        status, body = self.request("GET", "/shorts/abc")
+        self.assertEqual(status, 403)
+        self.assertIn(b"127.0.0.1/shorts/abc", body)
+        self.assertEqual(self.proxy.stats['blocked'], 1)
+
+    def test_one_client_connection_carries_many_requests(self):
+        self.assertEqual(self.request("GET", "/a"), (200, b"/a"))
+        self.assertEqual(self.request("POST", "/shorts/x", body=b"payload")[0], 403)
+        self.assertEqual(self.request("POST", "/echo", body=b"payload"), (200, b"payload"))
+        self.assertEqual(self.request("GET", "/b"), (200, b"/b"))
+        self.assertEqual(self.proxy.stats['requests'], 4)
+        self.assertEqual(self.proxy.stats['errors'], 0)
+
+    def test_inactive_proxy_forwards_everything(self):
+        self.proxy.configure(False)
+        self.assertEqual(self.request("GET", "/shorts/abc"), (200, b"/shorts/abc"))
+
+    def test_absolute_form_is_required(self):
+        self.connection.request("GET", "/relative")
+        self.assertEqual(self.connection.getresponse().status, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
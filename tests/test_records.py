@@ -0,0 +1,92 @@
+"""Compact history lines: SessionRecord encoding and shared SiteSnapshots."""
+import datetime
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+Record = marthaba.SessionRecord
+
+
+class SessionRecordTest(unittest.TestCase):
+
+    def test_only_set_fields_are_written(self):
+        record = Record(1700000000, 1700003600, sites="0123456789abcdef", session="aa")
+        self.assertEqual(record.to_json(),
+                         '{"start":1700000000,"end":1700003600,"sites":"0123456789abcdef","session":"aa"}')
+        end = Record(1700000000, 1700000600, 'end', planned=3600, completed=False, session="aa")
+        self.assertEqual(Record.from_json(end.to_json()).as_dict(), end.as_dict())
+        self.assertEqual(end.key, (1700000000, "aa"))
+        self.assertAlmostEqual(end.duration, 600 / 3600)
+
+    def test_older_lines_are_read(self):
+        record = Record.from_dict({'start_time': "2024-05-01T09:00:00", 'duration': 1.5,
+                                   'allowed_sites': ["x.com"], 'sites': ["b.com", "a.com"]})
+        start = datetime.datetime(2024, 5, 1, 9).timestamp()
+        self.assertEqual((record.start, record.end), (start, start + 5400))
+        self.assertEqual(record.sites, ("b.com", "a.com"))
+        self.assertIsNone(record.session)
+        record = Record.from_dict({'start_time': "2024-05-01T09:00:00", 'end_time': "2024-05-01T09:30:00"})
+        self.assertEqual(record.end - record.start, 1800)
+        self.assertEqual(Record.from_dict(record.as_dict()).as_dict(), record.as_dict())
+
+
+class SiteSnapshotsTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        self.path = os.path.join(self.directory, "history.jsonl.sites")
+
+    def lines(self):
+        with open(self.path) as f:
+            return f.read().splitlines()
+
+    def test_each_list_is_stored_once(self):
+        snapshots = marthaba.SiteSnapshots(self.path)
+        first = snapshots.put(["b.com", "a.com", "a.com"])
+        self.assertEqual(snapshots.put(["a.com", "b.com"]), first)
+        other = snapshots.put([])
+        self.assertNotEqual(other, first)
+        self.assertEqual(len(first), 16)
+        self.assertEqual(len(self.lines()), 2)
+        self.assertEqual(json.loads(self.lines()[0]), {'id': first, 'sites': ["a.com", "b.com"]})
+        self.assertIs(snapshots.get(first), snapshots.get(first))
+        self.assertEqual(snapshots.get(other), ())
+
+    def test_file_is_read_back(self):
+        first = marthaba.SiteSnapshots(self.path).put(["a.com"])
+        with open(self.path, 'a') as f:
+            f.write('{"id": "torn", "si')
+        snapshots = marthaba.SiteSnapshots(self.path)
+        self.assertEqual(snapshots.get(first), ("a.com",))
+        self.assertEqual(snapshots.get("unknown"), ())
+        self.assertEqual(snapshots.get(("inline.com",)), ("inline.com",))
+        self.assertEqual(snapshots.items(), [(first, ("a.com",))])
+
+    def test_sessions_share_one_snapshot(self):
+        service = marthaba.FocusService(marthaba.Paths.under(self.directory))
+        self.addCleanup(service.session.close)
+        self.addCleanup(service.config_store.flush)
+        service.config['allowed_sites'] = ["docs.python.org", "a.com"]
+        records = []
+        for _ in range(3):
+            records.append(service.start(60))
+            service.finish()
+        self.assertEqual(len({record.sites for record in records}), 1)
+        self.assertEqual(service.history_log.snapshots.get(records[0].sites), ("a.com", "docs.python.org"))
+        with open(service.history_log.snapshots.path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        with open(service.history_log.path) as f:
+            line = f.readline()
+        self.assertNotIn("docs.python.org", line)
+
+
+if __name__ == "__main__":
+    unittest.main()
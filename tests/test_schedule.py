@@ -0,0 +1,149 @@
+"""Recurring schedules: parsing, occurrences, the persisted queue and the wall-clock timer."""
+import datetime
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+MONDAY = datetime.date(2026, 3, 9)
+
+
+def at(day, hour, minute=0):
+    return datetime.datetime.combine(day, datetime.time(hour, minute)).timestamp()
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_days(self):
+        self.assertEqual(marthaba.parse_days("mon-fri"), [0, 1, 2, 3, 4])
+        self.assertEqual(marthaba.parse_days("Mon,Wed,friday"), [0, 2, 4])
+        self.assertEqual(marthaba.parse_days("fri-mon"), [0, 4, 5, 6])
+        self.assertEqual(marthaba.parse_days("weekends"), [5, 6])
+        self.assertEqual(marthaba.parse_days("daily"), list(range(7)))
+        with self.assertRaises(ValueError):
+            marthaba.parse_days("someday")
+
+    def test_clock(self):
+        self.assertEqual(marthaba.parse_clock(" 9:05"), datetime.time(9, 5))
+        for text in ("9", "25:00", "a:b"):
+            with self.assertRaises(ValueError):
+                marthaba.parse_clock(text)
+
+
+class FocusScheduleTest(unittest.TestCase):
+
+    def test_weekly(self):
+        schedule = marthaba.FocusSchedule("work", start="09:00", end="12:30", days=[0, 2])
+        self.assertEqual(schedule.occurrences(MONDAY), [(at(MONDAY, 9), at(MONDAY, 12, 30))])
+        self.assertEqual(schedule.occurrences(MONDAY + datetime.timedelta(days=1)), [])
+
+    def test_past_midnight(self):
+        schedule = marthaba.FocusSchedule("night", start="23:00", end="01:00")
+        tuesday = MONDAY + datetime.timedelta(days=1)
+        self.assertEqual(schedule.occurrences(MONDAY), [(at(MONDAY, 23), at(tuesday, 1))])
+
+    def test_pomodoro(self):
+        schedule = marthaba.FocusSchedule("pomo", kind='pomodoro', start="10:00", focus=25, pause=5, rounds=3)
+        self.assertEqual(schedule.occurrences(MONDAY), [(at(MONDAY, 10), at(MONDAY, 10, 25)),
+                                                        (at(MONDAY, 10, 30), at(MONDAY, 10, 55)),
+                                                        (at(MONDAY, 11), at(MONDAY, 11, 25))])
+
+    def test_round_trip_and_validation(self):
+        schedule = marthaba.FocusSchedule("work", start="9:00", end="17:00", days=[4, 0, 0])
+        self.assertEqual(schedule.as_dict(), {'name': "work", 'kind': 'weekly', 'start': "09:00",
+                                              'end': "17:00", 'days': [0, 4]})
+        self.assertEqual(marthaba.FocusSchedule.from_dict(schedule.as_dict()).as_dict(), schedule.as_dict())
+        for kwargs in ({'kind': 'monthly', 'end': "10:00"}, {}, {'end': "09:00"}, {'end': "10:00", 'days': []},
+                       {'kind': 'pomodoro', 'focus': 0}):
+            with self.assertRaises(ValueError):
+                marthaba.FocusSchedule("bad", **kwargs)
+
+
+class ScheduleQueueTest(unittest.TestCase):
+    SCHEDULES = [{'name': "morning", 'kind': 'weekly', 'start': "09:00", 'end': "10:00", 'days': [0, 1, 2, 3, 4]},
+                 {'name': "pomo", 'kind': 'pomodoro', 'start': "14:00", 'days': [0], 'focus': 25, 'pause': 5,
+                  'rounds': 2}]
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "schedule.json")
+
+    def queue(self, schedules=None):
+        return marthaba.ScheduleQueue(schedules or self.SCHEDULES, self.path)
+
+    def test_upcoming_in_order(self):
+        queue = self.queue()
+        upcoming = queue.upcoming(at(MONDAY, 8), limit=4)
+        self.assertEqual([(start, name) for start, _, name in upcoming],
+                         [(at(MONDAY, 9), "morning"), (at(MONDAY, 14), "pomo"),
+                          (at(MONDAY, 14, 30), "pomo"), (at(MONDAY + datetime.timedelta(days=1), 9), "morning")])
+        self.assertEqual(queue.next_start(at(MONDAY, 9, 30)), at(MONDAY, 14))
+
+    def test_take_due_starts_each_occurrence_once(self):
+        queue = self.queue()
+        self.assertIsNone(queue.take_due(at(MONDAY, 8)))
+        self.assertEqual(queue.take_due(at(MONDAY, 9, 5)), (at(MONDAY, 9), at(MONDAY, 10), "morning"))
+        self.assertIsNone(queue.take_due(at(MONDAY, 9, 6)))
+        # Missed while asleep: a finished occurrence is dropped, the running one is started
+        self.assertEqual(queue.take_due(at(MONDAY, 14, 40)), (at(MONDAY, 14, 30), at(MONDAY, 14, 55), "pomo"))
+
+    def test_state_survives_a_restart(self):
+        queue = self.queue()
+        queue.take_due(at(MONDAY, 9, 5))
+        queue.save()
+        restored = self.queue()
+        self.assertEqual(sorted(restored.heap), sorted(queue.heap))
+        self.assertEqual(restored.expanded_through, queue.expanded_through)
+        self.assertIsNone(restored.take_due(at(MONDAY, 9, 6)))
+        self.assertFalse(restored.dirty)
+
+    def test_changed_schedules_are_expanded_again(self):
+        queue = self.queue()
+        queue.take_due(at(MONDAY, 9, 5))
+        queue.save()
+        other = self.queue(self.SCHEDULES[:1])
+        self.assertEqual(other.heap, [])
+        self.assertEqual(other.handled, at(MONDAY, 9))
+
+    def test_sync_handled(self):
+        first, second = self.queue(), self.queue()
+        first.take_due(at(MONDAY, 9, 5))
+        first.save()
+        second.sync_handled()
+        self.assertIsNone(second.take_due(at(MONDAY, 9, 6)))
+
+
+class WallClockTimerTest(unittest.TestCase):
+
+    def timer(self, **kwargs):
+        timer = marthaba.WallClockTimer(**kwargs)
+        self.addCleanup(timer.close)
+        return timer
+
+    def test_due(self):
+        started = time.monotonic()
+        self.assertEqual(self.timer().wait_until(time.time() + 0.05), 'due')
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+
+    def test_polling_fallback(self):
+        timer = self.timer(max_sleep=0.01)
+        os.close(timer.fd)
+        timer.fd = None
+        self.assertEqual(timer.wait_until(time.time() + 0.05), 'due')
+
+    def test_wake(self):
+        timer = self.timer()
+        timer.wake()
+        self.assertEqual(timer.wait_until(time.time() + 60), 'woken')
+        timer.wake()
+        self.assertEqual(timer.wait_until(None), 'woken')
+
+
+if __name__ == "__main__":
+    unittest.main()
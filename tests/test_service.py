@@ -0,0 +1,56 @@
+"""FocusService shared by several processes on the same data directory."""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+
+class FinishTest(unittest.TestCase):
+    STORAGE = 'json'
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.paths = marthaba.Paths.under(tmp_dir.name, storage=self.STORAGE)
+
+    def service(self):
+        service = marthaba.FocusService(self.paths)
+        self.addCleanup(service.session.close)
+        # Write-behind saves must land before the directory goes
+        self.addCleanup(service.config_store.flush)
+        return service
+
+    def end_records(self, service):
+        return [record for record in service.history_log if record.event == 'end']
+
+    def test_window_and_daemon_log_one_end(self):
+        cli = self.service()
+        cli.start(60)
+        cli.config_store.flush()
+        # Both load the running session, then both reach its deadline
+        daemon, window = self.service(), self.service()
+        self.assertIsNotNone(daemon.finish())
+        self.assertIsNone(window.finish())
+        self.assertFalse(window.session.active)
+        self.assertEqual(len(self.end_records(window)), 1)
+        self.assertEqual(window.analytics.ended, 1)
+
+    def test_next_session_still_ends(self):
+        service = self.service()
+        service.start(60)
+        service.finish()
+        service.start(60)
+        self.assertIsNotNone(service.finish())
+        self.assertEqual(len(self.end_records(service)), 2)
+
+
+class SqliteFinishTest(FinishTest):
+    STORAGE = 'sqlite'
+
+
+if __name__ == "__main__":
+    unittest.main()
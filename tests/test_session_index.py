@@ -0,0 +1,171 @@
+"""SessionIndex over a SessionLog, including sessions that start in the same second."""
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+Record = marthaba.SessionRecord
+Index = marthaba.SessionIndex
+
+
+class SessionIndexTest(unittest.TestCase):
+    T = 1700000000
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "history.jsonl")
+        self.log = marthaba.SessionLog(self.path, legacy_path=None)
+
+    def index(self):
+        index = Index(self.log)
+        self.addCleanup(index.close)
+        return index
+
+    def summary(self, index):
+        return [(record.start, record.session, record.status, record.attempts)
+                for record in index.page(0, len(index))]
+
+    def test_events_find_their_session(self):
+        self.log.append(Record(self.T, self.T + 60, session="aa"))
+        self.log.append(Record(self.T + 100, self.T + 160, session="bb"))
+        self.log.append(Record(self.T, self.T + 30, event='end', completed=False, session="aa"))
+        self.log.append(Record(self.T + 100, self.T + 130, event='attempts', domains={"x.com": 2},
+                               session="bb"))
+        self.assertEqual(self.summary(self.index()), [(self.T, "aa", Index.ENDED, 0),
+                                                      (self.T + 100, "bb", Index.UNKNOWN, 2)])
+
+    def test_same_second_sessions_stay_apart(self):
+        self.log.append(Record(self.T, self.T + 60, session="aa"))
+        self.log.append(Record(self.T, self.T + 60, session="bb"))
+        self.log.append(Record(self.T, self.T + 1, event='end', completed=False, session="aa"))
+        self.log.append(Record(self.T, self.T + 60, event='attempts', domains={"x.com": 3}, session="bb"))
+        self.log.append(Record(self.T, self.T + 60, event='end', completed=True, session="bb"))
+        self.assertEqual(self.summary(self.index()), [(self.T, "aa", Index.ENDED, 0),
+                                                      (self.T, "bb", Index.COMPLETED, 3)])
+
+    def test_events_after_a_refresh_update_written_entries(self):
+        self.log.append(Record(self.T, self.T + 60, session="aa"))
+        self.log.append(Record(self.T, self.T + 60, session="bb"))
+        index = self.index()
+        self.log.append(Record(self.T, self.T + 60, event='end', completed=True, session="bb"))
+        self.log.append(Record(self.T, self.T + 60, event='attempts', domains={"x.com": 1}, session="aa"))
+        self.assertTrue(index.refresh())
+        self.assertEqual(self.summary(index), [(self.T, "aa", Index.UNKNOWN, 1),
+                                               (self.T, "bb", Index.COMPLETED, 0)])
+        # A fresh index reads the saved entries back
+        self.assertEqual(self.summary(self.index()), self.summary(index))
+
+    def test_records_without_ids_match_by_start(self):
+        self.log.append(Record(self.T, self.T + 60))
+        self.log.append(Record(self.T, self.T + 60, event='end', completed=True))
+        self.log.append(Record(self.T + 100, self.T + 160, session="cc"))
+        self.log.append(Record(self.T + 100, self.T + 160, event='end', completed=False))
+        self.assertEqual(self.summary(self.index()), [(self.T, None, Index.COMPLETED, 0),
+                                                      (self.T + 100, "cc", Index.UNKNOWN, 0)])
+
+    def test_index_of_an_older_format_is_rebuilt(self):
+        self.log.append(Record(self.T, self.T + 60, session="aa"))
+        self.index().close()
+        with open(self.path + ".idx.json", 'w') as f:
+            json.dump({'files': [], 'count': 5}, f)
+        self.assertEqual(self.summary(self.index()), [(self.T, "aa", Index.UNKNOWN, 0)])
+
+    def test_session_key_of_odd_ids(self):
+        self.assertEqual(Index.session_key(Record(0, 0)), 0)
+        self.assertEqual(Index.session_key(Record(0, 0, session="not hex")), 0)
+        self.assertEqual(Index.session_key(Record(0, 0, session="ff")), 255)
+
+
+class PagingTest(unittest.TestCase):
+    T = int(time.time()) - 30 * 86400
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "history.jsonl")
+        self.log = marthaba.SessionLog(self.path, max_bytes=1000, legacy_path=None)
+        for i in range(100):
+            self.append(i)
+
+    def append(self, i):
+        self.log.append(Record(self.T + i * 3600, self.T + i * 3600 + 1800, session="%04x" % i))
+
+    def index(self):
+        index = Index(self.log)
+        self.addCleanup(index.close)
+        return index
+
+    def test_pages_across_rotated_files(self):
+        self.assertGreater(len(self.log.archives()), 3)
+        index = self.index()
+        self.assertEqual(len(index), 100)
+        self.assertEqual([record.session for record in index.page(40, 45)], ["%04x" % i for i in range(40, 45)])
+        self.assertEqual(index.record(99).start, self.T + 99 * 3600)
+        self.assertEqual(index.page(100, 100), [])
+
+    def test_date_range(self):
+        index = self.index()
+        self.assertEqual(index.bisect(self.T + 10 * 3600), 10)
+        self.assertEqual(index.bisect(self.T + 10 * 3600 + 1), 11)
+        self.assertEqual(index.between(self.T + 5 * 3600, self.T + 8 * 3600), (5, 8))
+        self.assertEqual(index.between(None, self.T), (0, 0))
+        self.assertEqual(index.between(self.T + 50 * 3600), (50, 100))
+        self.assertEqual(index.between(self.T + 8 * 3600, self.T), (8, 8))
+
+    def test_refresh_reads_only_new_lines(self):
+        index = self.index()
+        self.assertFalse(index.refresh())
+        self.append(100)
+        line = Record(self.T + 101 * 3600, self.T + 101 * 3600 + 60, session="0065").to_json() + "\n"
+        with open(self.path, 'a') as f:
+            f.write(line[:10])
+        self.assertTrue(index.refresh())
+        self.assertEqual(len(index), 101)
+        with open(self.path, 'a') as f:
+            f.write(line[10:])
+        self.assertTrue(index.refresh())
+        self.assertEqual(len(index), 102)
+        self.assertEqual(index.record(101).session, "0065")
+
+    def test_rewritten_log_is_indexed_again(self):
+        index = self.index()
+        os.truncate(self.path, 0)
+        self.append(200)
+        index.refresh()
+        self.assertEqual(index.record(len(index) - 1).session, "%04x" % 200)
+        self.assertEqual(len(self.index()), len(index))
+
+
+class SameSecondServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.service = marthaba.FocusService(marthaba.Paths.under(tmp_dir.name))
+        self.addCleanup(self.service.session.close)
+        self.addCleanup(self.service.config_store.flush)
+        patcher = mock.patch.object(marthaba.time, 'time', lambda: 1700000000.5)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_both_sessions_get_their_end(self):
+        first = self.service.start(60)
+        self.service.finish()
+        second = self.service.start(60)
+        self.assertNotEqual(first.session, second.session)
+        self.assertIsNotNone(self.service.finish())
+        pairs = list(marthaba.iter_sessions(iter(self.service.history_log)))
+        self.assertEqual([(session.session, end.session) for session, end in pairs],
+                         [(first.session, first.session), (second.session, second.session)])
+
+
+if __name__ == "__main__":
+    unittest.main()
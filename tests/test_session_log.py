@@ -0,0 +1,97 @@
+"""SessionLog: appends, rotation, reverse reads and the legacy JSON import."""
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+Record = marthaba.SessionRecord
+
+
+class SessionLogTest(unittest.TestCase):
+    T = int(time.time()) - 3600
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        self.path = os.path.join(self.directory, "history.jsonl")
+
+    def log(self, **kwargs):
+        return marthaba.SessionLog(self.path, legacy_path=None, **kwargs)
+
+    def fill(self, log, count):
+        for i in range(count):
+            log.append(Record(self.T + i * 60, self.T + i * 60 + 30, session="%04x" % i))
+
+    def test_append_is_one_line_per_record(self):
+        log = self.log()
+        self.fill(log, 3)
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0]), {'start': self.T, 'end': self.T + 30, 'session': "0000"})
+        self.assertEqual([record.start for record in log], [self.T, self.T + 60, self.T + 120])
+
+    def test_rotates_by_size(self):
+        log = self.log(max_bytes=200)
+        self.fill(log, 10)
+        self.assertGreater(len(log.archives()), 1)
+        self.assertEqual([seq for seq, _ in log.archives()], list(range(1, len(log.archives()) + 1)))
+        self.assertEqual([record.session for record in log], ["%04x" % i for i in range(10)])
+        self.assertEqual(log.size(), sum(os.path.getsize(path) for path in log.files()))
+
+    def test_rotates_by_age(self):
+        log = self.log(max_age_days=1)
+        self.fill(log, 2)
+        with mock.patch.object(marthaba.time, 'time', lambda: self.T + 2 * 86400):
+            log.append(Record(self.T + 2 * 86400, self.T + 2 * 86400 + 30))
+        self.assertEqual(len(log.archives()), 1)
+        self.assertEqual(len(list(log)), 3)
+
+    def test_tail_reads_across_files(self):
+        log = self.log(max_bytes=150)
+        log.BLOCK_SIZE = 16
+        self.fill(log, 20)
+        self.assertEqual([record.session for record in log.tail(5)], ["%04x" % i for i in range(15, 20)])
+        odd = log.tail(3, lambda record: int(record.session, 16) % 2)
+        self.assertEqual([record.session for record in odd], ["000f", "0011", "0013"])
+        self.assertEqual(len(log.tail(100)), 20)
+
+    def test_torn_last_line_is_skipped(self):
+        log = self.log()
+        self.fill(log, 2)
+        with open(self.path, 'a') as f:
+            f.write('{"start": 17')
+        self.assertEqual(len(log.tail(5)), 2)
+        self.assertEqual(len(list(log)), 2)
+
+    def test_empty_log(self):
+        log = self.log()
+        self.assertEqual(log.tail(5), [])
+        self.assertEqual(list(log), [])
+        self.assertEqual(log.files(), [])
+
+    def test_legacy_history_is_imported_once(self):
+        legacy = os.path.join(self.directory, "history.json")
+        with open(legacy, 'w') as f:
+            json.dump([{'start_time': "2024-01-01T10:00:00", 'end_time': "2024-01-01T11:00:00",
+                        'allowed_sites': ["a.com"], 'sites': ["a.com"]},
+                       {'start_time': "2024-01-02T10:00:00", 'duration': 0.5}], f)
+        log = marthaba.SessionLog(self.path, legacy_path=legacy)
+        records = list(log)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[1].end - records[1].start, 1800)
+        self.assertEqual(log.snapshots.get(records[0].sites), ("a.com",))
+        self.assertFalse(os.path.exists(legacy))
+        self.assertTrue(os.path.exists(legacy + ".migrated"))
+
+
+if __name__ == "__main__":
+    unittest.main()
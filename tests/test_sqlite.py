@@ -0,0 +1,184 @@
+"""The 'sqlite' storage: Database, SqliteConfigStore and SqliteSessionLog."""
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+
+class SqliteConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "marthaba.db")
+        self.database = marthaba.Database(self.path)
+        self.addCleanup(self.database.close)
+        self.database.migrate()
+
+    def store(self):
+        store = marthaba.SqliteConfigStore(self.database, delay=0)
+        self.addCleanup(store.flush)
+        return store
+
+    def test_empty_table_gives_defaults(self):
+        # The database file is not JSON; it must not be parsed as a config file
+        with mock.patch.object(marthaba.ConfigStore, 'load', side_effect=AssertionError):
+            store = self.store()
+        self.assertEqual(store.data, marthaba.ConfigStore.DEFAULTS)
+        store.data['allowed_sites'].append("a.com")
+        self.assertEqual(marthaba.ConfigStore.DEFAULTS['allowed_sites'], [])
+
+    def test_round_trip(self):
+        store = self.store()
+        store.data['allowed_sites'] = ["docs.python.org"]
+        store.data['active'] = True
+        store.save()
+        store.flush()
+        self.assertEqual(self.store().data, {'active': True, 'allowed_sites': ["docs.python.org"],
+                                             'notifications': True})
+
+    def test_write_is_seen_by_another_store(self):
+        store, other = self.store(), self.store()
+        store.data['notifications'] = False
+        store.save()
+        store.flush()
+        self.assertTrue(other.changed_on_disk())
+        other.reload()
+        self.assertFalse(other.data['notifications'])
+
+
+class SqliteHistoryTest(unittest.TestCase):
+    T = 1700000000
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "marthaba.db")
+
+    def open(self):
+        database = marthaba.Database(self.path)
+        self.addCleanup(database.close)
+        return database
+
+    def summary(self, log):
+        log.refresh()
+        return [(record.session, record.status, record.attempts) for record in log.page(0, len(log))]
+
+    def test_same_second_sessions_stay_apart(self):
+        database = self.open()
+        database.migrate()
+        log = marthaba.SqliteSessionLog(database)
+        Record = marthaba.SessionRecord
+        log.append(Record(self.T, self.T + 60, session="aa"))
+        log.append(Record(self.T, self.T + 60, session="bb"))
+        log.append(Record(self.T, self.T + 5, event='end', completed=False, session="aa"))
+        log.append(Record(self.T, self.T + 60, event='attempts', domains={"x.com": 4}, session="bb"))
+        log.append(Record(self.T, self.T + 60, event='end', completed=True, session="bb"))
+        Index = marthaba.SessionIndex
+        self.assertEqual(self.summary(log), [("aa", Index.ENDED, 0), ("bb", Index.COMPLETED, 4)])
+
+    def test_older_schema_gains_the_session_column(self):
+        database = self.open()
+        database.connection.execute(
+            "CREATE TABLE history (id INTEGER PRIMARY KEY, start_time REAL NOT NULL, event TEXT, "
+            "status INTEGER NOT NULL DEFAULT 0, record TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)")
+        record = marthaba.SessionRecord(self.T, self.T + 60)
+        database.connection.execute("INSERT INTO history (start_time, record) VALUES (?, ?)",
+                                    (self.T, record.to_json()))
+        database.connection.execute("PRAGMA user_version = 3")
+        database.connection.commit()
+        self.assertTrue(database.migrate())
+        self.assertEqual(database.version, marthaba.Database.VERSION)
+        log = marthaba.SqliteSessionLog(database)
+        # Events of sessions logged before ids existed still find them
+        log.append(marthaba.SessionRecord(self.T, self.T + 60, event='end', completed=True))
+        self.assertEqual(self.summary(log), [(None, marthaba.SessionIndex.COMPLETED, 0)])
+
+
+class MigrationTest(unittest.TestCase):
+    T = 1700000000
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        self.paths = marthaba.Paths.under(self.directory)
+        with open(self.paths.config, 'w') as f:
+            json.dump({'active': False, 'allowed_sites': ["docs.python.org"], 'theme': 'blue_dark'}, f)
+        log = marthaba.SessionLog(self.paths.history, max_bytes=400, legacy_path=None)
+        sites = log.snapshots.put(["docs.python.org"])
+        for i in range(10):
+            start = self.T + i * 3600
+            log.append(marthaba.SessionRecord(start, start + 1800, sites=sites, session="%04x" % i))
+            log.append(marthaba.SessionRecord(start, start + 1800, event='end', completed=i % 2 == 0,
+                                              session="%04x" % i))
+        # A line from before site snapshots, with its list inline
+        log.append(marthaba.SessionRecord(self.T + 50000, self.T + 50060, sites=("a.com",)))
+        self.files = log.files() + [log.snapshots.path]
+
+    def service(self):
+        service = marthaba.FocusService(marthaba.Paths.under(self.directory, storage='sqlite'))
+        self.addCleanup(service.session.close)
+        self.addCleanup(service.config_store.flush)
+        self.addCleanup(service.history_log.database.close)
+        return service
+
+    def test_json_data_is_carried_over(self):
+        with mock.patch('builtins.print'):
+            service = self.service()
+        self.assertEqual(service.config['allowed_sites'], ["docs.python.org"])
+        self.assertEqual(service.config['theme'], 'blue_dark')
+        log = service.history_log
+        self.assertEqual(len(log), 11)
+        self.assertEqual(len(list(log)), 21)
+        Index = marthaba.SessionIndex
+        self.assertEqual([record.status for record in log.page(0, 3)],
+                         [Index.COMPLETED, Index.ENDED, Index.COMPLETED])
+        self.assertEqual(log.snapshots.get(log.record(0).sites), ("docs.python.org",))
+        self.assertEqual(log.snapshots.get(log.record(10).sites), ("a.com",))
+        for path in self.files + [self.paths.config]:
+            self.assertFalse(os.path.exists(path), path)
+            self.assertTrue(os.path.exists(path + ".migrated"), path)
+
+    def test_migration_runs_once(self):
+        with mock.patch('builtins.print'):
+            self.service()
+        database = marthaba.Database(self.paths.database)
+        self.addCleanup(database.close)
+        self.assertEqual(database.version, marthaba.Database.VERSION)
+        self.assertFalse(database.migrate())
+        self.assertEqual(len(self.service().history_log), 11)
+
+    def test_failed_migration_leaves_the_json_files(self):
+        database = marthaba.Database(self.paths.database)
+        self.addCleanup(database.close)
+        log = marthaba.SessionLog(self.paths.history, legacy_path=None)
+        with mock.patch.object(database, '_insert_history', side_effect=ValueError("bad record")):
+            with self.assertRaises(ValueError):
+                database.migrate(self.paths.config, log)
+        self.assertEqual(database.version, 0)
+        for path in self.files + [self.paths.config]:
+            self.assertTrue(os.path.exists(path), path)
+
+    def test_date_range_and_tail(self):
+        with mock.patch('builtins.print'):
+            log = self.service().history_log
+        self.assertEqual(log.between(self.T + 3600, self.T + 4 * 3600), (1, 4))
+        self.assertEqual(log.bisect(self.T + 99999), 11)
+        self.assertEqual([record.session for record in log.page(8, 11)], ["0008", "0009", None])
+        tail = log.tail(2, lambda record: record.event == 'end')
+        self.assertEqual([record.session for record in tail], ["0008", "0009"])
+        self.assertFalse(log.refresh())
+        log.append(marthaba.SessionRecord(self.T + 60000, self.T + 60060, session="ff"))
+        self.assertTrue(log.refresh())
+        self.assertEqual(len(log), 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""GUI startup: deferred imports, tabs built on first view and the startup profile."""
+import io
+import os
+import subprocess
+import sys
+import types
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import marthaba  # noqa: E402
+
+
+class DeferredImportTest(unittest.TestCase):
+
+    def test_import_leaves_heavy_modules_alone(self):
+        deferred = ('tkinter', 'asyncio', 'sqlite3', 'hashlib', 'subprocess', 'PIL')
+        code = ("import sys, marthaba; print(' '.join(m for m in %r if m in sys.modules))" % (deferred,))
+        result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "")
+
+    def test_import_breakdown_lists_the_module_first(self):
+        rows = marthaba.import_breakdown(limit=3)
+        self.assertEqual(rows[0][0], "marthaba")
+        self.assertLessEqual(len(rows), 4)
+        self.assertTrue(all(seconds >= 0 for _, seconds in rows))
+
+
+class LazyTabTest(unittest.TestCase):
+
+    def app(self, selected):
+        built = []
+        app = types.SimpleNamespace(
+            notebook=mock.Mock(),
+            register_theme_roles=mock.Mock(),
+            tab_builders={".history": lambda: built.append("history"),
+                          ".settings": lambda: built.append("settings")})
+        app.notebook.select.return_value = selected
+        app.notebook.nametowidget.side_effect = lambda name: "widget" + name
+        return app, built
+
+    def test_tab_is_built_once_on_first_view(self):
+        app, built = self.app(".history")
+        marthaba.AnimatedMarThaba.on_tab_changed(app)
+        marthaba.AnimatedMarThaba.on_tab_changed(app)
+        self.assertEqual(built, ["history"])
+        self.assertEqual(list(app.tab_builders), [".settings"])
+        app.register_theme_roles.assert_called_once_with("widget.history")
+
+    def test_built_tabs_are_left_alone(self):
+        app, built = self.app(".focus")
+        marthaba.AnimatedMarThaba.on_tab_changed(app)
+        self.assertEqual(built, [])
+        app.register_theme_roles.assert_not_called()
+
+
+class StartupProfileTest(unittest.TestCase):
+
+    def test_report_lists_phases_and_verdict(self):
+        profile = marthaba.StartupProfile()
+        profile.mark('config')
+        profile.mark('first paint')
+        out = io.StringIO()
+        profile.report([("marthaba", 0.012)], out=out)
+        text = out.getvalue()
+        self.assertIn("marthaba", text)
+        self.assertIn("config", text)
+        self.assertIn("first paint total", text)
+        self.assertIn("ok", text)
+        self.assertEqual([name for name, _ in profile.phases], ['config', 'first paint'])
+
+
+if __name__ == "__main__":
+    unittest.main()
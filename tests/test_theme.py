@@ -0,0 +1,103 @@
+"""Theme switching: color roles are recorded per widget and rewritten in place."""
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+
+class FakeWidget:
+    """Just the option API register_theme_roles() and change_theme() use"""
+
+    def __init__(self, parent=None, **options):
+        self.options = dict(options)
+        self.children = []
+        self.destroyed = False
+        if parent is not None:
+            parent.children.append(self)
+
+    def keys(self):
+        return list(self.options) + ['text', 'font']
+
+    def cget(self, option):
+        return self.options.get(option, "")
+
+    def config(self, **options):
+        if self.destroyed:
+            raise marthaba.tk.TclError("invalid command name")
+        self.options.update(options)
+
+    def winfo_children(self):
+        return list(self.children)
+
+
+class ThemeRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        marthaba.load_tk()
+        self.app = object.__new__(marthaba.AnimatedMarThaba)
+        self.app.config = {'theme': 'enhanced_dark'}
+        self.app.setup_styles()
+        for name in ('save_config', 'configure_notebook_style', 'set_ui_state', 'update_check_display'):
+            setattr(self.app, name, mock.Mock())
+        self.app.ui_state = 'idle'
+        self.app.session = mock.Mock(emergency_used=False)
+        colors = self.app.colors
+        self.root = FakeWidget(background=colors['bg'])
+        self.card = FakeWidget(self.root, background=colors['card_bg'], highlightbackground=colors['border'])
+        self.label = FakeWidget(self.card, background=colors['card_bg'], foreground=colors['text_light'])
+        self.custom = FakeWidget(self.card, background="#123456")
+
+    def test_roles_are_recorded_once(self):
+        self.app.register_theme_roles(self.root)
+        registry = self.app.theme_registry
+        self.assertEqual(registry[self.card], {'background': 'card_bg', 'highlightbackground': 'border'})
+        self.assertEqual(registry[self.label], {'background': 'card_bg', 'foreground': 'text_light'})
+        self.assertEqual(registry[self.custom], {})
+        self.label.options['foreground'] = self.app.colors['accent']
+        self.app.register_theme_roles(self.root)
+        self.assertEqual(registry[self.label]['foreground'], 'text_light')
+
+    def test_change_theme_recolors_in_place(self):
+        self.app.register_theme_roles(self.root)
+        self.app.change_theme('light_theme')
+        light = self.app.themes['light_theme']
+        self.assertIs(self.app.colors, light)
+        self.assertEqual(self.app.config['theme'], 'light_theme')
+        self.app.save_config.assert_called_once_with()
+        self.assertEqual(self.root.cget('background'), light['bg'])
+        self.assertEqual(self.card.cget('highlightbackground'), light['border'])
+        self.assertEqual(self.label.cget('foreground'), light['text_light'])
+        self.assertEqual(self.custom.cget('background'), "#123456")
+        self.app.set_ui_state.assert_called_once_with('idle')
+        # Back again: roles, not colors, were recorded
+        self.app.change_theme('enhanced_dark')
+        self.assertEqual(self.label.cget('foreground'), self.app.themes['enhanced_dark']['text_light'])
+
+    def test_same_or_unknown_theme_does_nothing(self):
+        self.app.change_theme('enhanced_dark')
+        self.app.change_theme('no_such_theme')
+        self.app.save_config.assert_not_called()
+
+    def test_destroyed_widgets_are_forgotten(self):
+        self.app.register_theme_roles(self.root)
+        self.label.destroyed = True
+        self.app.change_theme('blue_dark')
+        self.assertNotIn(self.label, self.app.theme_registry)
+        self.assertEqual(self.card.cget('background'), self.app.themes['blue_dark']['card_bg'])
+
+    def test_saved_theme_is_used_at_startup(self):
+        app = object.__new__(marthaba.AnimatedMarThaba)
+        app.config = {'theme': 'blue_dark'}
+        app.setup_styles()
+        self.assertIs(app.colors, app.themes['blue_dark'])
+        app.config = {'theme': 'gone'}
+        app.setup_styles()
+        self.assertEqual(app.current_theme, 'enhanced_dark')
+
+
+if __name__ == "__main__":
+    unittest.main()
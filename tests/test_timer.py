@@ -0,0 +1,95 @@
+"""FocusTimer: a monotonic deadline that ignores wall-clock jumps."""
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marthaba  # noqa: E402
+
+WALL = 1800000000.0
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 5000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FocusTimerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.timer = marthaba.FocusTimer(self.clock)
+        self.wall = WALL
+        patcher = mock.patch.object(marthaba.time, 'time', lambda: self.wall)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def advance(self, seconds, wall=None):
+        self.clock.now += seconds
+        self.wall += seconds if wall is None else wall
+
+    def test_counts_down_from_the_wall_clock_anchor(self):
+        self.assertFalse(self.timer.running)
+        self.assertEqual(self.timer.remaining(), 0.0)
+        self.timer.start(WALL - 60, WALL + 3600)
+        self.assertTrue(self.timer.running)
+        self.assertEqual(self.timer.remaining(), 3600)
+        self.assertEqual(self.timer.elapsed(), 60)
+        self.advance(100)
+        self.assertEqual(self.timer.remaining(), 3500)
+        self.assertEqual(self.timer.elapsed(), 160)
+
+    def test_wall_clock_changes_do_not_shift_the_deadline(self):
+        self.timer.start(WALL, WALL + 600)
+        self.advance(10, wall=-7200)
+        self.assertEqual(self.timer.remaining(), 590)
+        self.advance(10, wall=86400)
+        self.assertEqual(self.timer.remaining(), 580)
+
+    def test_set_end_and_stop(self):
+        self.timer.start(WALL, WALL + 600)
+        self.timer.set_end(WALL + 60)
+        self.assertEqual(self.timer.remaining(), 60)
+        self.advance(120)
+        self.assertEqual(self.timer.remaining(), 0.0)
+        self.timer.stop()
+        self.assertFalse(self.timer.running)
+        self.assertEqual(self.timer.elapsed(), 0.0)
+
+    def test_ticks_land_on_whole_seconds(self):
+        self.timer.start(WALL, WALL + 10)
+        self.advance(0.25)
+        self.assertEqual(self.timer.next_tick_ms(), 751)
+        self.advance(0.75)
+        self.assertEqual(self.timer.next_tick_ms(), 1)
+
+    def test_texts(self):
+        self.timer.start(WALL - 3725, WALL + 3661.5)
+        self.assertEqual(self.timer.texts(), ("Elapsed: 01:02:05", "Remaining: 01:01:02", "⏳ 1h 1m 2s"))
+        self.timer.set_end(WALL + 90)
+        self.assertEqual(self.timer.texts()[2], "⏳ 1m 30s")
+        self.timer.set_end(WALL + 0.2)
+        self.assertEqual(self.timer.texts()[1:], ("Remaining: 00:00:01", "⏳ 1s"))
+        self.advance(1)
+        self.assertEqual(self.timer.texts()[2], "⏳ 0s")
+
+
+class LabelUpdateTest(unittest.TestCase):
+
+    def test_label_is_configured_only_on_change(self):
+        app = types.SimpleNamespace(label_texts={})
+        label = mock.Mock()
+        for text in ("1s", "1s", "0s", "0s"):
+            marthaba.AnimatedMarThaba.set_label_text(app, label, text)
+        self.assertEqual(label.config.call_args_list, [mock.call(text="1s"), mock.call(text="0s")])
+
+
+if __name__ == "__main__":
+    unittest.main()